@@ -0,0 +1,220 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+import liberty
+import stage_1
+from eco import EcoSession
+from graph_cache import CACHE_DIR, MAX_ENTRIES, load_graph
+
+# ==========================================
+# PARALLEL STAGE 1 BATCH RUNNER
+# ==========================================
+# Runs stage 1 selection for a manifest of (netlist, fault report,
+# parameter set) jobs on a process pool and collects one table of
+# selected nodes and scores.
+#
+#   python batch_runner.py sweep.json --workers 8 --out sweep.csv
+#
+# A manifest is a JSON list of job entries (or {"jobs": [...]}). Any
+# parameter may be a list; an entry expands to the cartesian product:
+#
+#   [{"netlist": "b10.v", "report": "b10.rpt",
+#     "elbow": [0.05, 0.10, 0.20], "budget": [5, 10], "scoring": ["distance", "cop"]}]
+#
+# Relative paths are taken from the manifest's directory.
+#
+# Designs are shared through the parsed-netlist cache: every netlist is
+# parsed once, in parallel, into the cache before any job runs, and
+# workers then load it with one read. Jobs that differ only in elbow and
+# budget form one task, so their cone scores are computed once (the
+# EcoSession keeps them) instead of once per parameter set.
+#
+# With --liberty the library is indexed once by the driver; every worker
+# then loads the cached index before its first job.
+
+PARAMS = OrderedDict([
+    ('elbow',     stage_1.ELBOW_THRESHOLD),
+    ('budget',    stage_1.MAX_AREA_BUDGET),
+    ('scoring',   stage_1.SCORING_MODE),
+    ('selection', stage_1.SELECTION_MODE),
+])
+TABLE_COLUMNS = ('job', 'netlist', 'report') + tuple(PARAMS) + ('rank', 'node', 'score', 'seconds', 'error')
+
+
+# ---------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------
+def expand_jobs(entries, base_dir="."):
+    """Flattens manifest entries into job dicts with every parameter set."""
+    jobs = []
+    for entry in entries:
+        unknown = set(entry) - set(PARAMS) - set(('netlist', 'report'))
+        if unknown:
+            raise ValueError("Unknown manifest keys: {}".format(", ".join(sorted(unknown))))
+        if 'netlist' not in entry or 'report' not in entry:
+            raise ValueError("Manifest entry needs 'netlist' and 'report': {}".format(entry))
+        values = []
+        for name, default in PARAMS.items():
+            value = entry.get(name, default)
+            values.append(value if isinstance(value, list) else [value])
+        for combo in itertools.product(*values):
+            job = OrderedDict()
+            job['job'] = len(jobs) + 1
+            job['netlist'] = os.path.join(base_dir, entry['netlist'])
+            job['report'] = os.path.join(base_dir, entry['report'])
+            job.update(zip(PARAMS, combo))
+            jobs.append(job)
+    return jobs
+
+
+def load_manifest(filename):
+    with open(filename) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('jobs', [])
+    return expand_jobs(data, os.path.dirname(os.path.abspath(filename)))
+
+
+def group_jobs(jobs):
+    """{(netlist, report, scoring, selection): [jobs]}; a group shares its cone scores."""
+    groups = OrderedDict()
+    for job in jobs:
+        key = (job['netlist'], job['report'], job['scoring'], job['selection'])
+        groups.setdefault(key, []).append(job)
+    return groups
+
+
+# ---------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------
+_designs = {}   # Per worker process: (netlist, report) -> (CircuitGraph, victims)
+
+
+def init_worker(liberty_file, cache_dir):
+    """Pool initializer: makes the driver's Liberty library active in this worker."""
+    if liberty_file:
+        with open(os.devnull, 'w') as sink, redirect_stdout(sink):
+            liberty.use_library(liberty_file, cache_dir)
+
+
+def warm_cache(netlist, cache_dir, max_entries=MAX_ENTRIES):
+    """Parses `netlist` into the shared cache (no-op on a hit)."""
+    graph = load_graph(netlist, cache_dir, max_entries)
+    return netlist, graph.num_insts, graph.cache_hit, graph.load_time
+
+
+def _design(netlist, report, cache_dir, max_entries):
+    key = (netlist, report)
+    if key not in _designs:
+        graph = load_graph(netlist, cache_dir, max_entries)
+        _designs[key] = (stage_1.CircuitGraph(graph, EcoSession(graph)), stage_1.parse_tetramax_failures(report))
+    return _designs[key]
+
+
+def run_group(jobs, cache_dir, max_entries=MAX_ENTRIES):
+    """Runs jobs of one group in order. Returns ([(job, selected, seconds, error)], log text)."""
+    results = []
+    log = io.StringIO()
+    with redirect_stdout(log):
+        for job in jobs:
+            start = time.time()
+            try:
+                circuit, victims = _design(job['netlist'], job['report'], cache_dir, max_entries)
+                if not victims:
+                    raise ValueError("no victims in {}".format(job['report']))
+                selected = stage_1.run_weighted_analysis(circuit, victims, job['elbow'], job['budget'],
+                                                         job['scoring'], job['selection'])
+                results.append((job, selected, time.time() - start, ""))
+            except Exception as e:
+                results.append((job, [], time.time() - start, "{}: {}".format(e.__class__.__name__, e)))
+    return results, log.getvalue()
+
+
+# ---------------------------------------------------------
+# Driver
+# ---------------------------------------------------------
+def run_batch(jobs, workers=None, cache_dir=CACHE_DIR, verbose=False, liberty_file=None):
+    """Runs all jobs on a process pool. Returns [(job, selected, seconds, error)] in job order."""
+    groups = group_jobs(jobs)
+    netlists = list(OrderedDict.fromkeys(job['netlist'] for job in jobs))
+    if liberty_file:
+        # Index once here so the workers only read the cache
+        liberty.use_library(liberty_file, cache_dir)
+    # Room for every design, so the warm phase never evicts what the jobs will read
+    max_entries = max(MAX_ENTRIES, len(netlists))
+    print("[*] Running {} jobs ({} groups, {} designs)...".format(len(jobs), len(groups), len(netlists)))
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(liberty_file, cache_dir)) as pool:
+        # 1. Parse every design once, in parallel, into the shared cache
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            warm = pool.map(warm_cache, netlists, [cache_dir] * len(netlists), [max_entries] * len(netlists))
+            for netlist, insts, hit, seconds in warm:
+                print("    - {}: {} instances ({}, {:.2f} s)".format(netlist, insts, "cache" if hit else "parsed", seconds))
+
+        # 2. Largest designs first so the long tasks do not start last
+        order = sorted(groups.values(), key=lambda g: os.path.getsize(g[0]['netlist']), reverse=True)
+        futures = [pool.submit(run_group, group, cache_dir, max_entries) for group in order]
+        for future in as_completed(futures):
+            group_results, log = future.result()
+            if verbose:
+                sys.stdout.write(log)
+            for job, selected, seconds, error in group_results:
+                print("    - Job {:3}: {} selected ({:.2f} s){}".format(
+                    job['job'], len(selected), seconds, "  ERROR " + error if error else ""))
+            results.extend(group_results)
+    results.sort(key=lambda r: r[0]['job'])
+    return results
+
+
+def write_table(results, filename):
+    """One CSV row per selected node (or one empty row for a job that selected nothing)."""
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(TABLE_COLUMNS)
+        for job, selected, seconds, error in results:
+            head = [job[k] for k in ('job', 'netlist', 'report')] + [job[p] for p in PARAMS]
+            tail = ["{:.3f}".format(seconds), error]
+            if not selected:
+                writer.writerow(head + ["", "", ""] + tail)
+            for rank, (node, score) in enumerate(selected, 1):
+                writer.writerow(head + [rank, node, "{:.4f}".format(score)] + tail)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run stage 1 over a manifest of designs and parameter sets.")
+    parser.add_argument("manifest", help="JSON job manifest")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--out", default="batch_results.csv", help="Result table (CSV)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Parsed-netlist cache shared by the workers")
+    parser.add_argument("--no-cache", action="store_true", help="Parse in every worker instead")
+    parser.add_argument("--liberty", default=liberty.LIBERTY_FILE, metavar="LIB",
+                        help="Liberty library for pin directions and cell functions")
+    parser.add_argument("--verbose", action="store_true", help="Print each job's stage 1 log")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    jobs = load_manifest(args.manifest)
+    start = time.time()
+    results = run_batch(jobs, args.workers, None if args.no_cache else args.cache_dir, args.verbose, args.liberty)
+    write_table(results, args.out)
+    failed = sum(1 for r in results if r[3])
+    print("[*] {} jobs finished in {:.2f} s ({} failed) -> {}".format(len(results), time.time() - start, failed, args.out))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
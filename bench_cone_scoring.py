@@ -0,0 +1,91 @@
+import argparse
+import random
+import sys
+import time
+from collections import defaultdict
+
+from compact_graph import CompactGraph
+from cone_scoring import score_victims
+
+# ==========================================
+# BENCHMARK: PER-VICTIM BFS vs BATCHED SWEEP
+# ==========================================
+# Usage:
+#   python bench_cone_scoring.py                      (synthetic design)
+#   python bench_cone_scoring.py netlist.v faults.rpt (real design)
+
+SYNTH_GATES   = 20000
+SYNTH_VICTIMS = 1000
+SYNTH_WINDOW  = 400     # Fanin picked from the last N nets -> reconvergence
+SYNTH_FF_RATE = 0.05
+
+
+def build_synthetic(num_gates, seed=1):
+    rng = random.Random(seed)
+    graph = CompactGraph()
+    nets = ["pi{}".format(i) for i in range(64)]
+    for i in range(num_gates):
+        out = "n{}".format(i)
+        if rng.random() < SYNTH_FF_RATE:
+            graph.add_instance("r{}_reg".format(i), "DFFX1_LVT",
+                               [('D', rng.choice(nets[-SYNTH_WINDOW:])), ('Q', out)])
+        else:
+            graph.add_instance("U{}".format(i), "NAND2X0_LVT",
+                               [('A1', rng.choice(nets[-SYNTH_WINDOW:])),
+                                ('A2', rng.choice(nets)), ('Y', out)])
+        nets.append(out)
+    graph.finalize()
+    return graph
+
+
+def per_victim_scores(graph, victims):
+    scores = defaultdict(float)
+    for v in victims:
+        for node, dist in graph.fanin_cone(v).items():
+            scores[node] += 1.0 / (1.0 + float(dist))
+    return scores
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Per-victim BFS vs batched sweep cone scoring.")
+    parser.add_argument("netlist", nargs="?", help="Real design (default: synthetic)")
+    parser.add_argument("report", nargs="?", help="TetraMAX fault report of the real design")
+    parser.add_argument("--gates", type=int, default=SYNTH_GATES, help="Synthetic design size")
+    parser.add_argument("--victims", type=int, default=SYNTH_VICTIMS, help="Synthetic victims")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.netlist:
+        if not args.report:
+            parser.error("a netlist needs its fault report")
+        from stage_1 import parse_tetramax_failures
+        graph = CompactGraph.from_netlist(args.netlist)
+        names = parse_tetramax_failures(args.report)
+        victims = [i for i in (graph.inst_index(n) for n in names) if i >= 0]
+    else:
+        graph = build_synthetic(args.gates)
+        victims = random.Random(2).sample(range(graph.num_insts), min(args.victims, graph.num_insts))
+    print("[*] {} instances, {} victims".format(graph.num_insts, len(victims)))
+
+    start = time.time()
+    reference = per_victim_scores(graph, victims)
+    t_ref = time.time() - start
+    print("    Per-victim BFS : {:8.3f} s".format(t_ref))
+
+    start = time.time()
+    batched = score_victims(graph, victims)
+    t_batch = time.time() - start
+    print("    Batched sweep  : {:8.3f} s".format(t_batch))
+
+    worst = max([abs(reference[n] - batched.get(n, 0.0)) for n in reference] + [0.0])
+    same = set(reference) == set(batched) and worst < 1e-9
+    print("    Speedup        : {:8.1f}x".format(t_ref / max(t_batch, 1e-9)))
+    print("    Scores match   : {} (max abs diff {:.2e})".format(same, worst))
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
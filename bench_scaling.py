@@ -0,0 +1,259 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+try:
+    import resource
+except ImportError:     # Windows: no peak RSS
+    resource = None
+
+import stage_1
+import stage_2
+import stage_3
+import synth_netlist
+from compact_graph import CompactGraph
+from graph_cache import load_graph
+
+# ==========================================
+# BENCHMARK: STAGE SCALING ON SYNTHETIC NETLISTS
+# ==========================================
+# Times and memory-profiles every stage on synth_netlist.py designs of
+# growing size and stores the results as JSON:
+#
+#   python bench_scaling.py --scales 10000,100000,1000000 --out bench.json
+#   python bench_scaling.py --scales 10000,100000 --compare bench.json
+#
+# Each scale runs in a fresh interpreter, so peak RSS belongs to that
+# scale alone. Per stage the harness records wall time, peak RSS after
+# the stage and, with --tracemalloc, the peak of Python allocations made
+# during it (tracing slows every stage down, so it is off by default).
+# --repeat keeps the fastest of several runs per stage, which matters for
+# the millisecond stages of small designs. --compare exits with 1 if any
+# stage got slower than --tolerance times the baseline; stages shorter
+# than --min-seconds in both runs are timer noise and never flagged.
+
+SCALES      = (10000, 100000, 1000000)
+CONE_SAMPLE = 200     # Victims traced one by one through get_full_fanin_cone
+TOLERANCE   = 1.25
+MIN_SECONDS = 0.1     # Stages below this in both runs are not compared
+WORK_DIR    = ".bench"
+
+STAGES = ("parse_netlist", "cache_save", "cache_load", "parse_report", "fanin_cone",
+          "weighted_analysis", "find_traps", "generate_xor_tcl")
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+class StageTimer:
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = {}
+
+    def run(self, name, func, *args):
+        gc.collect()
+        if self.trace:
+            tracemalloc.start()
+        start = time.time()
+        with open(os.devnull, 'w') as sink, redirect_stdout(sink):
+            result = func(*args)
+        entry = {'seconds': round(time.time() - start, 4), 'rss_peak_mb': _rss_mb()}
+        if self.trace:
+            entry['alloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0), 2)
+            tracemalloc.stop()
+        self.stages[name] = entry
+        return result
+
+
+# ---------------------------------------------------------
+# One scale (runs in a child interpreter)
+# ---------------------------------------------------------
+def design_paths(work_dir, instances, seed):
+    base = os.path.join(work_dir, "synth_{}_s{}".format(instances, seed))
+    return base + ".v", base + ".rpt"
+
+
+def bench_scale(netlist, report, trace=False):
+    timer = StageTimer(trace)
+    cache_dir = tempfile.mkdtemp(prefix="bench_cache_")
+
+    graph = timer.run("parse_netlist", CompactGraph.from_netlist, netlist)
+    # Cold cache: parse + save; warm cache: one read
+    timer.run("cache_save", load_graph, netlist, cache_dir)
+    graph = timer.run("cache_load", load_graph, netlist, cache_dir)
+    circuit = stage_1.CircuitGraph(graph)
+    victims = timer.run("parse_report", stage_1.parse_tetramax_failures, report)
+
+    sample = random.Random(0).sample(victims, min(CONE_SAMPLE, len(victims)))
+    timer.run("fanin_cone", lambda: [circuit.get_full_fanin_cone(v) for v in sample])
+    selected = timer.run("weighted_analysis", stage_1.run_weighted_analysis, circuit, victims)
+
+    analyzer = stage_2.CircuitAnalyzer(graph)
+    with open(os.devnull, 'w') as sink, redirect_stdout(sink):
+        analyzer.parse_failures(report)
+    fixes = timer.run("find_traps", stage_2.find_traps, analyzer)
+
+    observer = stage_3.CircuitAnalyzer(graph)
+    observer.faults = [f['inst'] for f in analyzer.faults]
+    tcl = os.path.join(cache_dir, "xor.tcl")
+    timer.run("generate_xor_tcl", stage_3.generate_xor_tcl, observer, tcl)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        'instances': graph.num_insts,
+        'victims': len(victims),
+        'faults': len(analyzer.faults),
+        'selected': len(selected),
+        'fixes': len(fixes),
+        'netlist_mb': round(os.path.getsize(netlist) / (1024.0 * 1024.0), 2),
+        'stages': timer.stages,
+    }
+
+
+# ---------------------------------------------------------
+# Driver
+# ---------------------------------------------------------
+def _merge_runs(runs):
+    """Fastest time and largest memory figures per stage over repeated runs."""
+    merged = runs[0]
+    for run in runs[1:]:
+        for name, stage in run['stages'].items():
+            best = merged['stages'][name]
+            for key, value in stage.items():
+                if value is not None and best.get(key) is not None:
+                    best[key] = min(best[key], value) if key == 'seconds' else max(best[key], value)
+    merged['repeat'] = len(runs)
+    return merged
+
+
+def run_scales(scales, work_dir, seed, trace, ff_rate, reconvergence, repeat=1):
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    results = []
+    for instances in scales:
+        netlist, report = design_paths(work_dir, instances, seed)
+        if not os.path.exists(netlist) or not os.path.exists(report):
+            print("[*] Generating {} instances...".format(instances))
+            start = time.time()
+            synth_netlist.generate(netlist, report, instances, ff_rate, reconvergence, seed=seed)
+            print("    - {:.1f} s".format(time.time() - start))
+        print("[*] Benchmarking {} instances...".format(instances))
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", netlist, report]
+        if trace:
+            cmd.append("--tracemalloc")
+        runs = []
+        for _ in range(max(1, repeat)):
+            out = subprocess.check_output(cmd).decode('utf-8')
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        result = _merge_runs(runs)
+        results.append(result)
+        for name in STAGES:
+            stage = result['stages'][name]
+            print("    {:18} {:9.3f} s  {:8.1f} MB".format(name, stage['seconds'], stage['rss_peak_mb'] or 0.0))
+    return results
+
+
+def compare(results, current_meta, baseline, tolerance, min_seconds=MIN_SECONDS):
+    """Prints time ratios against a baseline run; returns the regressed (instances, stage) pairs."""
+    base = dict((r['instances'], r) for r in baseline['results'])
+    regressions = []
+    print("[*] Comparing against baseline (tolerance {:.2f}x)...".format(tolerance))
+    if baseline['meta'].get('tracemalloc') != current_meta.get('tracemalloc'):
+        print("WARNING: baseline and this run differ in --tracemalloc; timings are not comparable.")
+    for result in results:
+        old = base.get(result['instances'])
+        if old is None:
+            continue
+        for name in STAGES:
+            if name not in old['stages']:
+                continue
+            before = old['stages'][name]['seconds']
+            after = result['stages'][name]['seconds']
+            ratio = after / before if before > 0 else 1.0
+            flag = ""
+            if max(before, after) < min_seconds:
+                flag = "  (too short)"
+            elif ratio > tolerance:
+                flag = "  <-- REGRESSION"
+                regressions.append((result['instances'], name))
+            print("    {:8} {:18} {:9.3f} -> {:9.3f} s ({:5.2f}x){}".format(
+                result['instances'], name, before, after, ratio, flag))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Stage scaling benchmark on synthetic netlists.")
+    parser.add_argument("--scales", default=",".join(str(s) for s in SCALES),
+                        help="Comma-separated instance counts (default: {})".format(",".join(str(s) for s in SCALES)))
+    parser.add_argument("--out", default="bench_scaling.json", help="JSON results")
+    parser.add_argument("--compare", default=None, metavar="BASELINE", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed slowdown ratio")
+    parser.add_argument("--min-seconds", type=float, default=MIN_SECONDS,
+                        help="Stages shorter than this in both runs are not flagged (default: {})".format(MIN_SECONDS))
+    parser.add_argument("--work-dir", default=WORK_DIR, help="Where generated designs are kept")
+    parser.add_argument("--seed", type=int, default=synth_netlist.SEED)
+    parser.add_argument("--ff-rate", type=float, default=synth_netlist.FF_RATE)
+    parser.add_argument("--reconvergence", type=float, default=synth_netlist.RECONVERGENCE)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scale; the fastest time per stage is kept")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also record per-stage Python allocation peaks")
+    parser.add_argument("--child", nargs=2, metavar=("NETLIST", "REPORT"), help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        print(json.dumps(bench_scale(args.child[0], args.child[1], args.tracemalloc)))
+        return 0
+
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    baseline = None
+    if args.compare:
+        # Read first: --out may name the same file
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results = run_scales(scales, args.work_dir, args.seed, args.tracemalloc, args.ff_rate, args.reconvergence,
+                          args.repeat)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'seed': args.seed,
+            'ff_rate': args.ff_rate,
+            'reconvergence': args.reconvergence,
+            'tracemalloc': args.tracemalloc,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print("[*] Results written to {}".format(args.out))
+
+    if baseline is not None:
+        regressions = compare(results, report['meta'], baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print("[*] {} stage(s) regressed.".format(len(regressions)))
+            return 1
+        print("[*] No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+import re
+from collections import namedtuple
+
+# ==========================================
+# CELL FUNCTIONS FROM SAED-STYLE CELL NAMES
+# ==========================================
+# Maps a library cell name (AND2X1_LVT, AOI221X1_RVT, MUX21X2, DFFARX1...)
+# to its logic function. Every function is written over machine words:
+# each argument is an int holding one bit per pattern and `mask` has a 1
+# for every pattern slot, so one call evaluates many patterns at once.
+# The same callables give truth tables (for COP) by evaluating them on
+# the 2**n input combinations packed into one word.
+
+CellFunction = namedtuple('CellFunction', 'name inputs output evaluate')
+
+NAME_PATTERN = re.compile(r'^(AOI|OAI|AO|OA|NAND|NOR|XNOR|XOR|AND|OR|MUX|INV|IBUFF|NBUFF|BUFF|DELLN|TIEH|TIEL)(\d*)X\d', re.I)
+
+SEQUENTIAL_DATA_PINS = ('D', 'SI', 'SE')   # Observed/captured in full scan
+CONTROL_PINS = ('CLK', 'CK', 'RSTB', 'SETB', 'EN', 'ENB')
+
+
+def _and(words, mask):
+    out = mask
+    for w in words:
+        out &= w
+    return out
+
+
+def _or(words, mask):
+    out = 0
+    for w in words:
+        out |= w
+    return out
+
+
+def _xor(words, mask):
+    out = 0
+    for w in words:
+        out ^= w
+    return out
+
+
+def _groups(digits, n_groups_default):
+    return [int(d) for d in digits] if digits else n_groups_default
+
+
+def _and_or(groups, inner, outer, invert):
+    """AO/OA/AOI/OAI: outer(inner(A1..Ak), inner(...), ...)."""
+    def evaluate(words, mask):
+        terms = []
+        i = 0
+        for size in groups:
+            terms.append(inner(words[i:i + size], mask))
+            i += size
+        out = outer(terms, mask)
+        return out ^ mask if invert else out
+    return evaluate
+
+
+def _mux(select_bits):
+    def evaluate(words, mask):
+        data, sel = words[:1 << select_bits], words[1 << select_bits:]
+        out = 0
+        for k, d in enumerate(data):
+            term = d
+            for b, s in enumerate(sel):
+                term &= s if (k >> b) & 1 else s ^ mask
+            out |= term
+        return out
+    return evaluate
+
+
+def _inputs(n):
+    return tuple("A{}".format(i + 1) for i in range(n))
+
+
+def cell_function(cell_type):
+    """CellFunction for a combinational cell name, or None if unknown."""
+    cell = library_cell(cell_type)
+    if cell is not None and cell.function is not None:
+        return cell.function
+    m = NAME_PATTERN.match(cell_type)
+    if not m:
+        return None
+    kind, digits = m.group(1).upper(), m.group(2)
+
+    if kind in ('INV', 'IBUFF'):
+        return CellFunction(kind, ('A',), 'Y', lambda w, mask: w[0] ^ mask)
+    if kind in ('NBUFF', 'BUFF', 'DELLN'):
+        return CellFunction(kind, ('A',), 'Y', lambda w, mask: w[0])
+    if kind == 'TIEH':
+        return CellFunction(kind, (), 'Y', lambda w, mask: mask)
+    if kind == 'TIEL':
+        return CellFunction(kind, (), 'Y', lambda w, mask: 0)
+
+    if kind in ('AND', 'NAND', 'OR', 'NOR', 'XOR', 'XNOR'):
+        n = int(digits or 2)
+        base = {'AND': _and, 'NAND': _and, 'OR': _or, 'NOR': _or, 'XOR': _xor, 'XNOR': _xor}[kind]
+        if kind in ('NAND', 'NOR', 'XNOR'):
+            return CellFunction(kind + str(n), _inputs(n), 'Y', lambda w, mask, f=base: f(w, mask) ^ mask)
+        return CellFunction(kind + str(n), _inputs(n), 'Y', base)
+
+    if kind in ('AO', 'OA', 'AOI', 'OAI'):
+        groups = _groups(digits, [2, 1])
+        inner, outer = (_and, _or) if kind.startswith('AO') else (_or, _and)
+        return CellFunction(kind + digits, _inputs(sum(groups)), 'Y',
+                            _and_or(groups, inner, outer, kind.endswith('I')))
+
+    if kind == 'MUX':
+        # MUX21: A1, A2, S0 -> Y = S0 ? A2 : A1 ; MUX41: A1..A4, S0, S1
+        ways = int(digits[0]) if digits else 2
+        select_bits = {2: 1, 4: 2}.get(ways)
+        if select_bits is None:
+            return None
+        pins = _inputs(ways) + tuple("S{}".format(i) for i in range(select_bits))
+        return CellFunction("MUX{}1".format(ways), pins, 'Y', _mux(select_bits))
+    return None
+
+
+def truth_table(function):
+    """
+    Output column of `function` over all 2**n input combinations, as an
+    int whose bit k is the output for the assignment with input i = bit i of k.
+    """
+    n = len(function.inputs)
+    rows = 1 << n
+    mask = (1 << rows) - 1
+    words = []
+    for i in range(n):
+        w = 0
+        for k in range(rows):
+            if (k >> i) & 1:
+                w |= 1 << k
+        words.append(w)
+    return function.evaluate(words, mask) & mask
+
+
+def pin_sensitivity(function, pin):
+    """
+    Share of input assignments on which flipping `pin` flips the output,
+    i.e. the probability a value change on `pin` passes the cell under
+    random side inputs (AND2: 0.5, XOR2/INV: 1.0). 0.0 for a foreign pin.
+    """
+    if pin not in function.inputs:
+        return 0.0
+    bit = function.inputs.index(pin)
+    rows = 1 << len(function.inputs)
+    table = truth_table(function)
+    flips = 0
+    for k in range(rows):
+        if (table >> k) & 1 != (table >> (k ^ (1 << bit))) & 1:
+            flips += 1
+    return flips / float(rows)
+
+
+# ==========================================
+# LIBERTY FUNCTIONS AND THE ACTIVE LIBRARY
+# ==========================================
+# liberty.py indexes a .lib file into LibertyCell records. Once a library
+# is active (set_library), its pin directions, sequential flags and
+# boolean functions take precedence over the cell-name rules above and
+# the pin-name lists in compact_graph; cells missing from the library
+# still fall back to them.
+
+LIBRARY = None
+
+# Liberty operator precedence, highest first: ' and !, ^, & * (and plain
+# juxtaposition), | +
+EXPR_TOKEN = re.compile(r"[A-Za-z_][\w.\[\]]*|[01]|[!'&*|+^()]")
+
+
+def set_library(library):
+    """Makes `library` (a liberty.Library, or None) the one every parser consults."""
+    global LIBRARY
+    LIBRARY = library
+
+
+def library_cell(cell_type):
+    """LibertyCell of `cell_type` in the active library, or None."""
+    if LIBRARY is None:
+        return None
+    return LIBRARY.get(cell_type)
+
+
+def output_pins(cell_type):
+    """Output pins of a library cell in declaration order, or None if the cell is unknown."""
+    cell = library_cell(cell_type)
+    if cell is None:
+        return None
+    return [pin for pin, direction in cell.pins if direction == 'output']
+
+
+def _word_not(a):
+    return lambda w, mask: a(w, mask) ^ mask
+
+
+def _word_fold(terms, base):
+    def evaluate(w, mask):
+        return base([t(w, mask) for t in terms], mask)
+    return evaluate
+
+
+class _ExprParser:
+    def __init__(self, text, variables):
+        self.tokens = EXPR_TOKEN.findall(text)
+        self.pos = 0
+        self.variables = variables   # pin -> word index, grown as pins are seen
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError("Unexpected '{}' in function".format(self.peek()))
+        return node
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek() in ('|', '+'):
+            self.take()
+            terms.append(self.parse_and())
+        return terms[0] if len(terms) == 1 else _word_fold(terms, _or)
+
+    def parse_and(self):
+        terms = [self.parse_xor()]
+        while True:
+            tok = self.peek()
+            if tok in ('&', '*'):
+                self.take()
+            elif tok is None or tok in ('|', '+', ')', '^', "'"):
+                break
+            terms.append(self.parse_xor())
+        return terms[0] if len(terms) == 1 else _word_fold(terms, _and)
+
+    def parse_xor(self):
+        terms = [self.parse_unary()]
+        while self.peek() == '^':
+            self.take()
+            terms.append(self.parse_unary())
+        return terms[0] if len(terms) == 1 else _word_fold(terms, _xor)
+
+    def parse_unary(self):
+        tok = self.take()
+        if tok == '!':
+            node = _word_not(self.parse_unary())
+        elif tok == '(':
+            node = self.parse_or()
+            if self.take() != ')':
+                raise ValueError("Missing ')' in function")
+        elif tok == '0':
+            node = lambda w, mask: 0
+        elif tok == '1':
+            node = lambda w, mask: mask
+        elif tok is None or not (tok[0].isalpha() or tok[0] == '_'):
+            raise ValueError("Unexpected '{}' in function".format(tok))
+        else:
+            index = self.variables.setdefault(tok, len(self.variables))
+            node = lambda w, mask, i=index: w[i]
+        while self.peek() == "'":
+            self.take()
+            node = _word_not(node)
+        return node
+
+
+def expression_function(name, expression, output, pin_order=()):
+    """
+    CellFunction for a Liberty `function` string such as "!(A1&A2)" or
+    "(A1 S0') + (A2 S0)". Inputs are the referenced pins, in `pin_order`
+    first and then in order of appearance. Raises ValueError on syntax errors.
+    """
+    variables = {}
+    root = _ExprParser(expression, variables).parse()
+    inputs = [p for p in pin_order if p in variables]
+    inputs += [p for p in sorted(variables, key=variables.get) if p not in inputs]
+    # Re-index words from parse order to `inputs` order
+    order = [variables[p] for p in inputs]
+    slots = [0] * len(order)
+    for position, index in enumerate(order):
+        slots[index] = position
+
+    def evaluate(words, mask):
+        return root([words[slots[i]] for i in range(len(slots))], mask) & mask
+    return CellFunction(name, tuple(inputs), output, evaluate)
@@ -0,0 +1,139 @@
+import sys
+
+import stage_2
+from cell_library import cell_function, truth_table
+from compact_graph import CompactGraph
+from stage_3 import FanoutIndex
+
+# ==========================================
+# REGRESSION CHECKS: STAGE 2 PLANS, STAGE 3 REACH
+# ==========================================
+# Table-driven checks of two analyses whose wrong answers do not fail
+# anywhere else -- the TCL is written either way:
+#
+#   gate plans : a forced side input must unblock the gate, never tie its
+#                output to a constant in test mode (AND2 Y/sa1 -> no fix)
+#   reach      : a shorter but weaker path is still expanded when a
+#                longer, stronger one hits the distance limit first
+#
+#   python check_logic.py       (exit 1 on any failure)
+
+# (cell, pins, fault signature, expected [(side pin, action)])
+PLAN_CASES = [
+    ("AND2X1_LVT",  ("A1", "A2", "Y"),             (("A1", "sa0"),),               [("A2", "FORCE_1")]),
+    ("AND2X1_LVT",  ("A1", "A2", "Y"),             (("Y", "sa1"),),                []),
+    ("AND2X1_LVT",  ("A1", "A2", "Y"),             (("A1", "sa0"), ("Y", "sa1")),  [("A2", "FORCE_1")]),
+    ("OR2X1_LVT",   ("A1", "A2", "Y"),             (("A2", "sa1"),),               [("A1", "FORCE_0")]),
+    ("OR2X1_LVT",   ("A1", "A2", "Y"),             (("Y", "sa0"),),                []),
+    ("NAND3X0_LVT", ("A1", "A2", "A3", "Y"),       (("A3", "sa0"),),               [("A1", "FORCE_1")]),
+    ("NAND3X0_LVT", ("A1", "A2", "A3", "Y"),       (("Y", "sa0"),),                []),
+    ("AO21X1_LVT",  ("A1", "A2", "A3", "Y"),       (("A1", "sa0"),),               [("A2", "FORCE_1")]),
+    ("AO21X1_LVT",  ("A1", "A2", "A3", "Y"),       (("A3", "sa1"),),               [("A1", "FORCE_0")]),
+    ("OAI22X1_LVT", ("A1", "A2", "A3", "A4", "Y"), (("A3", "sa0"),),               [("A4", "FORCE_0")]),
+    ("MUX21X1_LVT", ("A1", "A2", "S0", "Y"),       (("A1", "sa0"),),               [("S0", "FORCE_0")]),
+    ("MUX21X1_LVT", ("A1", "A2", "S0", "Y"),       (("A2", "sa1"),),               [("S0", "FORCE_1")]),
+    ("XOR2X1_LVT",  ("A1", "A2", "Y"),             (("A1", "sa0"),),               []),
+]
+FAULT_TYPES = ("sa0", "sa1")
+
+
+def _forced_rows(function, plan):
+    """Truth-table rows left once the plan's side inputs are forced."""
+    n = len(function.inputs)
+    rows = (1 << (1 << n)) - 1
+    for pin, action, _ in plan:
+        rows &= stage_2._pin_rows(n, function.inputs.index(pin), 1 if action == "FORCE_1" else 0)
+    return rows
+
+
+def plan_problems(cell, pins, signature):
+    """Why the plan for `signature` would block the gate, or []."""
+    function = cell_function(cell)
+    plan = stage_2.gate_plan(cell, pins, signature)
+    tt = truth_table(function)
+    n = len(function.inputs)
+    rows = _forced_rows(function, plan)
+    problems = []
+    if plan and (tt & rows) in (0, rows):
+        problems.append("output constant under {}".format(plan))
+    for pin, ftype in signature:
+        idx = function.inputs.index(pin) if pin in function.inputs else -1
+        faulty = stage_2._fault_rows(tt, n, idx, stage_2.STUCK_VALUES[ftype])
+        if faulty and not faulty & rows:
+            problems.append("{}/{} undetectable under {}".format(pin, ftype, plan))
+    return problems
+
+
+def check_plans():
+    failures = 0
+    for cell, pins, signature, expected in PLAN_CASES:
+        got = [(pin, action) for pin, action, _ in stage_2.gate_plan(cell, pins, signature)]
+        if got != expected:
+            print("    FAIL plan {} {}: {} (expected {})".format(cell, signature, got, expected))
+            failures += 1
+    # Whatever the table says, no single fault may get a blocking plan
+    for cell, pins in sorted(set((case[0], case[1]) for case in PLAN_CASES)):
+        for pin in pins:
+            for ftype in FAULT_TYPES:
+                for problem in plan_problems(cell, pins, ((pin, ftype),)):
+                    print("    FAIL plan {} {}/{}: {}".format(cell, pin, ftype, problem))
+                    failures += 1
+    return failures
+
+
+# ---------------------------------------------------------
+# Stage 3 reach
+# ---------------------------------------------------------
+# (name, [(instance, cell, [(pin, net)])], start, max distance,
+#  min propagation, expected {instance: estimate})
+#
+# "detour": S reaches X directly through an AND2 side (0.5, 2 gates) and
+# through two inverters (1.0, 3 gates). The stronger path arrives at the
+# distance limit, so only the weaker one reaches Z behind X.
+REACH_CASES = [
+    ("detour",
+     [("S",  "INVX1_LVT",  [("A", "pi0"), ("Y", "s")]),
+      ("A",  "AND2X1_LVT", [("A1", "s"), ("A2", "pi1"), ("Y", "a")]),
+      ("I1", "INVX1_LVT",  [("A", "s"), ("Y", "i1")]),
+      ("I2", "INVX1_LVT",  [("A", "i1"), ("Y", "i2")]),
+      ("X",  "XOR2X1_LVT", [("A1", "a"), ("A2", "i2"), ("Y", "x")]),
+      ("Z",  "INVX1_LVT",  [("A", "x"), ("Y", "z")])],
+     "S", 3, 0.25, {"A": 0.5, "I1": 1.0, "I2": 1.0, "X": 1.0, "Z": 0.5}),
+    ("threshold",
+     [("S",  "INVX1_LVT",  [("A", "pi0"), ("Y", "s")]),
+      ("A",  "AND2X1_LVT", [("A1", "s"), ("A2", "pi1"), ("Y", "a")]),
+      ("B",  "AND2X1_LVT", [("A1", "a"), ("A2", "pi2"), ("Y", "b")]),
+      ("R",  "DFFX1_LVT",  [("D", "s"), ("Q", "r")])],
+     "S", 3, 0.5, {"A": 0.5}),
+]
+
+
+def build_graph(cells):
+    graph = CompactGraph()
+    for name, cell, pins in cells:
+        graph.add_instance(name, cell, pins)
+    graph.finalize()
+    return graph
+
+
+def check_reach():
+    failures = 0
+    for name, cells, start, max_distance, min_propagation, expected in REACH_CASES:
+        graph = build_graph(cells)
+        reach = FanoutIndex(graph, max_distance, min_propagation).reach(graph.inst_index(start))
+        got = dict((graph.inst_name(i), round(p, 9)) for i, p in reach.items())
+        if got != expected:
+            print("    FAIL reach {}: {} (expected {})".format(name, sorted(got.items()), sorted(expected.items())))
+            failures += 1
+    return failures
+
+
+def main():
+    print("[*] Checking Stage 2 gate plans and Stage 3 reach...")
+    failures = check_plans() + check_reach()
+    print("    - {} plan cases, {} reach cases, {} failures.".format(len(PLAN_CASES), len(REACH_CASES), failures))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import sys
+import time
+from collections import namedtuple
+
+import stage_1
+from fault_report import RPR_CLASSES, read_fault_report
+from fault_sim import NUM_PATTERNS
+from graph_cache import CACHE_DIR
+
+# ==========================================
+# CLOSED-LOOP ORCHESTRATION
+# ==========================================
+# Runs the Stage 1 loop of the README -- tmax profile -> selection ->
+# dc_shell insertion -- for several iterations and designs without
+# manual steps:
+#
+#   profile : tmax (or the local stand-in) lists the RPR faults of the
+#             current netlist
+#   select  : tpi_pipeline.py --stages 1 picks the points, writes the
+#             TCL and, with --write-netlist, the netlist they produce
+#   insert  : dc_shell (or the local stand-in) sources the TCL into the
+#             signoff netlist of the previous iteration
+#
+# Every step is a subprocess started from one asyncio event loop, with
+# a concurrency limit per tool kind (tmax and dc_shell licenses, CPU
+# cores for the Python steps). Iteration N+1 profiles and selects on the
+# ECO netlist of iteration N while dc_shell is still inserting
+# iteration N, so the dc_shell runs form their own chain behind the
+# analysis; --strict waits for dc_shell and profiles its output instead.
+#
+# Step outputs are cached in <cache-dir>/steps/ under a hash of the
+# step, its parameters, the tool commands and the contents of its input
+# files, so a rerun skips every step whose inputs did not change.
+#
+#   python closed_loop.py b10.v b15.v --iterations 3 --tools local --work-dir loop/
+
+STEP_FORMAT  = 1
+ITERATIONS   = 3
+TOOLS        = "synopsys"       # "synopsys" | "local"
+TMAX_JOBS    = 1                # Concurrent tmax runs (licenses)
+DC_JOBS      = 1                # Concurrent dc_shell runs (licenses)
+PYTHON_JOBS  = os.cpu_count() or 1
+WORK_DIR     = "closed_loop"
+HERE         = os.path.dirname(os.path.abspath(__file__))
+
+# Synopsys commands and scripts; adjust the library settings to the site flow
+TMAX_COMMAND   = "tmax -shell -f {script}"
+DC_COMMAND     = "dc_shell -f {script}"
+SEARCH_PATH    = "."
+TARGET_LIBRARY = "saed32nm_lvt.db"
+TMAX_LIBRARY   = "saed32nm_lvt.v"
+
+TMAX_SCRIPT = """read_netlist -library {library}
+read_netlist {netlist}
+run_build_model {top}
+run_drc
+add_faults -all
+set_random_patterns -length {patterns}
+run_fault_sim -random
+write_faults {report} -all -uncollapsed -replace
+exit
+"""
+
+DC_SCRIPT = """set search_path    [list . {search_path}]
+set target_library [list {library}]
+set link_library   [list * {library}]
+read_file -format verilog {netlist}
+current_design {top}
+link
+source -echo -verbose {tcl}
+compile_ultra -incremental
+check_design
+write_file -format verilog -hierarchy -output {output}
+exit
+"""
+
+Step = namedtuple('Step', 'name kind argv inputs outputs params')
+
+
+class StepError(Exception):
+    pass
+
+
+def file_hash(filename, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_tag():
+    """Size/mtime of this package's sources: cached Python steps expire when the code changes."""
+    tag = []
+    for name in sorted(os.listdir(HERE)):
+        if name.endswith('.py'):
+            stat = os.stat(os.path.join(HERE, name))
+            tag.append([name, stat.st_size, int(stat.st_mtime)])
+    return tag
+
+
+# ---------------------------------------------------------
+# Tool backends
+# ---------------------------------------------------------
+class SynopsysTools:
+    """tmax and dc_shell, each driven by a generated script."""
+    name = "synopsys"
+
+    def signature(self):
+        return [TMAX_COMMAND, DC_COMMAND, TMAX_SCRIPT, DC_SCRIPT, SEARCH_PATH, TARGET_LIBRARY, TMAX_LIBRARY]
+
+    def _script(self, path, template, **fields):
+        with open(path, 'w') as f:
+            f.write(template.format(**fields))
+        return path
+
+    def profile(self, netlist, report, work_dir, top, patterns):
+        script = self._script(os.path.join(work_dir, "profile.tcl"), TMAX_SCRIPT, library=TMAX_LIBRARY,
+                              netlist=netlist, top=top, patterns=patterns, report=report)
+        return shlex.split(TMAX_COMMAND.format(script=script))
+
+    def insert(self, netlist, tcl, output, work_dir, top):
+        script = self._script(os.path.join(work_dir, "insert.tcl"), DC_SCRIPT, search_path=SEARCH_PATH,
+                              library=TARGET_LIBRARY, netlist=netlist, top=top, tcl=tcl, output=output)
+        return shlex.split(DC_COMMAND.format(script=script))
+
+
+class LocalTools:
+    """fault_sim.py and the TCL applier of local_tools.py: the loop runs offline."""
+    name = "local"
+
+    def signature(self):
+        return code_tag()
+
+    def profile(self, netlist, report, work_dir, top, patterns):
+        return [sys.executable, os.path.join(HERE, "local_tools.py"), "profile", netlist, report, str(patterns)]
+
+    def insert(self, netlist, tcl, output, work_dir, top):
+        return [sys.executable, os.path.join(HERE, "local_tools.py"), "insert", netlist, tcl, "-o", output]
+
+
+TOOLSETS = {'synopsys': SynopsysTools, 'local': LocalTools}
+
+
+# ---------------------------------------------------------
+# Step cache
+# ---------------------------------------------------------
+class StepCache:
+    """Outputs of finished steps, keyed by the step and the contents of its inputs."""
+    def __init__(self, cache_dir):
+        self.root = os.path.join(cache_dir, "steps") if cache_dir else None
+
+    def key(self, step, signature, input_hashes):
+        outputs = [os.path.basename(p) for p in step.outputs]
+        blob = json.dumps([STEP_FORMAT, step.name, step.kind, signature, sorted(step.params.items()),
+                           input_hashes, outputs], sort_keys=True)
+        return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+    def restore(self, key, outputs):
+        if self.root is None:
+            return False
+        entry = os.path.join(self.root, key)
+        if not os.path.exists(os.path.join(entry, "manifest.json")):
+            return False
+        for i, path in enumerate(outputs):
+            shutil.copyfile(os.path.join(entry, str(i)), path)
+        return True
+
+    def store(self, key, outputs, seconds):
+        if self.root is None:
+            return
+        entry = os.path.join(self.root, key)
+        if not os.path.isdir(entry):
+            os.makedirs(entry)
+        for i, path in enumerate(outputs):
+            shutil.copyfile(path, os.path.join(entry, str(i)))
+        # Written last: an entry without a manifest is incomplete
+        with open(os.path.join(entry, "manifest.json"), 'w') as f:
+            json.dump({'outputs': [os.path.basename(p) for p in outputs], 'seconds': round(seconds, 3)}, f)
+
+
+# ---------------------------------------------------------
+# Orchestrator
+# ---------------------------------------------------------
+class ClosedLoop:
+    def __init__(self, tools, work_dir=WORK_DIR, cache_dir=CACHE_DIR, iterations=ITERATIONS, strict=False,
+                 tmax_jobs=TMAX_JOBS, dc_jobs=DC_JOBS, python_jobs=PYTHON_JOBS, patterns=NUM_PATTERNS,
+                 select_args=None, liberty_file=None):
+        self.tools = tools
+        self.work_dir = work_dir
+        self.cache_dir = cache_dir
+        self.cache = StepCache(cache_dir)
+        self.iterations = iterations
+        self.strict = strict
+        self.limits = {'tmax': tmax_jobs, 'dc': dc_jobs, 'python': python_jobs}
+        self.patterns = patterns
+        self.select_args = select_args or {}    # tpi_pipeline options: {'elbow': 0.1, ...}
+        self.liberty_file = liberty_file
+        self.signature = tools.signature()
+        self.code = code_tag()
+        self.stats = {'run': 0, 'cached': 0}
+        self.results = {}                       # {design: [iteration rows]}
+
+    # ---------------------------------------------------------
+    # Steps
+    # ---------------------------------------------------------
+    async def run_step(self, label, step):
+        loop = asyncio.get_event_loop()
+        hashes = []
+        for path in step.inputs:
+            hashes.append(await loop.run_in_executor(None, file_hash, path))
+        signature = self.code if step.kind == 'python' else self.signature
+        key = self.cache.key(step, signature, hashes)
+        if self.cache.restore(key, step.outputs):
+            self.stats['cached'] += 1
+            print("    - {} {}: cached".format(label, step.name))
+            return
+
+        log = os.path.splitext(step.outputs[0])[0] + ".log"
+        async with self.semaphores[step.kind]:
+            print("    - {} {}: started".format(label, step.name))
+            start = time.time()
+            with open(log, 'w') as f:
+                proc = await asyncio.create_subprocess_exec(*step.argv, stdout=f, stderr=asyncio.subprocess.STDOUT)
+                code = await proc.wait()
+            elapsed = time.time() - start
+        missing = [p for p in step.outputs if not os.path.exists(p)]
+        if code != 0 or missing:
+            raise StepError("{} {} failed (exit {}, see {})".format(label, step.name, code, log))
+        self.cache.store(key, step.outputs, elapsed)
+        self.stats['run'] += 1
+        print("    - {} {}: done in {:.1f} s".format(label, step.name, elapsed))
+
+    def profile_step(self, netlist, work_dir, top):
+        report = os.path.join(work_dir, "profile.rpt")
+        argv = self.tools.profile(netlist, report, work_dir, top, self.patterns)
+        return Step("profile", 'tmax' if self.tools.name == "synopsys" else 'python', argv, [netlist], [report],
+                    {'patterns': self.patterns, 'tools': self.tools.name, 'top': top}), report
+
+    def select_step(self, netlist, report, work_dir, points=()):
+        tcl = os.path.join(work_dir, stage_1.OUTPUT_TCL)
+        eco = os.path.join(work_dir, "eco.v")
+        argv = [sys.executable, os.path.join(HERE, "tpi_pipeline.py"), "--stages", "1", "--netlist", netlist,
+                "--stage1-report", report, "--out-dir", work_dir, "--stage1-tcl", stage_1.OUTPUT_TCL,
+                "--tcl-mode", "per-pin"]
+        if self.cache_dir:
+            argv += ["--cache-dir", self.cache_dir]
+        else:
+            argv += ["--no-cache"]
+        for option, value in sorted(self.select_args.items()):
+            argv += ["--" + option, str(value)]
+        params = dict(self.select_args)
+        if points:
+            # Points of earlier iterations: picking one again would cancel its inversion
+            params['exclude'] = ",".join(sorted(points))
+            argv += ["--exclude", params['exclude']]
+        inputs, outputs = [netlist, report], [tcl]
+        if self.liberty_file:
+            argv += ["--liberty", self.liberty_file]
+            inputs.append(self.liberty_file)
+        if not self.strict:
+            argv += ["--write-netlist", eco]
+            outputs.append(eco)
+        return Step("select", 'python', argv, inputs, outputs, params), tcl, eco
+
+    def insert_step(self, netlist, tcl, work_dir, top):
+        output = os.path.join(work_dir, "signoff.v")
+        argv = self.tools.insert(netlist, tcl, output, work_dir, top)
+        return Step("insert", 'dc' if self.tools.name == "synopsys" else 'python', argv, [netlist, tcl], [output],
+                    {'tools': self.tools.name, 'top': top}), output
+
+    async def _insert_after(self, previous, label, step):
+        """dc_shell chain: iteration N inserts into the output of iteration N-1."""
+        if previous is not None:
+            await previous
+        await self.run_step(label, step)
+
+    # ---------------------------------------------------------
+    # Loop per design
+    # ---------------------------------------------------------
+    async def run_design(self, netlist):
+        top = os.path.basename(netlist).split('.')[0]
+        rows = self.results[netlist] = []
+        chain = []      # The running dc_shell chain, if any
+        try:
+            return await self._iterate(netlist, top, rows, chain)
+        finally:
+            # Never leave an insertion running behind a failed analysis step
+            if chain:
+                await asyncio.gather(chain[-1], return_exceptions=True)
+
+    async def _iterate(self, netlist, top, rows, chain):
+        design_dir = os.path.join(self.work_dir, design_tag(netlist))
+        analysis = signoff = netlist
+        points = set()  # Nodes inverted so far
+        for iteration in range(1, self.iterations + 1):
+            label = "[{} #{}]".format(top, iteration)
+            work_dir = os.path.join(design_dir, "iter_{}".format(iteration))
+            if not os.path.isdir(work_dir):
+                os.makedirs(work_dir)
+
+            step, report = self.profile_step(analysis, work_dir, top)
+            await self.run_step(label, step)
+            victims = len(read_fault_report(report, RPR_CLASSES, include_equivalent=False).instances())
+            row = {'iteration': iteration, 'victims': victims, 'points': 0}
+            rows.append(row)
+            if not victims:
+                print("    - {} no RPR victims left; loop converged.".format(label))
+                break
+
+            step, tcl, eco = self.select_step(analysis, report, work_dir, points)
+            await self.run_step(label, step)
+            selected = tcl_points(tcl)
+            row['points'] = len(selected)
+            points.update(selected)
+
+            step, output = self.insert_step(signoff, tcl, work_dir, top)
+            chain.append(asyncio.ensure_future(self._insert_after(chain[-1] if chain else None, label, step)))
+            signoff = output
+            if self.strict:
+                await chain[-1]
+                analysis = signoff
+            else:
+                analysis = eco
+        if chain:
+            await chain[-1]
+        return signoff
+
+    async def run(self, netlists):
+        paths = [os.path.abspath(n) for n in netlists]
+        if len(set(paths)) != len(paths):
+            raise ValueError("a design is listed more than once")
+        self.semaphores = dict((kind, asyncio.Semaphore(n)) for kind, n in self.limits.items())
+        results = await asyncio.gather(*[self.run_design(n) for n in netlists], return_exceptions=True)
+        return dict(zip(netlists, results))
+
+
+def design_tag(netlist):
+    """Work directory name of a design: its stem plus a hash of its path, so equal stems do not collide."""
+    digest = hashlib.sha1(os.path.abspath(netlist).encode('utf-8')).hexdigest()
+    return "{}-{}".format(os.path.basename(netlist).split('.')[0], digest[:8])
+
+
+def tcl_points(tcl):
+    """Nodes a per-pin Stage 1 script inverts, from its '# Node:' comments."""
+    with open(tcl) as f:
+        return [line.split()[2] for line in f if line.startswith("# Node: ")]
+
+
+def print_summary(loop, outcomes, elapsed):
+    print("[*] Closed loop finished in {:.1f} s ({} steps run, {} cached)".format(
+        elapsed, loop.stats['run'], loop.stats['cached']))
+    for netlist, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            print("    - {}: FAILED: {}".format(netlist, outcome))
+            continue
+        history = ", ".join("#{} {} victims/{} points".format(r['iteration'], r['victims'], r['points'])
+                            for r in loop.results.get(netlist, []))
+        print("    - {}: {} -> {}".format(netlist, history, outcome))
+
+
+# ==========================================
+# CLI
+# ==========================================
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the profile -> select -> insert loop asynchronously.")
+    parser.add_argument("netlists", nargs="+", help="Designs to iterate (top module = file name stem)")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--tools", choices=sorted(TOOLSETS), default=TOOLS,
+                        help="synopsys (tmax/dc_shell) or local stand-ins (default: {})".format(TOOLS))
+    parser.add_argument("--strict", action="store_true",
+                        help="Profile each iteration on the dc_shell output instead of the ECO netlist")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Graph and step cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Run every step")
+    parser.add_argument("--tmax-jobs", type=int, default=TMAX_JOBS)
+    parser.add_argument("--dc-jobs", type=int, default=DC_JOBS)
+    parser.add_argument("--jobs", type=int, default=PYTHON_JOBS, help="Concurrent Python steps")
+    parser.add_argument("--patterns", type=int, default=NUM_PATTERNS, help="Random patterns per profile")
+    parser.add_argument("--elbow", type=float, default=stage_1.ELBOW_THRESHOLD)
+    parser.add_argument("--budget", type=int, default=stage_1.MAX_AREA_BUDGET)
+    parser.add_argument("--scoring", choices=("distance", "cop"), default=stage_1.SCORING_MODE)
+    parser.add_argument("--selection", choices=("rank", "celf"), default=stage_1.SELECTION_MODE)
+    parser.add_argument("--liberty", default=None, metavar="LIB", help="Liberty library for the selection step")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if len(set(os.path.abspath(n) for n in args.netlists)) != len(args.netlists):
+        parser.error("a design is listed more than once")
+    loop = ClosedLoop(TOOLSETS[args.tools](), args.work_dir, None if args.no_cache else args.cache_dir,
+                      args.iterations, args.strict, args.tmax_jobs, args.dc_jobs, args.jobs, args.patterns,
+                      {'elbow': args.elbow, 'budget': args.budget, 'scoring': args.scoring,
+                       'selection': args.selection}, args.liberty)
+    print("[*] Closed loop: {} design(s), {} iterations, {} tools{}".format(
+        len(args.netlists), args.iterations, args.tools, ", strict" if args.strict else ""))
+    start = time.time()
+    outcomes = asyncio.run(loop.run(args.netlists))
+    print_summary(loop, outcomes, time.time() - start)
+    return 1 if any(isinstance(o, Exception) for o in outcomes.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
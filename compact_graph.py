@@ -0,0 +1,356 @@
+from array import array
+from collections import deque
+
+import instrument
+from cell_library import library_cell
+from netlist_reader import NetlistReader, alias_map
+
+# ==========================================
+# COMPACT INTEGER-INDEXED CIRCUIT GRAPH
+# ==========================================
+# Nets, instances, cell types and pin names are interned to integer IDs.
+# Connectivity lives in flat array('i') CSR tables, so a BFS step is an
+# index into an array instead of several string hash lookups.
+#
+#   pins of inst i    : pin_name/pin_net/pin_dir[pin_ptr[i]:pin_ptr[i+1]]
+#   drivers of inst i : fanin[fanin_ptr[i]:fanin_ptr[i+1]]
+#   loads of inst i   : fanout[fanout_ptr[i]:fanout_ptr[i+1]]
+
+OUTPUT_PINS = ('Y', 'Z', 'Q', 'QN', 'SO')
+INPUT_PINS  = ('A', 'B', 'C', 'D', 'A1', 'A2', 'A3', 'A4',
+               'B1', 'B2', 'S0', 'S1', 'CLK', 'RSTB', 'SI', 'SE', 'TE')
+
+PIN_IN, PIN_OUT, PIN_OTHER = 0, 1, 2
+PORT_NONE, PORT_IN, PORT_OUT, PORT_INOUT = 0, 1, 2, 3
+PORT_CODES = {'input': PORT_IN, 'output': PORT_OUT, 'inout': PORT_INOUT}
+# Liberty pin directions (cell_library.LIBRARY); inout/internal are neither
+LIBERTY_DIRS = {'input': PIN_IN, 'output': PIN_OUT}
+
+
+def is_sequential_cell(cell_type):
+    """Registers/latches stop combinational cone tracing (DFF*, SDFF*, *reg*, LATCH*)."""
+    cell = library_cell(cell_type)
+    if cell is not None:
+        return cell.sequential
+    return "DFF" in cell_type or "reg" in cell_type or "LA" in cell_type
+
+
+def cell_pin_direction(cell_type, pin):
+    """PIN_* of `pin` on `cell_type`: from the active library, else by pin name."""
+    cell = library_cell(cell_type)
+    direction = cell.direction(pin) if cell is not None else None
+    if direction is not None:
+        return LIBERTY_DIRS.get(direction, PIN_OTHER)
+    if pin in OUTPUT_PINS:
+        return PIN_OUT
+    if pin in INPUT_PINS:
+        return PIN_IN
+    return PIN_OTHER
+
+
+class Interner:
+    """Bidirectional name <-> ID table. The reverse dict is built on first use."""
+    def __init__(self, names=None):
+        self.names = list(names) if names else []
+        self._ids = None if names else {}
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = dict(zip(self.names, range(len(self.names))))
+        return self._ids
+
+    def add(self, name):
+        ids = self.ids
+        idx = ids.get(name)
+        if idx is None:
+            idx = len(self.names)
+            ids[name] = idx
+            self.names.append(name)
+        return idx
+
+    def get(self, name, default=-1):
+        return self.ids.get(name, default)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def _transpose(ptr, data, num_rows):
+    """Reverses a CSR adjacency (fanin -> fanout) with a counting pass."""
+    counts = array('i', [0]) * (num_rows + 1)
+    for v in data:
+        counts[v + 1] += 1
+    for i in range(num_rows):
+        counts[i + 1] += counts[i]
+    out = array('i', [0]) * len(data)
+    fill = array('i', counts)
+    for row in range(num_rows):
+        for k in range(ptr[row], ptr[row + 1]):
+            v = data[k]
+            out[fill[v]] = row
+            fill[v] += 1
+    return counts, out
+
+
+class CompactGraph:
+    def __init__(self):
+        self.nets = Interner()
+        self.insts = Interner()
+        self.cells = Interner()
+        self.pin_names = Interner()
+
+        self.inst_cell = array('i')   # inst -> cell type ID
+        self.inst_out  = array('i')   # inst -> primary output net (-1: none)
+        self.cell_seq  = bytearray()  # cell type -> 1 if sequential
+
+        self.pin_ptr  = array('i', [0])
+        self.pin_name = array('i')
+        self.pin_net  = array('i')
+        self.pin_dir  = bytearray()
+
+        self.net_driver = array('i')  # net -> driving inst (-1: undriven)
+        self.net_port   = bytearray() # net -> PORT_* of the top module
+
+        self.fanin_ptr  = array('i', [0])
+        self.fanin      = array('i')
+        self.fanout_ptr = array('i', [0])
+        self.fanout     = array('i')
+
+        self._pin_info = {}           # pin name -> (pin name ID, PIN_*)
+        self._cell_pin_info = {}      # cell type ID -> own _pin_info for library cells
+        self.throughput = 0.0
+        self.cache_hit = False        # Set by graph_cache.load_graph
+        self.load_time = 0.0
+
+    # ---------------------------------------------------------
+    # Construction
+    # ---------------------------------------------------------
+    @classmethod
+    def from_netlist(cls, filename):
+        graph = cls()
+        reader = NetlistReader(filename)
+        with instrument.phase("parse_netlist", file=filename):
+            for inst in reader.instances():
+                graph.add_instance(inst.name, inst.cell_type, inst.pins)
+        top = reader.top_module()
+        with instrument.phase("build_graph"):
+            graph.finalize(alias_map(reader.assigns), top.directions if top else {})
+        graph.throughput = reader.throughput()
+        if instrument.ENABLED:
+            instrument.count("instances_parsed", reader.instance_count)
+            instrument.count("netlist_bytes", reader.bytes_read)
+        return graph
+
+    def add_instance(self, name, cell_type, pins):
+        inst = self.insts.add(name)
+        if inst < len(self.inst_cell):
+            # Duplicate instance name: keep the first definition
+            return inst
+        cell = self.cells.add(cell_type)
+        if cell == len(self.cell_seq):
+            self.cell_seq.append(1 if is_sequential_cell(cell_type) else 0)
+        self.inst_cell.append(cell)
+        pin_info = self._cell_pin_info.get(cell)
+        if pin_info is None:
+            # Pins of library cells are resolved per cell, the rest by name
+            pin_info = self._cell_pin_info[cell] = self._pin_info if library_cell(cell_type) is None else {}
+
+        net_ids, net_names = self.nets.ids, self.nets.names
+        net_driver = self.net_driver
+        out = -1
+        for pin, net in pins:
+            if pin is None:
+                continue
+            net_id = net_ids.get(net)
+            if net_id is None:
+                net_id = net_ids[net] = len(net_names)
+                net_names.append(net)
+                net_driver.append(-1)
+            info = pin_info.get(pin)
+            if info is None:
+                info = pin_info[pin] = (self.pin_names.add(pin), cell_pin_direction(cell_type, pin))
+            if info[1] == PIN_OUT:
+                out = net_id
+                net_driver[net_id] = inst
+            self.pin_name.append(info[0])
+            self.pin_net.append(net_id)
+            self.pin_dir.append(info[1])
+        self.inst_out.append(out)
+        self.pin_ptr.append(len(self.pin_net))
+        return inst
+
+    def finalize(self, aliases=None, directions=None):
+        """Resolves assign aliases and port directions, then builds the fanin/fanout CSR tables."""
+        # `assign lhs = rhs;` makes lhs an alias of rhs's driver
+        for lhs, root in (aliases or {}).items():
+            lhs_id, root_id = self.nets.get(lhs), self.nets.get(root)
+            if lhs_id < 0:
+                lhs_id = self.nets.add(lhs)
+                self.net_driver.append(-1)
+            if root_id >= 0 and self.net_driver[lhs_id] < 0:
+                self.net_driver[lhs_id] = self.net_driver[root_id]
+
+        self.net_port = bytearray(len(self.nets))
+        for net, direction in (directions or {}).items():
+            net_id = self.nets.get(net)
+            if net_id >= 0:
+                self.net_port[net_id] = PORT_CODES.get(direction, PORT_NONE)
+
+        self._build_adjacency()
+
+    def _build_adjacency(self):
+        num_insts = len(self.inst_cell)
+        self.fanin_ptr = array('i', [0])
+        self.fanin = array('i')
+        for inst in range(num_insts):
+            if self.inst_out[inst] >= 0:
+                seen = set()
+                for p in range(self.pin_ptr[inst], self.pin_ptr[inst + 1]):
+                    if self.pin_dir[p] != PIN_IN:
+                        continue
+                    drv = self.net_driver[self.pin_net[p]]
+                    if drv >= 0 and drv not in seen:
+                        seen.add(drv)
+                        self.fanin.append(drv)
+            self.fanin_ptr.append(len(self.fanin))
+        self.fanout_ptr, self.fanout = _transpose(self.fanin_ptr, self.fanin, num_insts)
+
+    # ---------------------------------------------------------
+    # In-place edits (ECO)
+    # ---------------------------------------------------------
+    # Edits touch the pin and driver tables only; call rebuild_adjacency()
+    # once after a batch of them before tracing cones again.
+    def add_net(self, name, port=PORT_NONE):
+        net = self.nets.get(name)
+        if net < 0:
+            net = self.nets.add(name)
+            self.net_driver.append(-1)
+        self._grow_ports()
+        if port != PORT_NONE:
+            self.net_port[net] = port
+        return net
+
+    def add_cell(self, name, cell_type, pins):
+        """add_instance() on a finalized graph. Returns the instance ID."""
+        inst = self.add_instance(name, cell_type, pins)
+        self._grow_ports()
+        return inst
+
+    def _grow_ports(self):
+        if len(self.net_port) < len(self.nets):
+            self.net_port.extend(bytes(len(self.nets) - len(self.net_port)))
+
+    def reconnect(self, inst, pin, net_name):
+        """Moves `pin` of `inst` onto net_name. Returns the previous net ID, or -1 if there is no such pin."""
+        net = self.add_net(net_name)
+        for p in range(self.pin_ptr[inst], self.pin_ptr[inst + 1]):
+            if self.pin_names.names[self.pin_name[p]] != pin:
+                continue
+            old = self.pin_net[p]
+            self.pin_net[p] = net
+            if self.pin_dir[p] == PIN_OUT:
+                if self.net_driver[old] == inst:
+                    self.net_driver[old] = -1
+                self.net_driver[net] = inst
+                if self.inst_out[inst] == old:
+                    self.inst_out[inst] = net
+            return old
+        return -1
+
+    def rebuild_adjacency(self):
+        with instrument.phase("rebuild_adjacency"):
+            self._build_adjacency()
+
+    # ---------------------------------------------------------
+    # Name translation
+    # ---------------------------------------------------------
+    def inst_index(self, name, escaped_fallback=False):
+        """
+        ID of an instance name, or -1. With escaped_fallback, a report
+        name "U123" also matches a netlist name "\\U123".
+        """
+        idx = self.insts.get(name)
+        if idx < 0 and escaped_fallback:
+            idx = self.insts.get("\\" + name)
+        return idx
+
+    def inst_name(self, inst):
+        return self.insts.names[inst]
+
+    def net_name(self, net):
+        return self.nets.names[net]
+
+    def cell_type(self, inst):
+        return self.cells.names[self.inst_cell[inst]]
+
+    def names(self, insts):
+        names = self.insts.names
+        return [names[i] for i in insts]
+
+    # ---------------------------------------------------------
+    # Lookups
+    # ---------------------------------------------------------
+    @property
+    def num_insts(self):
+        return len(self.inst_cell)
+
+    @property
+    def num_nets(self):
+        return len(self.nets)
+
+    def is_sequential(self, inst):
+        return self.cell_seq[self.inst_cell[inst]] == 1
+
+    def output_net(self, inst):
+        return self.inst_out[inst]
+
+    def get_fanin(self, inst):
+        return self.fanin[self.fanin_ptr[inst]:self.fanin_ptr[inst + 1]]
+
+    def get_fanout(self, inst):
+        return self.fanout[self.fanout_ptr[inst]:self.fanout_ptr[inst + 1]]
+
+    def pins(self, inst):
+        """[(pin_name, net_name), ...] in netlist order."""
+        pin_names, net_names = self.pin_names.names, self.nets.names
+        return [(pin_names[self.pin_name[p]], net_names[self.pin_net[p]])
+                for p in range(self.pin_ptr[inst], self.pin_ptr[inst + 1])]
+
+    def pin_map(self, inst):
+        return dict(self.pins(inst))
+
+    # ---------------------------------------------------------
+    # Distance-Aware Cone Trace (BFS)
+    # ---------------------------------------------------------
+    def fanin_cone(self, start):
+        """
+        Traces backwards from instance ID `start` until a register or
+        primary input is hit. Returns {inst_id: distance_from_fault}.
+        """
+        cone = {}
+        if self.inst_out[start] < 0:
+            return cone
+        fanin, fanin_ptr, cell_seq, inst_cell = self.fanin, self.fanin_ptr, self.cell_seq, self.inst_cell
+
+        queue = deque((d, 1) for d in fanin[fanin_ptr[start]:fanin_ptr[start + 1]])
+        track = instrument.ENABLED
+        peak = 0
+        while queue:
+            if track and len(queue) > peak:
+                peak = len(queue)
+            curr, dist = queue.popleft()
+            if curr in cone:
+                continue
+            cone[curr] = dist
+            # Flip-flops are recorded but not traced through
+            if cell_seq[inst_cell[curr]]:
+                continue
+            for u in fanin[fanin_ptr[curr]:fanin_ptr[curr + 1]]:
+                if u not in cone:
+                    queue.append((u, dist + 1))
+        if track:
+            instrument.count("cones_traced")
+            instrument.count("nodes_visited", len(cone))
+            instrument.high_water("queue_high_water", peak)
+        return cone
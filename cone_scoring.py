@@ -0,0 +1,385 @@
+import heapq
+from collections import defaultdict
+
+import instrument
+
+try:
+    import numpy
+except ImportError:      # Pure-Python fallback, same results
+    numpy = None
+
+# ==========================================
+# BATCHED CONE SCORING
+# ==========================================
+# Computes, for every instance, sum over victims of 1 / (1 + distance)
+# where distance is the BFS depth in that victim's fanin cone -- exactly
+# what calling get_full_fanin_cone() once per victim and summing gives.
+#
+# Victims are processed in batches; each victim owns one bit of a Python
+# int. The sweep is level-synchronous: at depth d a node carries the bits
+# of all victims reaching it for the first time at d, so a reconvergent
+# node is expanded once per level for the whole batch instead of once
+# per victim.
+#
+# Before sweeping, victims are collapsed: a victim's cone depends only
+# on the set of instances driving its input pins, so duplicate IDs and
+# gates fed by the same drivers (e.g. the fanout of one net, or several
+# faults collapsed onto one instance) share a single traced bit, weighted
+# by the size of the group. The summed scores are the same.
+
+BATCH_SIZE = 4096
+FRAME_DECAY = 0.5   # Weight of each time frame behind the registers relative to the one before
+
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+
+def sweep_batch(graph, victims):
+    """
+    Multi-source backward sweep for one batch of victim IDs (bit i is
+    victims[i]). Yields (depth, {inst_id: bits first reached at depth}).
+    """
+    fanin, fanin_ptr = graph.fanin, graph.fanin_ptr
+    cell_seq, inst_cell, inst_out = graph.cell_seq, graph.inst_cell, graph.inst_out
+
+    frontier = defaultdict(int)
+    for bit, victim in enumerate(victims):
+        if inst_out[victim] < 0:
+            continue
+        mask = 1 << bit
+        for d in fanin[fanin_ptr[victim]:fanin_ptr[victim + 1]]:
+            frontier[d] |= mask
+
+    visited = {}
+    depth = 1
+    track = instrument.ENABLED
+    while frontier:
+        if track:
+            instrument.high_water("frontier_high_water", len(frontier))
+        reached = {}
+        nxt = defaultdict(int)
+        for node, bits in frontier.items():
+            seen = visited.get(node)
+            if seen is not None:
+                bits &= ~seen
+                if not bits:
+                    continue
+                visited[node] = seen | bits
+            else:
+                visited[node] = bits
+            reached[node] = bits
+            # Flip-flops are recorded but not traced through
+            if cell_seq[inst_cell[node]]:
+                continue
+            for u in fanin[fanin_ptr[node]:fanin_ptr[node + 1]]:
+                nxt[u] |= bits
+        if reached:
+            if track:
+                instrument.count("nodes_visited", len(reached))
+            yield depth, reached
+        frontier = nxt
+        depth += 1
+
+
+def collapse_victims(graph, victims):
+    """
+    Groups victim IDs with identical fanin cones (same set of fanin
+    drivers). Victims without an output net trace nothing and are
+    dropped. Returns (representatives, group sizes), largest groups
+    first, so that equal sizes sit next to each other in a batch.
+    """
+    fanin, fanin_ptr, inst_out = graph.fanin, graph.fanin_ptr, graph.inst_out
+    groups = {}
+    for victim in victims:
+        if inst_out[victim] < 0:
+            continue
+        key = frozenset(fanin[fanin_ptr[victim]:fanin_ptr[victim + 1]])
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [victim, 1]
+        else:
+            group[1] += 1
+    order = sorted(groups.values(), key=lambda group: -group[1])
+    return [group[0] for group in order], [group[1] for group in order]
+
+
+def _size_masks(sizes):
+    """[(bit mask, group size)] over runs of equal sizes in one batch."""
+    masks = []
+    start = 0
+    for end in range(1, len(sizes) + 1):
+        if end == len(sizes) or sizes[end] != sizes[start]:
+            masks.append((((1 << end) - 1) ^ ((1 << start) - 1), sizes[start]))
+            start = end
+    return masks
+
+
+def score_victims(graph, victims, batch_size=BATCH_SIZE):
+    """
+    Summed distance weight per instance ID over all victim IDs.
+    Victims themselves are not included (distance 0 is the caller's).
+    """
+    scores = defaultdict(float)
+    with instrument.phase("score_cones", victims=len(victims)):
+        reps, sizes = collapse_victims(graph, victims)
+        for start in range(0, len(reps), batch_size):
+            batch = reps[start:start + batch_size]
+            masks = _size_masks(sizes[start:start + batch_size])
+            for depth, reached in sweep_batch(graph, batch):
+                weight = 1.0 / (1.0 + float(depth))
+                if len(masks) == 1:
+                    weight *= masks[0][1]
+                    for node, bits in reached.items():
+                        scores[node] += _popcount(bits) * weight
+                    continue
+                for node, bits in reached.items():
+                    scores[node] += sum(_popcount(bits & mask) * size for mask, size in masks) * weight
+    instrument.count("cones_traced", len(reps))
+    instrument.count("cones_shared", len(victims) - len(reps))
+    return scores
+
+
+# ==========================================
+# TIME-FRAME EXPANSION ACROSS REGISTERS
+# ==========================================
+# A cone stops at the registers feeding it (frame 0). Logic that sets up a
+# hard sequential fault one or two clock cycles earlier sits behind those
+# registers, in frames 1, 2, ... of the time-frame expansion.
+#
+# Every register reached in frame k-1 carries the summed weight with which
+# the victims reach it. Frame k is one more batched sweep, seeded by those
+# registers instead of the victims; each bit is weighted by its
+# register's carry, as score_victims weights a bit by its group size. A
+# node at distance d behind register r then gains
+#
+#     FRAME_DECAY**k * carry(r) / (1 + d)
+#
+# and the registers the sweep reaches carry carry(r) / (1 + d) into frame
+# k+1. Path weights are products of per-frame distance weights, the work
+# per frame depends on the registers reached, not on the number of
+# victims, and nothing is kept per register between frames. With
+# frames = 0 the scores are those of score_victims.
+#
+# expanded_cone() reports shortest distances across frames for inspection;
+# 1/(1 + that distance) is not the weight a node gets here.
+
+SUM_ROWS = 4096     # Bitsets per NumPy weighted-sum block
+
+
+def expanded_cone(graph, start, frames):
+    """
+    {inst ID: shortest distance} of `start`'s fanin over `frames` frames
+    behind its registers. Not the scoring metric past frame 0: see
+    frame_scores() for the per-frame weights.
+    """
+    fanin, fanin_ptr = graph.fanin, graph.fanin_ptr
+    cell_seq, inst_cell = graph.cell_seq, graph.inst_cell
+    cone = {}
+    if graph.inst_out[start] < 0:
+        return cone
+    used = {}   # inst ID -> fewest frames it was reached with
+    level = [(node, 0) for node in fanin[fanin_ptr[start]:fanin_ptr[start + 1]]]
+    depth = 1
+    while level:
+        nxt = []
+        for node, frame in level:
+            if used.get(node, frames + 1) <= frame:
+                continue    # Reached as close before, through no more registers
+            used[node] = frame
+            if node not in cone:
+                cone[node] = depth
+            if cell_seq[inst_cell[node]]:
+                if frame == frames:
+                    continue
+                frame += 1
+            nxt.extend((u, frame) for u in fanin[fanin_ptr[node]:fanin_ptr[node + 1]])
+        level = nxt
+        depth += 1
+    return cone
+
+
+def _collapse_carry(graph, carry):
+    """(register IDs, summed carries): registers with identical fanin share one bit."""
+    fanin, fanin_ptr, inst_out = graph.fanin, graph.fanin_ptr, graph.inst_out
+    groups = {}
+    for reg, weight in carry.items():
+        if inst_out[reg] < 0:
+            continue
+        key = frozenset(fanin[fanin_ptr[reg]:fanin_ptr[reg + 1]])
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [reg, weight]
+        else:
+            group[1] += weight
+    return [group[0] for group in groups.values()], [group[1] for group in groups.values()]
+
+
+def _bit_sums(weights, use_numpy):
+    """Function mapping bitsets to the sum of weights[i] over their set bits i."""
+    if not use_numpy:
+        def sums(bitsets):
+            totals = []
+            for bits in bitsets:
+                text = bin(bits)[:1:-1]     # Bit i is character i
+                total = 0.0
+                i = text.find('1')
+                while i >= 0:
+                    total += weights[i]
+                    i = text.find('1', i + 1)
+                totals.append(total)
+            return totals
+        return sums
+
+    # One 256-entry table per byte of the bitset, bytes grouped in 64-bit words
+    nwords = (len(weights) + 63) // 64
+    padded = numpy.zeros(nwords * 64)
+    padded[:len(weights)] = weights
+    byte_bits = numpy.unpackbits(numpy.arange(256, dtype=numpy.uint8)[:, None], axis=1, bitorder='little')
+    tables = padded.reshape(nwords * 8, 8).dot(byte_bits.T).ravel()
+    byte_offsets = numpy.arange(8) * 256
+
+    def sums(bitsets):
+        bitsets = list(bitsets)
+        totals = numpy.empty(len(bitsets))
+        for start in range(0, len(bitsets), SUM_ROWS):
+            rows = bitsets[start:start + SUM_ROWS]
+            words = numpy.frombuffer(b''.join(bits.to_bytes(nwords * 8, 'little') for bits in rows), dtype=numpy.uint64)
+            # Bitsets are sparse: look up only the bytes of nonzero words
+            hit = numpy.flatnonzero(words)
+            hit_bytes = words[hit].view(numpy.uint8).reshape(-1, 8)
+            index = ((hit % nwords) * 2048)[:, None] + byte_offsets + hit_bytes
+            totals[start:start + len(rows)] = numpy.bincount(hit // nwords, tables.take(index).sum(axis=1), len(rows))
+        return totals.tolist()
+    return sums
+
+
+def frame_scores(graph, victims, frames, decay=None, batch_size=BATCH_SIZE, use_numpy=True):
+    """
+    score_victims() plus the weight of `frames` time frames behind the
+    registers: frame k adds FRAME_DECAY**k times the product of each
+    frame's 1/(1+d), summed over register paths.
+    """
+    if decay is None: decay = FRAME_DECAY
+    scores = score_victims(graph, victims, batch_size)
+    if frames <= 0:
+        return scores
+    cell_seq, inst_cell = graph.cell_seq, graph.inst_cell
+    carry = dict((node, score) for node, score in scores.items() if cell_seq[inst_cell[node]])
+    use_numpy = use_numpy and numpy is not None
+    with instrument.phase("score_frames", frames=frames, registers=len(carry), numpy=use_numpy):
+        for frame in range(1, frames + 1):
+            scale = decay ** frame
+            nxt = defaultdict(float)
+            regs, weights = _collapse_carry(graph, carry)
+            for start in range(0, len(regs), batch_size):
+                sums = _bit_sums(weights[start:start + batch_size], use_numpy)
+                for depth, reached in sweep_batch(graph, regs[start:start + batch_size]):
+                    weight = 1.0 / (1.0 + float(depth))
+                    for node, total in zip(reached, sums(reached.values())):
+                        scores[node] += scale * total * weight
+                        if cell_seq[inst_cell[node]]:
+                            nxt[node] += total * weight
+            instrument.count("frame_registers", len(carry))
+            instrument.count("frame_cones_traced", len(regs))
+            carry = nxt
+            if not carry:
+                break
+    return scores
+
+
+# ==========================================
+# COVERAGE-AWARE (LAZY GREEDY) SELECTION
+# ==========================================
+# Picking the top-scored nodes counts a victim again for every selected
+# node whose cone contains it. Coverage selection instead maximizes
+#
+#     f(S) = sum over victims v of max over s in S of 1 / (1 + d(s, v))
+#
+# so a victim only adds to the objective through its closest selected
+# node. f is submodular: a node's marginal gain can only shrink as more
+# nodes are picked. CELF exploits this: gains sit in a max-heap and only
+# the top entry is re-evaluated; if it stays on top it is the true best.
+# For a single pick f equals the plain distance score.
+
+def coverage_table(graph, victims, batch_size=BATCH_SIZE):
+    """
+    {inst_id: {(batch_start, depth): victim bits}} where bit i stands for
+    victims[batch_start + i]. Keeping bits batch-local keeps every int
+    at most batch_size bits wide. Every victim covers itself at depth 0.
+    """
+    table = defaultdict(dict)
+    for i, victim in enumerate(victims):
+        key = (i - i % batch_size, 0)
+        entry = table[victim]
+        entry[key] = entry.get(key, 0) | (1 << (i % batch_size))
+    with instrument.phase("coverage_table", victims=len(victims)):
+        for start in range(0, len(victims), batch_size):
+            for depth, reached in sweep_batch(graph, victims[start:start + batch_size]):
+                key = (start, depth)
+                for node, bits in reached.items():
+                    entry = table[node]
+                    entry[key] = entry.get(key, 0) | bits
+    instrument.count("cones_traced", len(victims))
+    return table
+
+
+class Coverage:
+    """Closest selected depth of every covered victim, one bitset per (batch, depth)."""
+    def __init__(self):
+        self.at_depth = defaultdict(dict)   # batch -> {depth: bits whose best depth it is}
+        self.covered = defaultdict(int)     # batch -> bits covered at any depth
+
+    def gain(self, entry):
+        total = 0.0
+        for (batch, depth), bits in entry.items():
+            weight = 1.0 / (1.0 + depth)
+            total += _popcount(bits & ~self.covered[batch]) * weight
+            for best, held in self.at_depth[batch].items():
+                if best > depth:
+                    total += _popcount(bits & held) * (weight - 1.0 / (1.0 + best))
+        return total
+
+    def add(self, entry):
+        for batch, depth in sorted(entry):
+            bits = entry[(batch, depth)]
+            at_depth = self.at_depth[batch]
+            moved = bits & ~self.covered[batch]
+            for best in list(at_depth):
+                if best > depth:
+                    closer = bits & at_depth[best]
+                    if closer:
+                        at_depth[best] &= ~closer
+                        moved |= closer
+            if moved:
+                at_depth[depth] = at_depth.get(depth, 0) | moved
+                self.covered[batch] |= moved
+
+
+def lazy_greedy(table, exclude=()):
+    """
+    CELF over a coverage_table. Yields (inst_id, marginal_gain,
+    evaluations) in pick order; the caller stops when its budget or
+    elbow rule says so.
+    """
+    coverage = Coverage()
+    heap = []
+    for node, entry in table.items():
+        if node in exclude:
+            continue
+        heap.append((-coverage.gain(entry), node, 0))
+    heapq.heapify(heap)
+
+    picks = evaluations = 0
+    while heap:
+        neg_gain, node, stamp = heapq.heappop(heap)
+        if stamp == picks:
+            # Gain is current and every other entry is an upper bound
+            coverage.add(table[node])
+            picks += 1
+            yield node, -neg_gain, evaluations
+            continue
+        evaluations += 1
+        heapq.heappush(heap, (-coverage.gain(table[node]), node, picks))
@@ -0,0 +1,410 @@
+import heapq
+from collections import defaultdict
+
+import instrument
+from cell_library import truth_table
+from logic_model import LevelizedCircuit
+
+try:
+    import numpy
+except ImportError:      # Pure-Python fallback, same results
+    numpy = None
+
+# ==========================================
+# COP CONTROLLABILITY / OBSERVABILITY ENGINE
+# ==========================================
+# Probabilistic testability on the LevelizedCircuit model:
+#   - c1[net]  : probability the net is 1 under random patterns
+#   - obs[net] : probability a value change on the net reaches an
+#                observed point (PO / flop data input)
+#
+# Gate output probabilities come from the cell truth table, assuming
+# independent inputs. Pin observability is the gate output observability
+# times the probability that the side inputs sensitize that pin; a net
+# with fanout is observed if any branch is: 1 - prod(1 - O_branch).
+#
+# The full pass is vectorized per logic level and cell type with NumPy
+# when available. Test points are applied incrementally: only the fanout
+# cone (controllability) and the cones feeding changed gates
+# (observability) are revisited, and a trial can be rolled back, which is
+# what rank_candidates() does for every candidate.
+
+EPSILON        = 1e-6    # Smaller changes stop incremental propagation
+RANK_EPSILON   = 1e-4    # Coarser cut-off for throw-away ranking trials
+MIN_DETECT     = 1e-12   # Floor so undetectable targets cost a finite 1/p
+TE_PROBABILITY = 0.5     # Test-enable of an inversion point is random in test
+
+_KERNELS = {}
+
+
+def _kernel(function):
+    """(n, rows where out=1, rows sensitizing input i per input) for a cell function."""
+    kernel = _KERNELS.get(function.name)
+    if kernel is None:
+        n = len(function.inputs)
+        table = truth_table(function)
+        on_rows = [r for r in range(1 << n) if (table >> r) & 1]
+        sense = []
+        for i in range(n):
+            sense.append([r for r in range(1 << n)
+                          if not (r >> i) & 1 and ((table >> r) ^ (table >> (r | 1 << i))) & 1])
+        kernel = (n, on_rows, sense)
+        _KERNELS[function.name] = kernel
+    return kernel
+
+
+def _row_prob(probs, row, skip=-1):
+    p = 1.0
+    for i, q in enumerate(probs):
+        if i != skip:
+            p *= q if (row >> i) & 1 else 1.0 - q
+    return p
+
+
+def _mix(c1):
+    """Probability of 1 after XOR with the test-enable signal."""
+    return c1 + TE_PROBABILITY - 2.0 * c1 * TE_PROBABILITY
+
+
+class CopEngine:
+    def __init__(self, graph=None, circuit=None, use_numpy=True):
+        self.circuit = circuit if circuit is not None else LevelizedCircuit(graph)
+        self.use_numpy = use_numpy and numpy is not None
+        self.control_nets = {}      # net -> controllability before the XOR
+        self.observe_nets = set()
+        self._journal = None
+        self.epsilon = EPSILON
+        self.compute()
+
+    # ---------------------------------------------------------
+    # Full pass
+    # ---------------------------------------------------------
+    def compute(self):
+        ckt = self.circuit
+        num_nets = ckt.graph.num_nets
+        self.c1 = [0.5] * num_nets
+        self.obs = [0.0] * num_nets
+        self.pin_obs = [None] * len(ckt.gates)
+        for net, bit in ckt.constants.items():
+            self.c1[net] = float(bit)
+        with instrument.phase("cop_compute", numpy=bool(self.use_numpy)):
+            if self.use_numpy:
+                self._compute_numpy()
+            else:
+                self._compute_python()
+
+    def _observed(self, net):
+        return self.circuit.observed[net] or net in self.observe_nets
+
+    def _compute_python(self):
+        ckt = self.circuit
+        c1 = self.c1
+        for idx in ckt.order:
+            out = ckt.gates[idx][1]
+            c1[out] = self._gate_c1(idx)
+
+        miss = [1.0] * len(c1)
+        for idx in reversed(ckt.order):
+            out, in_nets = ckt.gates[idx][1], ckt.gates[idx][3]
+            self.obs[out] = 1.0 if self._observed(out) else 1.0 - miss[out]
+            pins = self._gate_pin_obs(idx)
+            self.pin_obs[idx] = pins
+            for net, o in zip(in_nets, pins):
+                miss[net] *= 1.0 - o
+        self._finish_sources(miss)
+
+    def _levels(self):
+        """
+        Per logic level: (gate ids, input nets, output nets, truth tables,
+        sensitization tables), padded to the widest cell of the level.
+        Padding inputs read the extra always-0 net at index num_nets and
+        never change the output, so one set of array operations covers
+        every cell type on the level.
+        """
+        ckt = self.circuit
+        pad = ckt.graph.num_nets
+        codes, functions = {}, []
+        gate_code = []
+        for function in ckt.functions:
+            code = codes.get(function.name)
+            if code is None:
+                code = codes[function.name] = len(functions)
+                functions.append(function)
+            gate_code.append(code)
+        gate_code = numpy.array(gate_code, dtype=numpy.int64)
+        widths = numpy.array([len(f.inputs) for f in functions], dtype=numpy.int64)
+        banks = {}
+
+        by_level = defaultdict(list)
+        for idx in ckt.order:
+            by_level[ckt.level[idx]].append(idx)
+        levels = []
+        for level in sorted(by_level):
+            ids = by_level[level]
+            level_codes = gate_code[ids]
+            width = int(widths[level_codes].max())
+            if width not in banks:
+                banks[width] = self._bank(functions, width)
+            tables, sense = banks[width]
+            ins = numpy.array([ckt.gates[i][3] + [pad] * (width - len(ckt.gates[i][3])) for i in ids],
+                              dtype=numpy.int64).reshape(len(ids), width)
+            outs = numpy.array([ckt.gates[i][1] for i in ids], dtype=numpy.int64)
+            levels.append((ids, ins, outs, tables[level_codes], sense[:, level_codes]))
+        return levels
+
+    @staticmethod
+    def _bank(functions, width):
+        """Truth and sensitization tables of every function, padded to `width` inputs."""
+        rows = 1 << width
+        tables = numpy.zeros((len(functions), rows))
+        sense = numpy.zeros((width, len(functions), rows >> 1))
+        for code, function in enumerate(functions):
+            n, on_rows, sens = _kernel(function)
+            if n > width:
+                continue
+            low = (1 << n) - 1
+            on = set(on_rows)
+            tables[code] = [1.0 if (r & low) in on else 0.0 for r in range(rows)]
+            for i in range(n):
+                hit = set(sens[i])
+                # Rows with bit i clear, numbered with bit i squeezed out
+                sense[i, code] = [1.0 if (r & low) in hit else 0.0
+                                  for r in range(rows) if not (r >> i) & 1]
+        return tables, sense
+
+    @staticmethod
+    def _np_rows(P, skip=-1):
+        """Probability of every input assignment (row), input i = bit i."""
+        rows = numpy.ones((P.shape[0], 1))
+        for i in range(P.shape[1]):
+            if i != skip:
+                p = P[:, i:i + 1]
+                rows = numpy.concatenate((rows * (1.0 - p), rows * p), axis=1)
+        return rows
+
+    def _compute_numpy(self):
+        ckt = self.circuit
+        levels = self._levels()
+        c1 = numpy.array(self.c1 + [0.0])
+        cp = numpy.zeros(len(c1), dtype=bool)
+        for net in self.control_nets:
+            cp[net] = True
+
+        for ids, ins, outs, tables, _ in levels:
+            raw = (self._np_rows(c1[ins]) * tables).sum(axis=1)
+            c1[outs] = raw
+            hit = cp[outs]
+            if hit.any():
+                for net, value in zip(outs[hit].tolist(), raw[hit].tolist()):
+                    self.control_nets[net] = value
+                c1[outs[hit]] = _mix(raw[hit])
+
+        observed = numpy.zeros(len(c1), dtype=bool)
+        observed[:-1] = numpy.frombuffer(bytes(ckt.observed), dtype=numpy.uint8) != 0
+        for net in self.observe_nets:
+            observed[net] = True
+        miss = numpy.ones(len(c1))
+        obs = numpy.zeros(len(c1))
+        for ids, ins, outs, _, sense in reversed(levels):
+            out_obs = numpy.where(observed[outs], 1.0, 1.0 - miss[outs])
+            obs[outs] = out_obs
+            P = c1[ins]
+            pins = numpy.empty(ins.shape)
+            for i in range(ins.shape[1]):
+                pins[:, i] = out_obs * (self._np_rows(P, skip=i) * sense[i]).sum(axis=1)
+                numpy.multiply.at(miss, ins[:, i], 1.0 - pins[:, i])
+            for idx, row, n in zip(ids, pins.tolist(), (len(ckt.gates[i][3]) for i in ids)):
+                self.pin_obs[idx] = row[:n]
+
+        self.c1 = c1[:-1].tolist()
+        self.obs = obs[:-1].tolist()
+        self._finish_sources(miss[:-1].tolist())
+
+    def _finish_sources(self, miss):
+        """Nets without a levelized driver (PIs, flop outputs, loop breaks)."""
+        ckt = self.circuit
+        for net in range(len(self.c1)):
+            idx = ckt.gate_of_net.get(net)
+            if idx is None or self.pin_obs[idx] is None:
+                self.obs[net] = 1.0 if self._observed(net) else 1.0 - miss[net]
+                if net in self.control_nets:
+                    self.control_nets[net] = self.c1[net]
+                    self.c1[net] = _mix(self.c1[net])
+
+    # ---------------------------------------------------------
+    # Per-gate formulas
+    # ---------------------------------------------------------
+    def _gate_c1(self, idx):
+        _, out, _, in_nets, _ = self.circuit.gates[idx]
+        _, on_rows, _ = _kernel(self.circuit.functions[idx])
+        probs = [self.c1[n] for n in in_nets]
+        raw = sum(_row_prob(probs, r) for r in on_rows)
+        if out in self.control_nets:
+            self._record(self.control_nets, out)
+            self.control_nets[out] = raw
+            return _mix(raw)
+        return raw
+
+    def _gate_pin_obs(self, idx):
+        _, out, _, in_nets, _ = self.circuit.gates[idx]
+        _, _, sense = _kernel(self.circuit.functions[idx])
+        probs = [self.c1[n] for n in in_nets]
+        out_obs = self.obs[out]
+        return [out_obs * sum(_row_prob(probs, r, i) for r in rows) for i, rows in enumerate(sense)]
+
+    def _net_obs(self, net):
+        if self._observed(net):
+            return 1.0
+        miss = 1.0
+        for load in self.circuit.net_loads[net]:
+            pins = self.pin_obs[load]
+            if pins is None:
+                continue
+            for n, o in zip(self.circuit.gates[load][3], pins):
+                if n == net:
+                    miss *= 1.0 - o
+        return 1.0 - miss
+
+    # ---------------------------------------------------------
+    # Incremental test-point insertion
+    # ---------------------------------------------------------
+    def _record(self, table, key):
+        if self._journal is not None and (id(table), key) not in self._journal:
+            self._journal[(id(table), key)] = (table, key, table.get(key) if isinstance(table, dict) else table[key])
+
+    def _set(self, table, key, value):
+        self._record(table, key)
+        table[key] = value
+
+    def insert_control_point(self, net):
+        """Inversion point: net XOR test-enable."""
+        if net in self.control_nets:
+            return
+        self._set(self.control_nets, net, self.c1[net])
+        self._update(c_seeds=[net])
+
+    def insert_observation_point(self, net):
+        if net in self.observe_nets:
+            return
+        self._record(self.__dict__, 'observe_nets')
+        self.observe_nets = self.observe_nets | {net}
+        self._update(o_seeds=[net])
+
+    def _update(self, c_seeds=(), o_seeds=()):
+        ckt = self.circuit
+        level, net_loads = ckt.level, ckt.net_loads
+        c1, obs = self.c1, self.obs
+        eps = self.epsilon
+
+        # Forward: controllability through the fanout cone
+        heap, queued, touched = [], set(), set()
+        for net in c_seeds:
+            value = _mix(self.control_nets[net])
+            if abs(value - c1[net]) > eps:
+                self._set(c1, net, value)
+                for load in net_loads[net]:
+                    if load not in queued and self.pin_obs[load] is not None:
+                        queued.add(load)
+                        heapq.heappush(heap, (level[load], load))
+        while heap:
+            _, idx = heapq.heappop(heap)
+            touched.add(idx)
+            out = ckt.gates[idx][1]
+            value = self._gate_c1(idx)
+            if abs(value - c1[out]) <= eps:
+                continue
+            self._set(c1, out, value)
+            for load in net_loads[out]:
+                if load not in queued and self.pin_obs[load] is not None:
+                    queued.add(load)
+                    heapq.heappush(heap, (level[load], load))
+
+        # Backward: gates whose side inputs or output observability changed
+        heap, queued = [], set()
+
+        def push_driver(net):
+            idx = ckt.gate_of_net.get(net)
+            if idx is not None and idx not in queued and self.pin_obs[idx] is not None:
+                queued.add(idx)
+                heapq.heappush(heap, (-level[idx], idx))
+
+        for idx in touched:
+            queued.add(idx)
+            heapq.heappush(heap, (-level[idx], idx))
+        for net in o_seeds:
+            value = self._net_obs(net)
+            if abs(value - obs[net]) > eps:
+                self._set(obs, net, value)
+                push_driver(net)
+        while heap:
+            _, idx = heapq.heappop(heap)
+            old = self.pin_obs[idx]
+            pins = self._gate_pin_obs(idx)
+            if all(abs(a - b) <= eps for a, b in zip(pins, old)):
+                continue
+            self._set(self.pin_obs, idx, pins)
+            for net in set(ckt.gates[idx][3]):
+                value = self._net_obs(net)
+                if abs(value - obs[net]) > eps:
+                    self._set(obs, net, value)
+                    push_driver(net)
+
+    def begin_trial(self):
+        self._journal = {}
+
+    def rollback(self):
+        for table, key, value in self._journal.values():
+            if isinstance(table, dict) and value is None:
+                table.pop(key, None)
+            else:
+                table[key] = value
+        self._journal = None
+
+    def commit(self):
+        self._journal = None
+
+    def changed_nets(self):
+        """Nets whose c1/obs moved during the current trial."""
+        return set(key for (tid, key) in self._journal if tid in (id(self.c1), id(self.obs)))
+
+    # ---------------------------------------------------------
+    # Detectability and candidate ranking
+    # ---------------------------------------------------------
+    def detectability(self, net, value):
+        """Probability a random pattern detects stuck-at-`value` on the net's driver."""
+        c1 = self.control_nets.get(net, self.c1[net])
+        return (c1 if value == 0 else 1.0 - c1) * self.obs[net]
+
+    def test_cost(self, targets):
+        """Sum of 1/p over (net, value) targets: expected patterns to detect them all."""
+        return sum(1.0 / max(self.detectability(net, v), MIN_DETECT) for net, v in targets)
+
+    def rank_candidates(self, candidates, targets, observation=False, epsilon=RANK_EPSILON):
+        """
+        Estimated drop in test_cost(targets) for a test point on each
+        candidate net, each evaluated as an incremental trial and rolled
+        back. Returns [(net, gain)] sorted best first.
+        """
+        self.epsilon, saved = epsilon, self.epsilon
+        by_net = defaultdict(list)
+        for net, value in targets:
+            by_net[net].append(value)
+        base = {(net, v): 1.0 / max(self.detectability(net, v), MIN_DETECT) for net, v in targets}
+
+        gains = []
+        for cand in candidates:
+            self.begin_trial()
+            if observation:
+                self.insert_observation_point(cand)
+            else:
+                self.insert_control_point(cand)
+            gain = 0.0
+            for net in self.changed_nets() | {cand}:
+                for v in by_net.get(net, ()):
+                    gain += base[(net, v)] - 1.0 / max(self.detectability(net, v), MIN_DETECT)
+            self.rollback()
+            gains.append((cand, gain))
+        self.epsilon = saved
+        instrument.count("cop_trials", len(candidates))
+        gains.sort(key=lambda x: x[1], reverse=True)
+        return gains
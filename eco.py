@@ -0,0 +1,222 @@
+from collections import defaultdict, deque
+
+import instrument
+import stage_1
+import stage_2
+import stage_3
+from compact_graph import PORT_IN, PORT_OUT
+from cone_scoring import score_victims
+
+# ==========================================
+# IN-MEMORY ECO LAYER
+# ==========================================
+# Applies the insertions the stage scripts emit as TCL directly to the
+# CompactGraph, so the next analysis or what-if iteration does not have
+# to wait for dc_shell and a fresh parse:
+#
+#   stage 1 : XOR inversion point on a node output (TPI_XOR_*)
+#   stage 2 : OR / AND forcing gate on a blocking side input (U_ATOMIC_FIX_*)
+#   stage 3 : XOR observation tree onto the observe port (U_OBS_XOR_*)
+#
+# Instance, net and pin names follow the TCL generators exactly.
+#
+# Cached results are invalidated by locality:
+#   - cone scores: a victim's score changes only if an edited instance
+#     lies in its fanin cone, i.e. the victim is in the edit's fanout
+#     (stopping at registers, as the cone trace does). Those victims'
+#     old contributions are subtracted before the edit and their new
+#     ones added after it; all other contributions are kept. When most
+#     victims are affected anyway, the scores are only marked stale and
+#     recomputed in one sweep by the next cone_scores() call.
+#   - trap analysis: depends only on the faulty gate's own pins, so only
+#     faults on gates whose pins were rewired are re-analyzed.
+
+XOR_CELL = "XOR2X1_LVT"
+OR_CELL  = "OR2X1_LVT"
+AND_CELL = "AND2X1_LVT"
+INV_CELL = "INVX0_LVT"
+
+
+class EcoSession:
+    def __init__(self, graph):
+        self.graph = graph
+        self.victims = []                 # Tracked victim IDs
+        self.scores = defaultdict(float)  # inst ID -> summed cone score of tracked victims
+        self._traps = {}                  # (gate ID, fault signature) -> stage_2.analyze_gate result
+        self.added = []                   # Names of inserted instances, in order
+        self.reconnected = {}             # inst ID -> {pin: new net name} of rewired original pins
+        self.assigns = []                 # (lhs, rhs) net aliases created by edits
+        self.base_insts = graph.num_insts # IDs from here on were created by edits
+        self.base_nets = graph.num_nets
+        self.rescored = 0                 # Victim cones recomputed by edits so far
+        self._stale = False               # Scores need a full recompute before use
+
+    # ---------------------------------------------------------
+    # Cached analyses
+    # ---------------------------------------------------------
+    def track_victims(self, names):
+        """Starts maintaining cone scores for these victim names."""
+        known = set(self.victims)
+        new = [i for i in (self.graph.inst_index(n) for n in names) if i >= 0 and i not in known]
+        for node, score in score_victims(self.graph, new).items():
+            self.scores[node] += score
+        self.victims.extend(new)
+
+    def cone_scores(self, victims):
+        """Drop-in for CircuitGraph.get_cone_scores: {node_name: weighted_score}."""
+        if self._stale:
+            self.scores = score_victims(self.graph, self.victims)
+            self.rescored += len(self.victims)
+            self._stale = False
+        self.track_victims(victims)
+        wanted = set(i for i in (self.graph.inst_index(v) for v in victims) if i >= 0)
+        if wanted != set(self.victims):
+            # A different victim set than the one tracked: score it directly
+            return dict((self.graph.inst_name(i), s) for i, s in score_victims(self.graph, list(wanted)).items())
+        names = self.graph.insts.names
+        return dict((names[i], s) for i, s in self.scores.items() if s > 1e-9)
+
+    def gate_traps(self, gate_id, signature):
+        """Cached stage_2.analyze_gate; pass as find_traps(analyzer, session.gate_traps)."""
+        key = (gate_id, signature)
+        if key not in self._traps:
+            self._traps[key] = stage_2.analyze_gate(self.graph, gate_id, signature)
+        return self._traps[key]
+
+    # ---------------------------------------------------------
+    # Invalidation
+    # ---------------------------------------------------------
+    def _affected_victims(self, roots):
+        """Tracked victims whose fanin cone contains any of `roots`."""
+        graph = self.graph
+        victims = set(self.victims)
+        roots = set(roots)
+        seen = set(roots)
+        queue = deque(roots)
+        hit = []
+        while queue:
+            node = queue.popleft()
+            if node in victims:
+                hit.append(node)
+            if node not in roots and graph.is_sequential(node):
+                continue    # Cones stop at registers
+            for load in graph.get_fanout(node):
+                if load not in seen:
+                    seen.add(load)
+                    queue.append(load)
+        return hit
+
+    def _edit(self, roots, apply):
+        """
+        Runs apply() with the cone scores of affected victims refreshed
+        around it. Returns the number of affected victims.
+        """
+        with instrument.phase("eco_edit"):
+            return self._run_edit(roots, apply)
+
+    def _run_edit(self, roots, apply):
+        affected = self._affected_victims([r for r in roots if r >= 0])
+        if 2 * len(affected) > len(self.victims):
+            self._stale = True
+        incremental = affected and not self._stale
+        if incremental:
+            for node, score in score_victims(self.graph, affected).items():
+                self.scores[node] -= score
+        rewired = apply()
+        self.graph.rebuild_adjacency()
+        if incremental:
+            for node, score in score_victims(self.graph, affected).items():
+                self.scores[node] += score
+            self.rescored += len(affected)
+
+        stale = set(rewired)
+        for key in [k for k in self._traps if k[0] in stale]:
+            del self._traps[key]
+        return len(affected)
+
+    def _add_cell(self, name, cell_type, pins):
+        self.graph.add_cell(name, cell_type, pins)
+        self.added.append(name)
+
+    def _reconnect(self, inst, pin, net_name):
+        old = self.graph.reconnect(inst, pin, net_name)
+        if old >= 0 and inst < self.base_insts:
+            self.reconnected.setdefault(inst, {})[pin] = net_name
+        return old
+
+    # ---------------------------------------------------------
+    # Stage 1: inversion points
+    # ---------------------------------------------------------
+    def insert_inversion_points(self, selected_nodes, test_port="TEST_ENABLE"):
+        """Mirrors stage_1.generate_tcl_script. Returns the number of affected victims."""
+        graph = self.graph
+        targets = []
+        for node, _ in selected_nodes:
+            inst = graph.inst_index(node)
+            if inst < 0:
+                continue
+            pin_name, xor_inst, new_net = stage_1.tpi_names(node, graph.cell_type(inst))
+            if pin_name in graph.pin_map(inst):
+                targets.append((inst, pin_name, xor_inst, new_net))
+
+        def apply():
+            graph.add_net(test_port, PORT_IN)
+            for inst, pin_name, xor_inst, new_net in targets:
+                target_net = graph.net_name(self._reconnect(inst, pin_name, new_net))
+                self._add_cell(xor_inst, XOR_CELL, [('A1', new_net), ('A2', test_port), ('Y', target_net)])
+            return [t[0] for t in targets]
+
+        return self._edit([t[0] for t in targets], apply)
+
+    # ---------------------------------------------------------
+    # Stage 2: forcing gates
+    # ---------------------------------------------------------
+    def insert_atomic_fixes(self, fixes, test_port="TEST_ENABLE"):
+        """Mirrors stage_2.generate_tcl. Returns the number of affected victims."""
+        graph = self.graph
+        gates = [graph.inst_index(fix['gate']) for fix in fixes]
+
+        def apply():
+            if any(fix['action'] == "FORCE_0" for fix in fixes) and graph.inst_index(stage_2.TE_INV_CELL) < 0:
+                self._add_cell(stage_2.TE_INV_CELL, INV_CELL, [('A', test_port), ('Y', stage_2.TE_INV_NET)])
+            rewired = []
+            for count, (fix, gate) in enumerate(zip(fixes, gates), 1):
+                if gate < 0:
+                    continue
+                inst_name, safe_net = stage_2.fix_names(count, fix['side_net'])
+                if fix['action'] == "FORCE_1":
+                    cell, control = OR_CELL, test_port
+                else:
+                    cell, control = AND_CELL, stage_2.TE_INV_NET
+                self._reconnect(gate, fix['gate_pin'], safe_net)
+                self._add_cell(inst_name, cell, [('A1', fix['side_net']), ('A2', control), ('Y', safe_net)])
+                rewired.append(gate)
+            return rewired
+
+        return self._edit(gates, apply)
+
+    # ---------------------------------------------------------
+    # Stage 3: observation tree
+    # ---------------------------------------------------------
+    def insert_observation_tree(self, obs_nets, obs_port="TEST_OBSERVE", num_ports=None, max_depth=None):
+        """
+        Mirrors stage_3.generate_xor_tcl. The trees only add loads to the
+        observed nets, so no cone score or trap result changes.
+        """
+        graph = self.graph
+        trees = stage_3.observation_trees(obs_nets, obs_port, num_ports, max_depth)
+
+        def apply():
+            for port_name, layers, root in trees:
+                for gates in layers:
+                    for inst, net_a, net_b, net_out in gates:
+                        self._add_cell(inst, XOR_CELL, [(stage_3.PIN_IN1, net_a), (stage_3.PIN_IN2, net_b),
+                                                        (stage_3.PIN_OUT, net_out)])
+                if root:
+                    # connect_net <root> <port>: the port aliases the root net
+                    port = graph.add_net(port_name, PORT_OUT)
+                    graph.net_driver[port] = graph.net_driver[graph.nets.get(root)]
+                    self.assigns.append((port_name, root))
+            return []
+
+        return self._edit([], apply)
@@ -0,0 +1,183 @@
+import re
+from array import array
+from collections import namedtuple
+
+import instrument
+from compact_graph import Interner
+from netlist_reader import open_text
+
+# ==========================================
+# STREAMING TETRAMAX FAULT-LIST READER
+# ==========================================
+# Reads `report_faults` / `write_faults` style listings, plain or .gz:
+#
+#    sa0   AU   U123/A1
+#    sa0   --   U122/Y        <- equivalent to the fault above it
+#
+# Each line is matched with one compiled pattern, so instance names that
+# happen to contain "ND" or "AU" are never mistaken for a fault class.
+# Faults are stored column-wise in flat arrays with interned names, and
+# the class index is built during the same pass; the per-instance index
+# is a CSR table derived from the stored columns on first use.
+
+FAULT_LINE = re.compile(r'^\s*(sa[01]|st[rf]|[a-z]{2,4}\d?)\s+([A-Z]{2}|--)\s+(\S+)')
+
+EQUIVALENT = "--"
+# Aborted / not detected / ATPG untestable: random-pattern-resistant targets
+RPR_CLASSES = ("ND", "AU", "AN", "AP", "NO")
+
+Fault = namedtuple('Fault', 'type cls inst pin equivalent')
+
+
+class FaultList:
+    def __init__(self):
+        self.types = Interner()
+        self.classes = Interner()
+        self.insts = Interner()
+        self.pins = Interner()
+
+        self.f_type  = bytearray()
+        self.f_class = bytearray()
+        self.f_inst  = array('i')   # -1: primary port fault (no instance)
+        self.f_pin   = array('i')   # port name for port faults
+        self.f_equiv = bytearray()  # 1: listed as "--" under a representative
+        self.f_rep   = array('i')   # representative fault ID (self if primary)
+
+        self.by_class = {}          # class code -> array of fault IDs
+        self._inst_ptr = None
+        self._inst_faults = None
+        self.lines_read = 0
+
+    def __len__(self):
+        return len(self.f_type)
+
+    # ---------------------------------------------------------
+    # Construction
+    # ---------------------------------------------------------
+    def add(self, ftype, cls, location, rep=-1):
+        fid = len(self.f_type)
+        equivalent = cls == EQUIVALENT
+        if equivalent and rep >= 0:
+            cls = self.classes.names[self.f_class[rep]]
+        else:
+            rep = fid
+        if "/" in location:
+            inst, pin = location.rsplit("/", 1)
+            inst_id = self.insts.add(inst)
+        else:
+            inst_id, pin = -1, location
+        self.f_type.append(self.types.add(ftype))
+        self.f_class.append(self.classes.add(cls))
+        self.f_inst.append(inst_id)
+        self.f_pin.append(self.pins.add(pin))
+        self.f_equiv.append(1 if equivalent else 0)
+        self.f_rep.append(rep)
+        self.by_class.setdefault(cls, array('i')).append(fid)
+        self._inst_ptr = None
+        return fid
+
+    # ---------------------------------------------------------
+    # Lookups
+    # ---------------------------------------------------------
+    def fault(self, fid):
+        inst = self.f_inst[fid]
+        return Fault(self.types.names[self.f_type[fid]],
+                     self.classes.names[self.f_class[fid]],
+                     self.insts.names[inst] if inst >= 0 else None,
+                     self.pins.names[self.f_pin[fid]],
+                     self.f_equiv[fid] == 1)
+
+    def __iter__(self):
+        for fid in range(len(self)):
+            yield self.fault(fid)
+
+    def with_class(self, *codes):
+        ids = []
+        for code in codes:
+            ids.extend(self.by_class.get(code, ()))
+        return sorted(ids)
+
+    def _build_instance_index(self):
+        num_insts = len(self.insts)
+        ptr = array('i', [0]) * (num_insts + 1)
+        for inst in self.f_inst:
+            if inst >= 0:
+                ptr[inst + 1] += 1
+        for i in range(num_insts):
+            ptr[i + 1] += ptr[i]
+        faults = array('i', [0]) * ptr[num_insts]
+        fill = array('i', ptr)
+        for fid, inst in enumerate(self.f_inst):
+            if inst >= 0:
+                faults[fill[inst]] = fid
+                fill[inst] += 1
+        self._inst_ptr, self._inst_faults = ptr, faults
+
+    def on_instance(self, name):
+        inst = self.insts.get(name)
+        if inst < 0:
+            return []
+        if self._inst_ptr is None:
+            self._build_instance_index()
+        return list(self._inst_faults[self._inst_ptr[inst]:self._inst_ptr[inst + 1]])
+
+    def on_pin(self, inst_name, pin):
+        pin_id = self.pins.get(pin)
+        return [fid for fid in self.on_instance(inst_name) if self.f_pin[fid] == pin_id]
+
+    def instances(self, classes=None, include_equivalent=True):
+        """Distinct instance names with at least one matching fault, in report order."""
+        wanted = None if classes is None else set(self.classes.get(c) for c in classes)
+        seen = bytearray(len(self.insts))
+        names = []
+        for fid in range(len(self)):
+            inst = self.f_inst[fid]
+            if inst < 0 or seen[inst]:
+                continue
+            if wanted is not None and self.f_class[fid] not in wanted:
+                continue
+            if not include_equivalent and self.f_equiv[fid]:
+                continue
+            seen[inst] = 1
+            names.append(self.insts.names[inst])
+        return names
+
+
+def read_fault_report(filename, classes=None, include_equivalent=True):
+    """
+    Streams a TetraMAX fault list (optionally .gz) into a FaultList.
+    `classes` keeps only faults whose (inherited) class is listed, so
+    memory is bounded by what the caller needs, not by the report size.
+    """
+    with instrument.phase("parse_fault_report", file=filename):
+        faults = _read_fault_report(filename, classes, include_equivalent)
+    if instrument.ENABLED:
+        instrument.count("fault_lines_read", faults.lines_read)
+        instrument.count("faults_kept", len(faults))
+    return faults
+
+
+def _read_fault_report(filename, classes, include_equivalent):
+    faults = FaultList()
+    keep = None if classes is None else set(classes)
+    rep = -1        # ID of the last primary fault kept
+    rep_class = None
+    match = FAULT_LINE.match
+    with open_text(filename) as f:
+        for line in f:
+            faults.lines_read += 1
+            m = match(line)
+            if not m:
+                continue
+            ftype, cls, location = m.groups()
+            if cls == EQUIVALENT:
+                if not include_equivalent or (keep is not None and rep_class not in keep):
+                    continue
+                faults.add(ftype, cls, location, rep)
+            else:
+                rep_class = cls
+                if keep is not None and cls not in keep:
+                    rep = -1
+                    continue
+                rep = faults.add(ftype, cls, location)
+    return faults
@@ -0,0 +1,275 @@
+import heapq
+import math
+import random
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+import instrument
+from cell_library import CONTROL_PINS, SEQUENTIAL_DATA_PINS, cell_function
+from compact_graph import PIN_OUT
+from graph_cache import load_graph
+from logic_model import LevelizedCircuit
+
+# ==========================================
+# BIT-PARALLEL RANDOM-PATTERN FAULT SIMULATOR
+# ==========================================
+# Full-scan stuck-at simulation on the LevelizedCircuit model:
+#   - sources   : driven with random words each pass
+#   - patterns  : WORD_BITS random patterns per pass, one bit each in a
+#                 Python int, so every gate evaluation covers the whole pass
+#   - faults    : parallel-pattern single-fault propagation, event-driven
+#                 through the fanout cone in level order
+#
+# The detection count per fault over N patterns estimates its detection
+# probability; faults below RPR_THRESHOLD are random-pattern resistant.
+
+WORD_BITS     = 1024
+NUM_PATTERNS  = 8192
+RPR_THRESHOLD = 1.0 / 4096   # Detection probability below this is "hard"
+SEED          = 2024
+
+SimFault = namedtuple('SimFault', 'inst pin value')
+
+
+class FaultSimulator(LevelizedCircuit):
+    def __init__(self, graph, control_points=(), seed=SEED):
+        """
+        control_points: instance IDs whose output net is XORed with an
+        independent random test-enable word (a stage 1 inversion TPI).
+        """
+        LevelizedCircuit.__init__(self, graph)
+        self.seed = seed
+        self.control_nets = set(graph.output_net(i) for i in control_points if graph.output_net(i) >= 0)
+
+    # ---------------------------------------------------------
+    # Good-machine simulation
+    # ---------------------------------------------------------
+    def good_values(self, rng, width):
+        mask = (1 << width) - 1
+        values = [0] * self.graph.num_nets
+        for net, bit in self.constants.items():
+            values[net] = mask if bit else 0
+        for net in self.sources:
+            values[net] = rng.getrandbits(width)
+        for qn, q in self.inverted_sources:
+            values[qn] = values[q] ^ mask
+        self.te_words = {net: rng.getrandbits(width) for net in self.control_nets}
+        for net, te in self.te_words.items():
+            if self.graph.net_driver[net] < 0 or net not in self.gate_of_net:
+                values[net] ^= te
+        for idx in self.order:
+            _, out, evaluate, in_nets, _ = self.gates[idx]
+            v = evaluate([values[n] for n in in_nets], mask)
+            te = self.te_words.get(out)
+            values[out] = v ^ te if te is not None else v
+        return values
+
+    # ---------------------------------------------------------
+    # Single-fault propagation (all patterns of a pass at once)
+    # ---------------------------------------------------------
+    def _propagate(self, values, mask, start_net, faulty_word, start_gate=None):
+        """Returns the detection word of a fault whose effect starts at start_net."""
+        gates, level, net_loads, observed = self.gates, self.level, self.net_loads, self.observed
+        te_words = self.te_words
+        push, pop = heapq.heappush, heapq.heappop
+        faulty = {start_net: faulty_word}
+        detect = (values[start_net] ^ faulty_word) if observed[start_net] else 0
+        heap = []
+        queued = set()
+        for load in net_loads[start_net]:
+            if load != start_gate and load not in queued:
+                queued.add(load)
+                push(heap, (level[load], load))
+        while heap:
+            _, idx = pop(heap)
+            _, out, evaluate, in_nets, _ = gates[idx]
+            v = evaluate([faulty[n] if n in faulty else values[n] for n in in_nets], mask)
+            if te_words and out in te_words:
+                v ^= te_words[out]
+            if v == values[out]:
+                continue
+            faulty[out] = v
+            if observed[out]:
+                detect |= v ^ values[out]
+            for load in net_loads[out]:
+                if load not in queued:
+                    queued.add(load)
+                    push(heap, (level[load], load))
+        return detect & mask
+
+    def fault_site(self, fault):
+        """
+        (net, gate) where the fault effect enters: gate is None for a stem
+        fault (output pin, every load sees it), the faulty gate index for
+        a branch fault on an input pin, or -1 for a flop data input.
+        Returns None when the fault can never be observed.
+        """
+        g = self.graph
+        for p in range(g.pin_ptr[fault.inst], g.pin_ptr[fault.inst + 1]):
+            if g.pin_names.names[g.pin_name[p]] != fault.pin:
+                continue
+            net = self.canonical[g.pin_net[p]]
+            if g.pin_dir[p] == PIN_OUT:
+                return (net, None)
+            if g.is_sequential(fault.inst):
+                return (net, -1) if fault.pin in SEQUENTIAL_DATA_PINS else None
+            for gidx in self.net_loads[net]:
+                if self.gates[gidx][0] == fault.inst:
+                    return (net, gidx)
+            return None
+        return None
+
+    def detect_word(self, values, mask, fault, site):
+        if site is None:
+            return 0
+        net, gidx = site
+        stuck = mask if fault.value else 0
+        if gidx is None:
+            # Stem fault: every load of the net sees the stuck value
+            te = self.te_words.get(net)
+            return self._propagate(values, mask, net, stuck ^ te if te is not None else stuck)
+        if gidx < 0:
+            return (values[net] ^ stuck) & mask
+
+        # Branch fault on an input pin: only this instance sees it
+        _, out, evaluate, in_nets, in_pins = self.gates[gidx]
+        words = [stuck if p == fault.pin else values[n] for p, n in zip(in_pins, in_nets)]
+        v = evaluate(words, mask)
+        te = self.te_words.get(out)
+        if te is not None:
+            v ^= te
+        if v == values[out]:
+            return 0
+        return self._propagate(values, mask, out, v, gidx)
+
+    def run(self, faults, num_patterns=NUM_PATTERNS, word_bits=WORD_BITS, drop_after=None):
+        """
+        Simulates `faults` (SimFault list) over num_patterns random patterns.
+        Returns an array of detection counts, one per fault. With
+        drop_after=k a fault stops being simulated once detected k times.
+        """
+        rng = random.Random(self.seed)
+        counts = array('i', [0]) * len(faults)
+        sites = [self.fault_site(f) for f in faults]
+        active = [fid for fid in range(len(faults)) if sites[fid] is not None]
+        with instrument.phase("fault_sim", faults=len(active)):
+            done = self._simulate(rng, counts, faults, sites, active, num_patterns, word_bits, drop_after)
+        instrument.count("patterns_simulated", done)
+        return counts
+
+    def _simulate(self, rng, counts, faults, sites, active, num_patterns, word_bits, drop_after):
+        done = 0
+        while done < num_patterns and active:
+            width = min(word_bits, num_patterns - done)
+            mask = (1 << width) - 1
+            values = self.good_values(rng, width)
+            still = []
+            for fid in active:
+                word = self.detect_word(values, mask, faults[fid], sites[fid])
+                if word:
+                    counts[fid] += bin(word).count('1')
+                if drop_after is None or counts[fid] < drop_after:
+                    still.append(fid)
+            active = still
+            done += width
+        return done
+
+
+# ==========================================
+# FAULT LISTS AND RESULTS
+# ==========================================
+def all_faults(graph):
+    """Uncollapsed stuck-at-0/1 list on every pin of every known cell."""
+    faults = []
+    for inst in range(graph.num_insts):
+        if not graph.is_sequential(inst) and cell_function(graph.cell_type(inst)) is None:
+            continue
+        for pin, _ in graph.pins(inst):
+            if pin in CONTROL_PINS:
+                continue
+            faults.append(SimFault(inst, pin, 0))
+            faults.append(SimFault(inst, pin, 1))
+    return faults
+
+
+def faults_from_report(graph, report, fault_ids=None):
+    """SimFaults for FaultList entries whose instance exists in the graph."""
+    faults = []
+    for fid in (range(len(report)) if fault_ids is None else fault_ids):
+        f = report.fault(fid)
+        inst = graph.inst_index(f.inst, escaped_fallback=True) if f.inst else -1
+        if inst >= 0 and f.type in ('sa0', 'sa1'):
+            faults.append(SimFault(inst, f.pin, 1 if f.type == 'sa1' else 0))
+        elif inst < 0 and f.inst:
+            instrument.count("faults_unknown_instance")
+    return faults
+
+
+def rpr_faults(faults, counts, num_patterns=NUM_PATTERNS, threshold=RPR_THRESHOLD):
+    return [f for f, c in zip(faults, counts) if float(c) / num_patterns < threshold]
+
+
+def write_fault_report(graph, faults, counts, filename, num_patterns=NUM_PATTERNS,
+                       threshold=RPR_THRESHOLD):
+    """
+    TetraMAX-style listing: detected faults are DS, random-pattern
+    resistant ones ND, so stage 1 reads the RPR victims directly.
+    """
+    with open(filename, 'w') as f:
+        f.write("// Random-pattern fault simulation: {} patterns, RPR threshold {:g}\n".format(num_patterns, threshold))
+        f.write("// p is a lower bound for faults dropped once detected often enough\n")
+        for fault, count in zip(faults, counts):
+            prob = float(count) / num_patterns
+            cls = "ND" if prob < threshold else "DS"
+            f.write(" sa{}   {}   {}/{}   // p={:.6f}\n".format(
+                fault.value, cls, graph.inst_name(fault.inst), fault.pin, prob))
+
+
+def prescreen_candidates(graph, candidates, faults, num_patterns=NUM_PATTERNS, threshold=RPR_THRESHOLD):
+    """
+    For each candidate instance ID, how many of `faults` stop being RPR
+    when an inversion test point is placed on its output.
+    """
+    baseline = FaultSimulator(graph).run(faults, num_patterns)
+    hard = [f for f, c in zip(faults, baseline) if float(c) / num_patterns < threshold]
+    gains = {}
+    for cand in candidates:
+        counts = FaultSimulator(graph, [cand]).run(hard, num_patterns)
+        gains[cand] = sum(1 for c in counts if float(c) / num_patterns >= threshold)
+    return gains
+
+
+# ==========================================
+# CLI
+# ==========================================
+# python fault_sim.py <netlist.v> <out.rpt> [num_patterns]
+#   Writes a TetraMAX-style report whose ND faults stage 1 reads as victims.
+def main(argv):
+    if len(argv) < 3:
+        print("Usage: python fault_sim.py <netlist.v> <out.rpt> [num_patterns]")
+        return 1
+    num_patterns = int(argv[3]) if len(argv) > 3 else NUM_PATTERNS
+
+    graph = load_graph(argv[1])
+    sim = FaultSimulator(graph)
+    faults = all_faults(graph)
+    print("[*] {} gates levelized, {} faults, {} unknown cells, {} loop gates".format(
+        len(sim.gates), len(faults), sim.unknown_cells, len(sim.loop_gates)))
+
+    start = time.time()
+    # A fault detected this often is not RPR; stop simulating it
+    counts = sim.run(faults, num_patterns, drop_after=int(math.ceil(RPR_THRESHOLD * num_patterns)))
+    elapsed = time.time() - start
+    hard = rpr_faults(faults, counts, num_patterns)
+    print("[*] Simulated {} patterns in {:.2f} s".format(num_patterns, elapsed))
+    print("    - {} random-pattern resistant faults".format(len(hard)))
+
+    write_fault_report(graph, faults, counts, argv[2], num_patterns)
+    print("[*] Wrote {}".format(argv[2]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
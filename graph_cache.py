@@ -0,0 +1,207 @@
+import hashlib
+import json
+import marshal
+import os
+import time
+from array import array
+
+import cell_library
+import instrument
+from compact_graph import CompactGraph, Interner
+from netlist_reader import PARSER_VERSION, open_text
+
+# ==========================================
+# PERSISTENT PARSED-NETLIST CACHE
+# ==========================================
+# A parsed CompactGraph is stored as one binary file named after the
+# SHA-1 of the netlist text plus the parser and cache format versions:
+#
+#   <cache_dir>/<sha1>-p<PARSER_VERSION>-f<CACHE_FORMAT>.graph
+#
+# Graphs built while a Liberty library is active (pin directions and
+# sequential flags come from it) add "-l<library sha1 prefix>" before the
+# version suffix.
+#
+# The payload is a marshal'ed dict of name blobs and raw array bytes, so
+# a hit costs one read, one split() per name table and a handful of
+# frombytes() calls. index.json remembers (size, mtime) -> sha1 per path
+# so unchanged files are not re-hashed. Files from other versions are deleted on sight and the
+# least recently used entries beyond MAX_ENTRIES are evicted.
+
+CACHE_DIR    = ".tpi_cache"
+CACHE_FORMAT = 1
+MAX_ENTRIES  = 8
+MAGIC        = b"TPIGRAPH"
+INDEX_FILE   = "index.json"
+
+NAME_TABLES = ('nets', 'insts', 'cells', 'pin_names')
+ARRAYS = ('inst_cell', 'inst_out', 'pin_ptr', 'pin_name', 'pin_net',
+          'net_driver', 'fanin_ptr', 'fanin', 'fanout_ptr', 'fanout')
+BYTE_ARRAYS = ('cell_seq', 'pin_dir', 'net_port')
+
+
+def _suffix():
+    return "-p{}-f{}.graph".format(PARSER_VERSION, CACHE_FORMAT)
+
+
+def _library_tag():
+    library = cell_library.LIBRARY
+    if library is None or not library.key:
+        return ""
+    return "-l" + library.key[:12]
+
+
+def content_hash(filename, block_size=1 << 20):
+    """SHA-1 of the (decompressed) netlist text."""
+    digest = hashlib.sha1()
+    with open_text(filename) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block.encode('latin-1'))
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------
+# Serialization
+# ---------------------------------------------------------
+# Name tables are stored as one newline-joined blob: Verilog identifiers
+# never contain a newline, and one split() is far cheaper than
+# unmarshalling millions of separate string objects.
+def _pack_names(names):
+    return "\n".join(names).encode('latin-1')
+
+
+def _unpack_names(blob):
+    return blob.decode('latin-1').split("\n") if blob else []
+
+
+def save_graph(graph, path):
+    payload = {
+        'names': {t: _pack_names(getattr(graph, t).names) for t in NAME_TABLES},
+        'arrays': {a: getattr(graph, a).tobytes() for a in ARRAYS},
+        'bytes': {b: bytes(getattr(graph, b)) for b in BYTE_ARRAYS},
+    }
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        marshal.dump(payload, f)
+    os.rename(tmp, path)   # Atomic: readers never see a partial file
+
+
+def read_graph(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a graph cache file: {}".format(path))
+        payload = marshal.load(f)
+    graph = CompactGraph()
+    for t in NAME_TABLES:
+        setattr(graph, t, Interner(_unpack_names(payload['names'][t])))
+    for a in ARRAYS:
+        data = array('i')
+        data.frombytes(payload['arrays'][a])
+        setattr(graph, a, data)
+    for b in BYTE_ARRAYS:
+        setattr(graph, b, bytearray(payload['bytes'][b]))
+    return graph
+
+
+# ---------------------------------------------------------
+# Index / eviction
+# ---------------------------------------------------------
+def _load_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_index(cache_dir, entries):
+    """Adds `entries` to index.json, keeping what other processes saved meanwhile."""
+    index = _load_index(cache_dir)
+    index.update(entries)
+    tmp = os.path.join(cache_dir, "{}.{}.tmp".format(INDEX_FILE, os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.rename(tmp, os.path.join(cache_dir, INDEX_FILE))
+
+
+def evict(cache_dir, max_entries=MAX_ENTRIES):
+    """
+    Drops other-version entries and all but the newest max_entries.
+    Other processes may evict the same files concurrently.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not name.endswith(".graph"):
+            continue
+        try:
+            if not name.endswith(_suffix()):
+                os.remove(path)
+                continue
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            continue    # Already removed by another process
+    entries.sort(reverse=True)
+    for _, path in entries[max_entries:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def netlist_key(filename, cache_dir=CACHE_DIR):
+    """Content hash of the netlist, reusing the index if size/mtime match."""
+    stat = os.stat(filename)
+    index = _load_index(cache_dir)
+    path = os.path.abspath(filename)
+    entry = index.get(path)
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+        return entry[2]
+    digest = content_hash(filename)
+    _save_index(cache_dir, {path: [stat.st_size, stat.st_mtime, digest]})
+    return digest
+
+
+def load_graph(filename, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+    """
+    Returns the CompactGraph for `filename`, parsing only on a cache
+    miss. cache_dir=None bypasses the cache. graph.cache_hit and
+    graph.load_time report what happened.
+    """
+    with instrument.phase("load_graph", file=filename):
+        return _load_graph(filename, cache_dir, max_entries)
+
+
+def _load_graph(filename, cache_dir, max_entries):
+    start = time.time()
+    if cache_dir is None:
+        graph = CompactGraph.from_netlist(filename)
+        graph.load_time = time.time() - start
+        return graph
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    entry = os.path.join(cache_dir, netlist_key(filename, cache_dir) + _library_tag() + _suffix())
+
+    graph = None
+    if os.path.exists(entry):
+        try:
+            graph = read_graph(entry)
+            os.utime(entry, None)   # Mark as recently used
+            graph.cache_hit = True
+        except (IOError, ValueError, EOFError, KeyError):
+            graph = None            # Corrupt entry: rebuild it
+    if graph is None:
+        instrument.count("cache_misses")
+        graph = CompactGraph.from_netlist(filename)
+        with instrument.phase("save_graph"):
+            save_graph(graph, entry)
+        evict(cache_dir, max_entries)
+    else:
+        instrument.count("cache_hits")
+    graph.load_time = time.time() - start
+    return graph
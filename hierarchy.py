@@ -0,0 +1,408 @@
+import argparse
+import re
+import sys
+import time
+from collections import deque
+
+import instrument
+from compact_graph import PIN_IN, PIN_OUT, CompactGraph, cell_pin_direction, is_sequential_cell
+from fault_report import read_fault_report
+from netlist_reader import Instance, NetlistReader, alias_map
+
+# ==========================================
+# HIERARCHICAL NETLISTS: LAZY ELABORATION
+# ==========================================
+# `write_file -hierarchy` netlists instantiate user modules inside other
+# modules. Flattening all of them multiplies memory by the number of
+# times each module is used, so instead:
+#
+#   1. one streaming pass keeps every module definition once (its leaf
+#      cells, submodule instances, assigns and port/wire widths);
+#   2. the fanin cones of the seeds (victim instances) are walked on
+#      demand through the definitions, across port connections, without
+#      building anything;
+#   3. only the module instances those cones touch are flattened into a
+#      CompactGraph.
+#
+# Flat names keep the hierarchical path: instance "u_core/u_alu/U12",
+# net "u_core/n5". A net crossing a port takes the name it has in the
+# highest module it reaches, so a driver inside u_alu and a load in the
+# top module meet on one net. Names in the generated TCL are therefore
+# the hierarchical paths dc_shell resolves with get_pins / get_nets.
+#
+# A single-module netlist elaborates to the same graph as
+# CompactGraph.from_netlist.
+
+CONSTANT_PATTERN = re.compile(r"^(\d*)'[sS]?([bBoOdDhH])([0-9a-fA-FxXzZ_?]+)$")
+RANGE_PATTERN    = re.compile(r"^(\\\S+|[A-Za-z_][\w$]*)\[(\d+):(\d+)\]$")
+RADIX = {'b': 2, 'o': 8, 'd': 10, 'h': 16}
+
+
+def is_constant(net):
+    return net[:1].isdigit()
+
+
+def _constant_bits(text):
+    """Sized/unsized literal -> ["1'b0" | "1'b1", ...], MSB first."""
+    m = CONSTANT_PATTERN.match(text)
+    if not m:
+        return [text]
+    digits = m.group(3).replace('_', '')
+    try:
+        value = int(digits, RADIX[m.group(2).lower()])
+    except ValueError:
+        value = 0       # x/z: tie low, as unknown constants count for nothing
+    width = int(m.group(1)) if m.group(1) else max(1, value.bit_length())
+    return ["1'b{}".format((value >> i) & 1) for i in range(width - 1, -1, -1)]
+
+
+def _split_concat(text):
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def connection_bits(expr, ranges):
+    """Bit-level nets of a port connection expression, MSB first."""
+    if expr.startswith('{') and expr.endswith('}'):
+        bits = []
+        for part in _split_concat(expr[1:-1]):
+            bits.extend(connection_bits(part, ranges))
+        return bits
+    if is_constant(expr):
+        return _constant_bits(expr)
+    m = RANGE_PATTERN.match(expr)
+    if m:
+        msb, lsb = int(m.group(2)), int(m.group(3))
+        step = 1 if lsb >= msb else -1
+        return ["{}[{}]".format(m.group(1), i) for i in range(msb, lsb + step, step)]
+    if expr in ranges:
+        msb, lsb = ranges[expr]
+        step = 1 if lsb >= msb else -1
+        return ["{}[{}]".format(expr, i) for i in range(msb, lsb + step, step)]
+    return [expr]
+
+
+class ModuleDef:
+    """One module definition, kept once no matter how often it is instantiated."""
+    def __init__(self, info):
+        self.info = info            # netlist_reader.ModuleInfo: ports, bit-level directions, ranges
+        self.name = info.name
+        self.cells = []             # Leaf cell Instances
+        self.children = []          # Instances of other modules in the file
+        self.assigns = []
+        self.aliases = {}           # Local `assign` chains: {lhs: root}
+        self.port_of = {}           # Alias root of a port bit -> port bit
+        self.cell_index = {}
+        self.child_index = {}
+        self.child_bits = []        # Per child: {child port bit: local net bit}
+        self._drivers = None        # Alias root -> [(child or -1, cell index or port bit)]
+        self.flat_cells = 0         # Leaf cells when fully flattened
+
+    def root(self, net):
+        return self.aliases.get(net, net)
+
+    def drivers(self, modules):
+        if self._drivers is None:
+            drivers = {}
+            for i, cell in enumerate(self.cells):
+                for pin, net in cell.pins:
+                    if pin is not None and cell_pin_direction(cell.cell_type, pin) == PIN_OUT:
+                        drivers.setdefault(self.root(net), []).append((-1, i))
+            for k, child in enumerate(self.children):
+                directions = modules[child.cell_type].info.directions
+                for port, net in self.child_bits[k].items():
+                    if directions.get(port) == 'output' and not is_constant(net):
+                        drivers.setdefault(self.root(net), []).append((k, port))
+            self._drivers = drivers
+        return self._drivers
+
+
+class Scope:
+    """One module instance in the hierarchy; created only when a walk reaches it."""
+    __slots__ = ('path', 'prefix', 'module', 'parent', 'child', 'children', 'names')
+
+    def __init__(self, path, module, parent=None, child=-1):
+        self.path = path            # "" for the top module
+        self.prefix = path + "/" if path else ""
+        self.module = module
+        self.parent = parent
+        self.child = child          # Index in parent.module.children
+        self.children = {}
+        self.names = {}             # Local net -> flat net name (memo)
+
+
+class Hierarchy:
+    def __init__(self, modules, top):
+        self.modules = modules      # {module name: ModuleDef}
+        self.top = top
+        self.root = Scope("", top)
+        self.bytes_read = 0
+        self.throughput = 0.0
+
+    # ---------------------------------------------------------
+    # Index (one pass, no flattening)
+    # ---------------------------------------------------------
+    @classmethod
+    def from_netlist(cls, filename):
+        reader = NetlistReader(filename)
+        records = {}
+        with instrument.phase("index_modules", file=filename):
+            for rec in reader.records():
+                records.setdefault(rec.module, []).append(rec)
+        top = reader.top_module()
+        if top is None:
+            raise ValueError("No top module in {}".format(filename))
+
+        modules = dict((name, ModuleDef(info)) for name, info in reader.modules.items())
+        for name, recs in records.items():
+            module = modules[name]
+            for rec in recs:
+                if rec.__class__ is not Instance:
+                    module.assigns.append(rec)
+                elif rec.cell_type in modules:
+                    module.child_index.setdefault(rec.name, len(module.children))
+                    module.children.append(rec)
+                else:
+                    module.cell_index.setdefault(rec.name, len(module.cells))
+                    module.cells.append(rec)
+        for module in modules.values():
+            module.aliases = alias_map(module.assigns)
+            module.port_of = dict((module.root(bit), bit) for bit in module.info.directions)
+            module.child_bits = [cls._port_map(module, child, modules[child.cell_type]) for child in module.children]
+
+        hierarchy = cls(modules, modules[top.name])
+        hierarchy._count_cells(hierarchy.top, set())
+        hierarchy.bytes_read = reader.bytes_read
+        hierarchy.throughput = reader.throughput()
+        if instrument.ENABLED:
+            instrument.count("netlist_bytes", reader.bytes_read)
+            instrument.count("modules_indexed", len(modules))
+        return hierarchy
+
+    @staticmethod
+    def _port_map(module, child, child_def):
+        """{child port bit: local net bit} of one submodule instance."""
+        bits = {}
+        ports = child_def.info.ports
+        for position, (pin, expr) in enumerate(child.pins):
+            if pin is None:
+                # Positional connection: port by header order
+                if position >= len(ports):
+                    continue
+                pin = ports[position]
+            if pin in child_def.info.ranges:
+                msb, lsb = child_def.info.ranges[pin]
+                step = 1 if lsb >= msb else -1
+                port_bits = ["{}[{}]".format(pin, i) for i in range(msb, lsb + step, step)]
+            else:
+                port_bits = [pin]
+            net_bits = connection_bits(expr, module.info.ranges)
+            # Verilog aligns both sides at the LSB
+            for port_bit, net_bit in zip(reversed(port_bits), reversed(net_bits)):
+                bits[port_bit] = net_bit
+        return bits
+
+    def _count_cells(self, module, active):
+        if module.flat_cells or module.name in active:
+            return module.flat_cells
+        active.add(module.name)
+        total = len(module.cells)
+        for child in module.children:
+            total += self._count_cells(self.modules[child.cell_type], active)
+        active.discard(module.name)
+        module.flat_cells = total
+        return total
+
+    # ---------------------------------------------------------
+    # Navigation
+    # ---------------------------------------------------------
+    def child_scope(self, scope, k):
+        child = scope.children.get(k)
+        if child is None:
+            inst = scope.module.children[k]
+            child = scope.children[k] = Scope(scope.prefix + inst.name, self.modules[inst.cell_type], scope, k)
+        return child
+
+    def resolve(self, name):
+        """(Scope, cell index) of a hierarchical leaf instance path, or None."""
+        scope, rest = self.root, name
+        while True:
+            module = scope.module
+            i = module.cell_index.get(rest)
+            if i is None:
+                i = module.cell_index.get("\\" + rest)
+            if i is not None:
+                return scope, i
+            head, sep, tail = rest.partition('/')
+            k = module.child_index.get(head)
+            if not sep or k is None:
+                return None
+            scope, rest = self.child_scope(scope, k), tail
+
+    def _up(self, scope, net):
+        """Moves a local net up through port connections to the highest scope it reaches."""
+        while scope.parent is not None and not is_constant(net):
+            port = scope.module.port_of.get(scope.module.root(net))
+            if port is None:
+                break
+            outer = scope.parent.module.child_bits[scope.child].get(port)
+            if outer is None:
+                break       # Port left unconnected by the parent
+            scope, net = scope.parent, outer
+        return scope, net
+
+    def net_name(self, scope, net):
+        """Flat name of a local net, shared by every module instance it passes through."""
+        name = scope.names.get(net)
+        if name is None:
+            outer, local = self._up(scope, net)
+            if outer.parent is None or is_constant(local):
+                # Top-level nets keep their names; `assign` aliases there are
+                # resolved by CompactGraph.finalize as for a flat netlist
+                name = local
+            else:
+                name = outer.prefix + outer.module.root(local)
+            scope.names[net] = name
+        return name
+
+    def drivers(self, scope, net):
+        """Leaf (Scope, cell index) pairs driving a local net, wherever they sit."""
+        scope, net = self._up(scope, net)
+        found = []
+        stack = [(scope, net)]
+        while stack:
+            scope, net = stack.pop()
+            for k, item in scope.module.drivers(self.modules).get(scope.module.root(net), ()):
+                if k < 0:
+                    found.append((scope, item))
+                else:
+                    stack.append((self.child_scope(scope, k), item))
+        return found
+
+    # ---------------------------------------------------------
+    # Demand-driven walk and elaboration
+    # ---------------------------------------------------------
+    def reach(self, seeds, cones=True):
+        """
+        Scopes holding the seed instances and, with cones=True, every
+        cell of their fanin cones (stopping at registers, as the cone
+        trace does). Returns (scopes in discovery order, unresolved seeds).
+        """
+        scopes = {}
+        seen = set()
+        queue = deque()
+        missing = 0
+        for name in seeds:
+            found = self.resolve(name)
+            if found is None:
+                missing += 1
+                continue
+            key = (found[0].path, found[1])
+            if key not in seen:
+                seen.add(key)
+                queue.append((found[0], found[1], True))
+        walked = 0
+        while queue:
+            scope, i, seed = queue.popleft()
+            scopes.setdefault(scope.path, scope)
+            walked += 1
+            cell = scope.module.cells[i]
+            if not cones or (not seed and is_sequential_cell(cell.cell_type)):
+                continue
+            for pin, net in cell.pins:
+                if pin is None or cell_pin_direction(cell.cell_type, pin) != PIN_IN:
+                    continue
+                for drv_scope, j in self.drivers(scope, net):
+                    key = (drv_scope.path, j)
+                    if key not in seen:
+                        seen.add(key)
+                        queue.append((drv_scope, j, False))
+        if instrument.ENABLED:
+            instrument.count("cone_cells_walked", walked)
+        return list(scopes.values()), missing
+
+    def all_scopes(self):
+        """Every module instance of the design (full flattening)."""
+        scopes = []
+        stack = [self.root]
+        while stack:
+            scope = stack.pop()
+            scopes.append(scope)
+            for k in range(len(scope.module.children) - 1, -1, -1):
+                stack.append(self.child_scope(scope, k))
+        return scopes
+
+    def elaborate(self, scopes=None):
+        """CompactGraph of the leaf cells of `scopes` (default: all), hierarchical names kept."""
+        if scopes is None:
+            scopes = self.all_scopes()
+        graph = CompactGraph()
+        with instrument.phase("elaborate", scopes=len(scopes)):
+            for scope in scopes:
+                prefix = scope.prefix
+                for cell in scope.module.cells:
+                    pins = [(pin, self.net_name(scope, net)) for pin, net in cell.pins]
+                    graph.add_instance(prefix + cell.name, cell.cell_type, pins)
+            graph.finalize(self.top.aliases, self.top.info.directions)
+        graph.throughput = self.throughput
+        return graph
+
+    def region(self, seeds, cones=True):
+        """Elaborates only what the seeds' fanin cones reach; prints what was kept."""
+        start = time.time()
+        scopes, missing = self.reach(seeds, cones)
+        graph = self.elaborate(scopes)
+        print("    - Elaborated {} module instances: {} of {} cells ({:.0f} ms).".format(
+            len(scopes), graph.num_insts, self.top.flat_cells, (time.time() - start) * 1000))
+        if missing:
+            print("    - {} seed instances not found in the hierarchy.".format(missing))
+            instrument.count("faults_unknown_instance", missing)
+        graph.load_time = time.time() - start
+        return graph
+
+
+def load_hierarchy(filename):
+    print("[*] Indexing Hierarchical Netlist: {}...".format(filename))
+    start = time.time()
+    hierarchy = Hierarchy.from_netlist(filename)
+    print("    - {} modules, top {} ({} cells when flat, {:.1f} s).".format(
+        len(hierarchy.modules), hierarchy.top.name, hierarchy.top.flat_cells, time.time() - start))
+    return hierarchy
+
+
+# ---------------------------------------------------------
+# CLI
+# ---------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description="Index a hierarchical netlist and elaborate the fault-cone region.")
+    parser.add_argument("netlist", help="Hierarchical gate-level netlist")
+    parser.add_argument("report", nargs="?", default=None, help="Fault report whose instances seed the region")
+    parser.add_argument("--no-cones", action="store_true", help="Only the module instances holding the faults")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    hierarchy = load_hierarchy(args.netlist)
+    if args.report:
+        seeds = read_fault_report(args.report).instances()
+        print("[*] Elaborating the region of {} fault instances...".format(len(seeds)))
+        graph = hierarchy.region(seeds, not args.no_cones)
+    else:
+        print("[*] Elaborating the whole design...")
+        graph = hierarchy.elaborate()
+    print("    - {} instances, {} nets.".format(graph.num_insts, graph.num_nets))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:     # Windows: no peak RSS
+    resource = None
+
+# ==========================================
+# RUN INSTRUMENTATION
+# ==========================================
+# Per-phase wall/CPU timers, peak RSS and named counters for every stage.
+# Off by default; call enable() (tpi_pipeline --profile) to record.
+#
+#   with instrument.phase("parse_netlist"):
+#       ...
+#   if instrument.ENABLED:
+#       instrument.count("nodes_visited", len(cone))
+#
+# When disabled, phase() returns one shared no-op context manager and
+# call sites test instrument.ENABLED before counting, so hot loops pay
+# nothing. Always use `import instrument` -- a from-import would freeze
+# the flag at import time.
+#
+# export() writes either a JSON summary or a Chrome trace
+# (chrome://tracing, Perfetto) with one slice per phase.
+
+ENABLED = False
+
+_events = []        # Finished phases: (name, start_us, dur_us, cpu_s, rss_mb, depth, args)
+_counters = {}
+_maxima = {}
+_depth = [0]
+_origin = [0.0]
+
+
+def enable():
+    global ENABLED
+    reset()
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    del _events[:]
+    _counters.clear()
+    _maxima.clear()
+    _depth[0] = 0
+    _origin[0] = time.perf_counter()
+
+
+def rss_peak_mb():
+    """Peak resident set size of this process so far, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+# ---------------------------------------------------------
+# Recording
+# ---------------------------------------------------------
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ('name', 'args', 'start', 'cpu')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        _depth[0] += 1
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        _depth[0] -= 1
+        _events.append((self.name, (self.start - _origin[0]) * 1e6, (end - self.start) * 1e6,
+                        time.process_time() - self.cpu, rss_peak_mb(), _depth[0], self.args))
+        return False
+
+
+def phase(name, **args):
+    """Context manager timing one phase; extra keyword args end up in the trace."""
+    if not ENABLED:
+        return _NULL_PHASE
+    return _Phase(name, args)
+
+
+def count(name, amount=1):
+    if ENABLED:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def high_water(name, value):
+    if ENABLED and value > _maxima.get(name, -1):
+        _maxima[name] = value
+
+
+# ---------------------------------------------------------
+# Export
+# ---------------------------------------------------------
+def summary():
+    """{'phases': {name: totals}, 'counters': {...}, 'maxima': {...}}"""
+    phases = {}
+    for name, _, dur, cpu, rss, _, _ in _events:
+        entry = phases.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rss_peak_mb': None})
+        entry['calls'] += 1
+        entry['wall_s'] += dur / 1e6
+        entry['cpu_s'] += cpu
+        if rss is not None:
+            entry['rss_peak_mb'] = max(entry['rss_peak_mb'] or 0.0, rss)
+    for entry in phases.values():
+        entry['wall_s'] = round(entry['wall_s'], 6)
+        entry['cpu_s'] = round(entry['cpu_s'], 6)
+    return {'phases': phases, 'counters': dict(_counters), 'maxima': dict(_maxima),
+            'rss_peak_mb': rss_peak_mb()}
+
+
+def chrome_trace():
+    pid = os.getpid()
+    events = []
+    for name, start, dur, cpu, rss, depth, args in _events:
+        fields = dict(args)
+        fields['cpu_s'] = round(cpu, 6)
+        if rss is not None:
+            fields['rss_peak_mb'] = round(rss, 1)
+        events.append({'name': name, 'ph': 'X', 'ts': round(start, 1), 'dur': round(dur, 1),
+                       'pid': pid, 'tid': 0, 'args': fields})
+    end = max([e['ts'] + e['dur'] for e in events] + [0.0])
+    for name, value in sorted(list(_counters.items()) + list(_maxima.items())):
+        events.append({'name': name, 'ph': 'C', 'ts': end, 'pid': pid, 'tid': 0, 'args': {name: value}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def export(filename, fmt="json"):
+    """fmt: "json" (summary) or "chrome" (trace events)."""
+    data = chrome_trace() if fmt == "chrome" else summary()
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+def print_summary():
+    data = summary()
+    print("[*] Profile:")
+    print("    Phase                      Calls     Wall s      CPU s    RSS MB")
+    order = sorted(data['phases'].items(), key=lambda kv: kv[1]['wall_s'], reverse=True)
+    for name, p in order:
+        print("    {:26} {:5} {:10.3f} {:10.3f} {:9.1f}".format(
+            name, p['calls'], p['wall_s'], p['cpu_s'], p['rss_peak_mb'] or 0.0))
+    for name, value in sorted(list(data['counters'].items()) + list(data['maxima'].items())):
+        print("    - {}: {}".format(name, value))
@@ -0,0 +1,440 @@
+import argparse
+import marshal
+import os
+import re
+import sys
+import time
+from array import array
+
+import cell_library
+import instrument
+from cell_library import expression_function
+from graph_cache import CACHE_DIR, content_hash, netlist_key
+from netlist_reader import open_text
+
+# ==========================================
+# LIBERTY (.lib) CELL INDEX
+# ==========================================
+# Streams a Liberty library and keeps, per cell, only what the parsers
+# need: pin directions in declaration order, whether the cell is
+# sequential (an ff / latch / statetable group) and the boolean
+# `function` of each output pin. Timing and power tables -- nearly all
+# of a production .lib -- are skipped by counting braces.
+#
+#   library = liberty.load_library("saed32lvt_tt.lib")
+#   cell_library.set_library(library)   # every parser now consults it
+#
+# The index is cached as one marshal'ed file next to the graph cache:
+#
+#   <cache_dir>/<sha1>-l<LIBERTY_VERSION>.libidx
+#
+# keyed by the content hash of the .lib (reusing graph_cache's
+# size/mtime index), so later runs load it in milliseconds.
+
+LIBERTY_FILE    = None          # Default library for the CLI (None: name rules only)
+LIBERTY_VERSION = 1             # Bump whenever the index built from the same file changes
+CHUNK_SIZE      = 4 * 1024 * 1024
+MAGIC           = b"TPILIBIDX"
+
+COMMENT_PATTERN = re.compile(r'/\*.*?\*/|//[^\n]*', re.S)
+# One statement per match: a group header `name (args) {`, a complex
+# attribute `name (args) ;`, a simple attribute `name : value ;` or `}`
+STATEMENT_PATTERN = re.compile(r"""
+    \s* (?:
+        ([A-Za-z_][\w.]*) \s* \( ([^)]*) \) \s* (\{)? \s* ;?
+      | ([A-Za-z_][\w.]*) \s* : \s* ("[^"]*" | [^;\n{}]*) \s* ;?
+      | (\})
+    )
+""", re.X)
+
+BRACE_PATTERN = re.compile(r'[{}]')
+
+SEQUENTIAL_GROUPS = frozenset(('ff', 'latch', 'ff_bank', 'latch_bank', 'statetable'))
+BUS_GROUPS = frozenset(('bus', 'bundle'))
+DIRECTIONS = ('input', 'output', 'inout', 'internal')
+INTERNAL = 3
+
+
+class LibertyCell:
+    __slots__ = ('name', 'pins', 'sequential', 'functions', '_function')
+
+    def __init__(self, name, pins, sequential, functions):
+        self.name = name
+        self.pins = pins              # ((pin, 'input'|'output'|'inout'|'internal'), ...)
+        self.sequential = sequential
+        self.functions = functions    # {output pin: Liberty function string}
+        self._function = False        # CellFunction, compiled on first use
+
+    def direction(self, pin):
+        for name, direction in self.pins:
+            if name == pin:
+                return direction
+        return None
+
+    @property
+    def function(self):
+        """CellFunction of the first output with a function; None for sequential cells."""
+        if self._function is False:
+            self._function = None
+            if not self.sequential:
+                inputs = [p for p, d in self.pins if d == 'input']
+                for pin, direction in self.pins:
+                    if direction == 'output' and pin in self.functions:
+                        try:
+                            self._function = expression_function(self.name, self.functions[pin], pin, inputs)
+                        except ValueError:
+                            pass
+                        break
+        return self._function
+
+
+class Library:
+    """
+    Cells stored column-wise, as in the graph cache, so the binary index
+    loads with a few bulk reads; a LibertyCell is only built the first
+    time a parser asks for that cell.
+    """
+    def __init__(self, name=None, key=None):
+        self.name = name
+        self.key = key                # Content hash of the .lib (part of the graph cache key)
+        self.cell_names = []
+        self.cell_seq = bytearray()   # cell -> 1 if sequential
+        self.pin_ptr = array('i', [0])
+        self.pin_names = []           # pins of cell c: [pin_ptr[c]:pin_ptr[c+1]]
+        self.pin_dir = bytearray()    # pin -> index into DIRECTIONS
+        self.pin_func = []            # pin -> Liberty function string ('' if none)
+        self.cache_hit = False
+        self.load_time = 0.0
+        self._index = None            # cell name -> position, built on first lookup
+        self._cells = {}
+
+    def add_cell(self, name, pins, sequential):
+        """`pins` = [(pin, direction, function or '')] in declaration order."""
+        self.cell_names.append(name)
+        self.cell_seq.append(1 if sequential else 0)
+        for pin, direction, function in pins:
+            self.pin_names.append(pin)
+            self.pin_dir.append(DIRECTIONS.index(direction) if direction in DIRECTIONS else INTERNAL)
+            self.pin_func.append(function)
+        self.pin_ptr.append(len(self.pin_names))
+        self._index = None
+
+    def get(self, name):
+        """LibertyCell for a cell name, or None."""
+        cell = self._cells.get(name)
+        if cell is None:
+            if self._index is None:
+                self._index = dict(zip(self.cell_names, range(len(self.cell_names))))
+            c = self._index.get(name)
+            if c is None:
+                return None
+            lo, hi = self.pin_ptr[c], self.pin_ptr[c + 1]
+            pins = tuple((self.pin_names[p], DIRECTIONS[self.pin_dir[p]]) for p in range(lo, hi))
+            functions = dict((self.pin_names[p], self.pin_func[p]) for p in range(lo, hi) if self.pin_func[p])
+            cell = self._cells[name] = LibertyCell(name, pins, self.cell_seq[c] == 1, functions)
+        return cell
+
+    def __len__(self):
+        return len(self.cell_names)
+
+
+def _unquote(text):
+    # Newlines would break the name blobs of the binary index
+    return text.replace('\n', ' ').strip().strip('"').strip()
+
+
+# ---------------------------------------------------------
+# Streaming reader
+# ---------------------------------------------------------
+class LibertyReader:
+    def __init__(self, filename, chunk_size=CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.library = Library()
+        self.bytes_read = 0
+        self.statements = 0
+
+        self._stack = []        # Open groups: (group type, [names])
+        self._cell = None       # [name, {pin: [direction, function]}, pin order, sequential]
+        self._pins = ()         # Pin entries the innermost pin/bus group sets
+        self._skip = 0          # Brace depth left in a skipped group
+
+    def _chunks(self, f):
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                return
+            # Extend to the end of the line so no token is split in two
+            if not chunk.endswith('\n'):
+                chunk += f.readline()
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    def read(self):
+        """Parses the whole file; returns a Library (without a cache key)."""
+        with open_text(self.filename) as f:
+            pending = ''
+            for chunk in self._chunks(f):
+                text = pending + chunk
+                if text.rfind('/*') > text.rfind('*/'):
+                    # Block comment runs into the next chunk
+                    pending = text
+                    continue
+                text = COMMENT_PATTERN.sub(' ', text).replace('\\\n', ' ')
+                # Only complete statements: cut after the last one ending a line
+                cut = max(text.rfind(';\n'), text.rfind('{\n'), text.rfind('}\n'))
+                if cut < 0:
+                    pending = text
+                    continue
+                self._parse(text, cut + 1)
+                pending = text[cut + 1:]
+            if pending.strip():
+                text = COMMENT_PATTERN.sub(' ', pending).replace('\\\n', ' ')
+                self._parse(text, len(text))
+        return self.library
+
+    def _parse(self, text, end):
+        match = STATEMENT_PATTERN.match
+        pos = 0
+        while pos < end:
+            if self._skip:
+                pos = self._skip_group(text, pos, end)
+                continue
+            m = match(text, pos)
+            if m is None:
+                # Stray text: resume on the next line
+                nl = text.find('\n', pos)
+                pos = end if nl < 0 else nl + 1
+                continue
+            pos = m.end()
+            self.statements += 1
+            if m.group(6):
+                self._close()
+            elif m.group(3):
+                if not self._open(m.group(1).lower(), m.group(2)):
+                    self._skip = 1
+            elif m.group(4):
+                self._attribute(m.group(4), m.group(5))
+
+    def _skip_group(self, text, pos, end):
+        """Skips to the end of an ignored group (timing, power, ...); may span chunks."""
+        for m in BRACE_PATTERN.finditer(text, pos, end):
+            if m.group() == '{':
+                self._skip += 1
+            else:
+                self._skip -= 1
+                if not self._skip:
+                    return m.end()
+        return end
+
+    def _open(self, group, args):
+        """Enters a group; False if nothing in it is indexed, so the caller skips it."""
+        parent = self._stack[-1][0] if self._stack else None
+        if group == 'library' and parent is None:
+            names = [_unquote(a) for a in args.split(',') if a.strip()]
+            self.library.name = names[0] if names else None
+        elif self._cell is None:
+            if group != 'cell' or parent != 'library' or not args.strip():
+                return False
+            self._cell = [_unquote(args.split(',')[0]), {}, [], False]
+        elif group in SEQUENTIAL_GROUPS and parent == 'cell':
+            self._cell[3] = True
+            return False
+        elif group == 'pin' and (parent == 'cell' or parent in BUS_GROUPS):
+            names = [_unquote(a) for a in args.split(',') if a.strip()]
+            inherited = self._pins[0][0] if parent in BUS_GROUPS and self._pins else None
+            self._pins = [self._pin_entry(name, inherited) for name in names]
+        elif group in BUS_GROUPS and parent == 'cell':
+            names = [_unquote(a) for a in args.split(',') if a.strip()]
+            self._pins = [self._pin_entry(name, None) for name in names]
+        else:
+            return False
+        self._stack.append((group, None if group in ('library', 'cell') else names))
+        return True
+
+    def _pin_entry(self, name, direction):
+        pins = self._cell[1]
+        entry = pins.get(name)
+        if entry is None:
+            entry = pins[name] = [direction, None]
+            self._cell[2].append(name)
+        return entry
+
+    def _close(self):
+        if not self._stack:
+            return
+        group, _ = self._stack.pop()
+        if group == 'cell' and self._cell is not None:
+            name, pins, order, sequential = self._cell
+            self.library.add_cell(name, [(pin, pins[pin][0], pins[pin][1] or '') for pin in order], sequential)
+            self._cell = None
+            self._pins = ()
+        elif group == 'pin' and self._stack and self._stack[-1][0] in BUS_GROUPS and self._cell is not None:
+            # Back in the bus: its own entry takes attributes again
+            self._pins = [self._cell[1][n] for n in self._stack[-1][1] if n in self._cell[1]]
+        elif group == 'pin' or group in BUS_GROUPS:
+            self._pins = ()
+
+    def _attribute(self, name, value):
+        if not self._pins or self._stack[-1][0] not in ('pin', 'bus', 'bundle'):
+            return
+        if name == 'direction':
+            for entry in self._pins:
+                entry[0] = _unquote(value).lower()
+        elif name == 'function':
+            for entry in self._pins:
+                entry[1] = _unquote(value)
+
+
+def read_liberty(filename):
+    """Parses `filename` (.lib or .lib.gz) into a Library, without caching."""
+    start = time.time()
+    reader = LibertyReader(filename)
+    with instrument.phase("parse_liberty", file=filename):
+        library = reader.read()
+    if instrument.ENABLED:
+        instrument.count("liberty_bytes", reader.bytes_read)
+        instrument.count("liberty_statements", reader.statements)
+    library.load_time = time.time() - start
+    return library
+
+
+# ---------------------------------------------------------
+# Binary cache
+# ---------------------------------------------------------
+def _suffix():
+    return "-l{}.libidx".format(LIBERTY_VERSION)
+
+
+# Name and function tables are stored as newline-joined blobs, as in
+# graph_cache.py: one split() is far cheaper than unmarshalling many
+# small tuples.
+def _pack(strings):
+    return "\n".join(strings).encode('latin-1')
+
+
+def _unpack(blob, count):
+    return blob.decode('latin-1').split("\n") if count else []
+
+
+def save_library(library, path):
+    payload = {
+        'name': library.name,
+        'cells': _pack(library.cell_names),
+        'cell_seq': bytes(library.cell_seq),
+        'pin_ptr': library.pin_ptr.tobytes(),
+        'pins': _pack(library.pin_names),
+        'pin_dir': bytes(library.pin_dir),
+        'functions': _pack(library.pin_func),
+    }
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        marshal.dump(payload, f)
+    os.rename(tmp, path)   # Atomic: readers never see a partial file
+
+
+def read_library(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a library index file: {}".format(path))
+        payload = marshal.load(f)
+    library = Library(payload['name'])
+    library.cell_seq = bytearray(payload['cell_seq'])
+    library.cell_names = _unpack(payload['cells'], len(library.cell_seq))
+    library.pin_ptr = array('i')
+    library.pin_ptr.frombytes(payload['pin_ptr'])
+    library.pin_dir = bytearray(payload['pin_dir'])
+    library.pin_names = _unpack(payload['pins'], len(library.pin_dir))
+    library.pin_func = _unpack(payload['functions'], len(library.pin_dir))
+    if len(library.cell_names) != len(library.cell_seq) or len(library.pin_names) != len(library.pin_dir):
+        raise ValueError("Truncated library index file: {}".format(path))
+    return library
+
+
+def load_library(filename, cache_dir=CACHE_DIR):
+    """
+    Returns the Library for `filename`, parsing only on a cache miss.
+    cache_dir=None bypasses the cache. library.cache_hit and
+    library.load_time report what happened.
+    """
+    with instrument.phase("load_liberty", file=filename):
+        return _load_library(filename, cache_dir)
+
+
+def _load_library(filename, cache_dir):
+    start = time.time()
+    if cache_dir is None:
+        library = read_liberty(filename)
+        library.key = content_hash(filename)
+        library.load_time = time.time() - start
+        return library
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    key = netlist_key(filename, cache_dir)
+    entry = os.path.join(cache_dir, key + _suffix())
+
+    library = None
+    if os.path.exists(entry):
+        try:
+            library = read_library(entry)
+            library.cache_hit = True
+        except (IOError, ValueError, EOFError, KeyError, TypeError):
+            library = None          # Corrupt entry: rebuild it
+    if library is None:
+        library = read_liberty(filename)
+        save_library(library, entry)
+        for name in os.listdir(cache_dir):
+            # Indexes of this file from other versions are dead weight
+            if name.startswith(key) and name.endswith(".libidx") and name != os.path.basename(entry):
+                os.remove(os.path.join(cache_dir, name))
+    library.key = key
+    library.load_time = time.time() - start
+    return library
+
+
+def use_library(filename, cache_dir=CACHE_DIR):
+    """Loads `filename` and makes it the active library; returns it."""
+    print("[*] Loading Liberty Library: {}...".format(filename))
+    library = load_library(filename, cache_dir)
+    source = "cache" if library.cache_hit else "parse"
+    print("    - {} cells from {} ({:.0f} ms, {}).".format(len(library), library.name, library.load_time * 1000, source))
+    cell_library.set_library(library)
+    return library
+
+
+# ---------------------------------------------------------
+# CLI
+# ---------------------------------------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description="Index a Liberty library and show what the parsers see.")
+    parser.add_argument("liberty", nargs="?", default=LIBERTY_FILE, help=".lib or .lib.gz file")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Index cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse the library")
+    parser.add_argument("--cell", action="append", default=[], help="Print the index entry of this cell")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.liberty:
+        print("Error: no Liberty file given.")
+        return 1
+    library = use_library(args.liberty, None if args.no_cache else args.cache_dir)
+    sequential = sum(library.cell_seq)
+    print("    - {} sequential, {} combinational.".format(sequential, len(library) - sequential))
+    for name in args.cell:
+        cell = library.get(name)
+        if cell is None:
+            print("    {}: not in library".format(name))
+            continue
+        print("    {}{}".format(name, " (sequential)" if cell.sequential else ""))
+        for pin, direction in cell.pins:
+            function = cell.functions.get(pin)
+            print("        {:8} {:8} {}".format(pin, direction, function or ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
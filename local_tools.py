@@ -0,0 +1,256 @@
+import argparse
+import fnmatch
+import sys
+import time
+from collections import OrderedDict
+
+import fault_sim
+from compact_graph import PORT_IN, PORT_OUT, CompactGraph
+from eco import AND_CELL, INV_CELL, OR_CELL, XOR_CELL, EcoSession
+from netlist_writer import verify_netlist, write_netlist
+
+# ==========================================
+# LOCAL TOOL STAND-INS
+# ==========================================
+# Offline replacements for the two EDA steps of the closed loop
+# (closed_loop.py --tools local):
+#
+#   profile : fault_sim.py random-pattern simulation instead of tmax,
+#             writing the same TetraMAX-style fault list
+#   insert  : applies the stage TCL scripts to the netlist instead of
+#             dc_shell, through the ECO layer and netlist_writer
+#
+# The insert stand-in interprets the command subset the stage
+# generators emit in per-pin mode: set with get_lib_cells / get_pins /
+# get_nets -of_objects / index_collection, create_port, create_net,
+# create_cell, connect_net and disconnect_net. Bulk (foreach) scripts
+# are rejected. There is no incremental compile: the output is the
+# netlist with the test logic wired in, as dc_shell would hold it right
+# after `source`.
+#
+#   python local_tools.py insert b10.v insert_tpi_logic.tcl -o b10_tpi.v
+#   python local_tools.py profile b10.v stage1_failures.rpt 8192
+
+LIB_CELLS = (XOR_CELL, OR_CELL, AND_CELL, INV_CELL)   # What get_lib_cells can find
+PORT_DIRECTIONS = {'in': PORT_IN, 'out': PORT_OUT}
+
+
+class TclError(Exception):
+    pass
+
+
+def tcl_commands(text):
+    """Splits a script into commands: one per line, braces may span lines."""
+    command, depth = [], 0
+    for line in text.splitlines():
+        if not command and (not line.strip() or line.lstrip().startswith('#')):
+            continue
+        command.append(line)
+        depth += line.count('{') - line.count('}')
+        if depth <= 0:
+            yield ' '.join(command).strip()
+            command, depth = [], 0
+    if command:
+        yield ' '.join(command).strip()
+
+
+def tcl_words(command):
+    """Top-level words; {braced} and [bracketed] words keep their delimiters."""
+    words, word, depth = [], [], 0
+    for ch in command:
+        if ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+        if ch.isspace() and depth == 0:
+            if word:
+                words.append(''.join(word))
+                word = []
+        else:
+            word.append(ch)
+    if word:
+        words.append(''.join(word))
+    return words
+
+
+class TclApplier:
+    """Runs stage TCL against an EcoSession; cells are added once their pins are known."""
+    def __init__(self, session):
+        self.session = session
+        self.graph = session.graph
+        self.vars = {}
+        self.pending = OrderedDict()    # New cell -> [lib cell, OrderedDict(pin -> net)]
+        self.loose = {}                 # (inst ID, pin) disconnected and not yet reconnected
+        self.commands = 0
+
+    # ---------------------------------------------------------
+    # Evaluation
+    # ---------------------------------------------------------
+    def value(self, word):
+        if word.startswith('{') and word.endswith('}'):
+            return word[1:-1]
+        if word.startswith('[') and word.endswith(']'):
+            return self.call(tcl_words(word[1:-1]))
+        if word.startswith('$'):
+            if word[1:] not in self.vars:
+                raise TclError("unknown variable {}".format(word))
+            return self.vars[word[1:]]
+        return word
+
+    def call(self, words):
+        name, args = words[0], [self.value(w) for w in words[1:]]
+        if name in ('get_object_name', 'get_pins', 'get_ports', 'index_collection'):
+            return args[0]
+        if name == 'get_lib_cells':
+            pattern = args[0].rsplit('/', 1)[-1]
+            matches = fnmatch.filter(LIB_CELLS, pattern)
+            return matches[0] if matches else pattern.replace('*', '')
+        if name == 'get_nets' and args[0] == '-of_objects':
+            return self.net_of(args[1])
+        raise TclError("unsupported command {}".format(name))
+
+    def run(self, command):
+        words = tcl_words(command)
+        head = words[0]
+        self.commands += 1
+        if head in ('echo', 'if'):
+            # Library checks and messages
+            return
+        if head == 'set' and len(words) == 3:
+            self.vars[words[1]] = self.value(words[2])
+        elif head == 'create_port' and len(words) == 4 and words[1] == '-direction':
+            self.graph.add_net(self.value(words[3]), PORT_DIRECTIONS.get(self.value(words[2]), PORT_IN))
+        elif head == 'create_net' and len(words) == 2:
+            self.graph.add_net(self.value(words[1]))
+        elif head == 'create_cell' and len(words) == 3:
+            name = self.value(words[1])
+            if name in self.pending or self.graph.inst_index(name) >= 0:
+                raise TclError("cell {} already exists".format(name))
+            self.pending[name] = [self.value(words[2]), OrderedDict()]
+        elif head == 'connect_net' and len(words) == 3:
+            self.connect(self.value(words[1]), self.value(words[2]))
+        elif head == 'disconnect_net' and len(words) == 3:
+            self.disconnect(self.value(words[1]), self.value(words[2]))
+        else:
+            raise TclError("unsupported command: {}".format(command[:60]))
+
+    # ---------------------------------------------------------
+    # Connectivity
+    # ---------------------------------------------------------
+    def _pin(self, obj):
+        inst, sep, pin = obj.rpartition('/')
+        if not sep:
+            return None, None, None
+        if inst in self.pending:
+            return inst, -1, pin
+        inst_id = self.graph.inst_index(inst, escaped_fallback=True)
+        if inst_id < 0:
+            raise TclError("unknown pin {}".format(obj))
+        return inst, inst_id, pin
+
+    def net_of(self, obj):
+        inst, inst_id, pin = self._pin(obj)
+        if inst is None:
+            return obj      # A port: its net has the same name
+        if inst_id < 0:
+            return self.pending[inst][1].get(pin, "")
+        net = self.graph.pin_map(inst_id).get(pin)
+        if net is None:
+            raise TclError("unknown pin {}".format(obj))
+        return net
+
+    def connect(self, net, obj):
+        inst, inst_id, pin = self._pin(obj)
+        if inst is None:
+            if obj != net:
+                # connect_net <net> <port>: the port aliases the net
+                port = self.graph.add_net(obj)
+                driver = self.graph.nets.get(net)
+                if driver >= 0:
+                    self.graph.net_driver[port] = self.graph.net_driver[driver]
+                self.session.assigns.append((obj, net))
+        elif inst_id < 0:
+            self.pending[inst][1][pin] = net
+        else:
+            self.loose.pop((inst_id, pin), None)
+            self.session._reconnect(inst_id, pin, net)
+
+    def disconnect(self, net, obj):
+        inst, inst_id, pin = self._pin(obj)
+        if inst is None or inst_id < 0:
+            raise TclError("can only disconnect pins of existing cells: {}".format(obj))
+        if self.net_of(obj) != net:
+            raise TclError("{} is not on net {}".format(obj, net))
+        self.loose[(inst_id, pin)] = net
+
+    def finish(self):
+        for name, (cell_type, pins) in self.pending.items():
+            self.session._add_cell(name, cell_type, list(pins.items()))
+        self.graph.rebuild_adjacency()
+        if self.loose:
+            (inst, pin), net = next(iter(self.loose.items()))
+            raise TclError("{} pins left disconnected (e.g. {}/{})".format(
+                len(self.loose), self.graph.inst_name(inst), pin))
+
+
+def apply_tcl(netlist, scripts, output, verify=False):
+    """Writes `netlist` with the per-pin stage `scripts` applied. Returns False on errors."""
+    print("[*] Applying {} TCL script(s) to {}...".format(len(scripts), netlist))
+    start = time.time()
+    session = EcoSession(CompactGraph.from_netlist(netlist))
+    applier = TclApplier(session)
+    for script in scripts:
+        with open(script) as f:
+            text = f.read()
+        for command in tcl_commands(text):
+            if command.startswith('foreach') or command.startswith('set') and command.endswith('{'):
+                print("Error: {}: bulk TCL is not supported; generate it with --tcl-mode per-pin.".format(script))
+                return False
+            try:
+                applier.run(command)
+            except TclError as e:
+                print("Error: {}: {}".format(script, e))
+                return False
+    try:
+        applier.finish()
+    except TclError as e:
+        print("Error: {}".format(e))
+        return False
+    print("    - {} commands, {} cells added ({:.2f} s).".format(
+        applier.commands, len(session.added), time.time() - start))
+    unapplied = write_netlist(netlist, session, output)
+    if verify:
+        return not unapplied and not verify_netlist(output, session.graph)
+    return not unapplied
+
+
+# ==========================================
+# CLI
+# ==========================================
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline stand-ins for the tmax and dc_shell steps.")
+    sub = parser.add_subparsers(dest="tool")
+    insert = sub.add_parser("insert", help="Apply per-pin stage TCL to a netlist (dc_shell stand-in)")
+    insert.add_argument("netlist")
+    insert.add_argument("scripts", nargs="+", help="Stage TCL scripts, applied in order")
+    insert.add_argument("-o", "--output", required=True, help="Netlist to write (.gz ok)")
+    insert.add_argument("--verify", action="store_true", help="Re-parse the output and compare")
+    profile = sub.add_parser("profile", help="Random-pattern fault list (tmax stand-in, see fault_sim.py)")
+    profile.add_argument("netlist")
+    profile.add_argument("report")
+    profile.add_argument("patterns", nargs="?", type=int, default=fault_sim.NUM_PATTERNS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.tool == "insert":
+        return 0 if apply_tcl(args.netlist, args.scripts, args.output, args.verify) else 1
+    if args.tool == "profile":
+        return fault_sim.main(["fault_sim.py", args.netlist, args.report, str(args.patterns)])
+    build_parser().print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from array import array
+
+from cell_library import SEQUENTIAL_DATA_PINS, cell_function
+from compact_graph import PIN_OUT, PORT_OUT
+
+# ==========================================
+# LEVELIZED COMBINATIONAL MODEL (FULL SCAN)
+# ==========================================
+# The gate-level view shared by the fault simulator and the COP engine:
+#   - gates     : known combinational cells, inputs in function pin order
+#   - sources   : primary inputs, flip-flop outputs, unknown cell outputs
+#   - observed  : primary outputs and flip-flop data inputs (D/SI/SE)
+#   - order     : gates in topological order, level[g] = logic depth
+
+
+class LevelizedCircuit:
+    def __init__(self, graph):
+        self.graph = graph
+        num_nets = graph.num_nets
+
+        self.gates = []                   # [(inst, out_net, evaluate, in_nets, in_pins)]
+        self.functions = []               # CellFunction per gate
+        self.gate_of_net = {}             # out_net -> index in self.gates
+        self.net_loads = [[] for _ in range(num_nets)]  # net -> gate indices
+        self.observed = bytearray(num_nets)
+        self.sources = []                 # nets driven by random values
+        self.inverted_sources = []        # (QN net, Q net)
+        self.constants = {}               # net -> 0 / 1
+        self.unknown_cells = 0
+        self._build()
+        self._levelize()
+
+    # ---------------------------------------------------------
+    # Circuit model
+    # ---------------------------------------------------------
+    def _build(self):
+        g = self.graph
+        # `assign` aliases carry their driver in net_driver but sit on no
+        # output pin; simulate them as the driver's output net.
+        on_output_pin = bytearray(g.num_nets)
+        for p in range(len(g.pin_net)):
+            if g.pin_dir[p] == PIN_OUT:
+                on_output_pin[g.pin_net[p]] = 1
+        self.canonical = array('i', range(g.num_nets))
+        for net in range(g.num_nets):
+            drv = g.net_driver[net]
+            if drv >= 0 and not on_output_pin[net] and g.inst_out[drv] >= 0:
+                self.canonical[net] = g.inst_out[drv]
+        canonical = self.canonical
+
+        for net in range(g.num_nets):
+            name = g.net_name(net)
+            if name in ("1'b0", "1'h0", "0"):
+                self.constants[net] = 0
+            elif name in ("1'b1", "1'h1", "1"):
+                self.constants[net] = 1
+            elif g.net_port[net] == PORT_OUT:
+                self.observed[canonical[net]] = 1
+            if g.net_driver[net] < 0 and net not in self.constants:
+                self.sources.append(net)     # PI or undriven
+
+        for inst in range(g.num_insts):
+            pins = g.pin_map(inst)
+            if g.is_sequential(inst):
+                q, qn = pins.get('Q'), pins.get('QN')
+                if q is not None:
+                    self.sources.append(g.nets.get(q))
+                    if qn is not None:
+                        self.inverted_sources.append((g.nets.get(qn), g.nets.get(q)))
+                elif qn is not None:
+                    self.sources.append(g.nets.get(qn))
+                for pin in SEQUENTIAL_DATA_PINS:
+                    if pin in pins:
+                        self.observed[canonical[g.nets.get(pins[pin])]] = 1
+                continue
+
+            function = cell_function(g.cell_type(inst))
+            out_name = pins.get(function.output) if function else None
+            if function is None or out_name is None or any(p not in pins for p in function.inputs):
+                # Unknown cell: its outputs act as free random inputs
+                self.unknown_cells += 1
+                for p in range(g.pin_ptr[inst], g.pin_ptr[inst + 1]):
+                    if g.pin_dir[p] == PIN_OUT:
+                        self.sources.append(g.pin_net[p])
+                continue
+            out = g.nets.get(out_name)
+            in_nets = [canonical[g.nets.get(pins[p])] for p in function.inputs]
+            idx = len(self.gates)
+            self.gates.append((inst, out, function.evaluate, in_nets, function.inputs))
+            self.functions.append(function)
+            self.gate_of_net[out] = idx
+            for n in set(in_nets):
+                self.net_loads[n].append(idx)
+
+    def _levelize(self):
+        """Topological order of gates; gates left on combinational loops become sources."""
+        num = len(self.gates)
+        pending = array('i', [0]) * num
+        for idx, gate in enumerate(self.gates):
+            pending[idx] = sum(1 for n in set(gate[3]) if n in self.gate_of_net)
+        self.level = array('i', [0]) * num
+        order = [idx for idx in range(num) if pending[idx] == 0]
+        head = 0
+        while head < len(order):
+            idx = order[head]
+            head += 1
+            for load in self.net_loads[self.gates[idx][1]]:
+                pending[load] -= 1
+                self.level[load] = max(self.level[load], self.level[idx] + 1)
+                if pending[load] == 0:
+                    order.append(load)
+        self.loop_gates = [idx for idx in range(num) if pending[idx] > 0]
+        for idx in self.loop_gates:
+            self.sources.append(self.gates[idx][1])
+        self.order = order
@@ -0,0 +1,358 @@
+import gzip
+import io
+import re
+import time
+from collections import namedtuple, OrderedDict
+
+# ==========================================
+# SHARED STREAMING NETLIST READER
+# ==========================================
+# One-pass reader for gate-level Verilog used by every stage.
+# The file is consumed in line-aligned chunks, so memory stays flat no
+# matter how large the post-synthesis netlist is.
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Bump whenever the records produced for the same file change; it is part
+# of the on-disk graph cache key (graph_cache.py).
+PARSER_VERSION = 1
+
+# Comments and compiler directives are blanked before the text is split
+# into ';'-terminated statements. Gate instances (the bulk of any netlist)
+# take the INSTANCE/PIN fast path; module headers, declarations and
+# assigns are tokenized.
+COMMENT_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|`[^\n]*', re.S)
+INSTANCE_PATTERN = re.compile(r"""
+    \s* ([A-Za-z_][\w$]*)                           # cell type
+    \s+ (\\\S+|[A-Za-z_][\w$]*(?:\s*\[[^\]]*\])?)   # instance name
+    \s* \( (.*) \) \s* $                            # connections
+""", re.S | re.X)
+PIN_PATTERN = re.compile(r'\.\s*([\w$]+)\s*\(\s*([^()]*?)\s*\)')
+TOKEN_PATTERN = re.compile(r"""
+      \s+
+    | ( \\\S+                                     # escaped identifier
+      | [A-Za-z_][\w$]*                           # identifier / keyword
+      | \d*'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ_?]+  # sized constant
+      | \d+
+      | "(?:[^"\\\n]|\\.)*"
+      | \S
+      )
+""", re.S | re.X)
+
+Instance = namedtuple('Instance', 'module cell_type name pins')
+Assign   = namedtuple('Assign', 'module lhs rhs')
+
+DIRECTION_KEYWORDS = ('input', 'output', 'inout')
+VECTOR_KEYWORDS = ('wire', 'tri', 'wand', 'wor')
+SKIP_KEYWORDS = ('wire', 'reg', 'tri', 'wand', 'wor', 'supply0', 'supply1',
+                 'parameter', 'localparam', 'defparam', 'specify', 'integer')
+KEYWORDS = frozenset(('module', 'macromodule', 'assign') + DIRECTION_KEYWORDS + SKIP_KEYWORDS)
+
+
+class ModuleInfo:
+    def __init__(self, name):
+        self.name = name
+        self.ports = []              # Port order from the header
+        self.directions = OrderedDict()  # {bit-level net name: 'input'|'output'|'inout'}
+        self.ranges = {}             # {vector port/wire name: (msb, lsb)}
+        self.instance_count = 0
+        self.cell_types = set()
+
+
+def open_text(filename):
+    """Opens plain or gzipped text; latin-1 keeps byte counts 1:1."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='latin-1')
+    return io.open(filename, 'r', encoding='latin-1')
+
+
+def _expand_range(name, msb, lsb):
+    step = 1 if lsb >= msb else -1
+    return ["{}[{}]".format(name, i) for i in range(msb, lsb + step, step)]
+
+
+def _split_top_level(tokens, sep=','):
+    """Splits a token list on `sep` outside of (), [] and {}."""
+    groups = [[]]
+    depth = 0
+    for tok in tokens:
+        if tok in '([{' and len(tok) == 1:
+            depth += 1
+        elif tok in ')]}' and len(tok) == 1:
+            depth -= 1
+        if tok == sep and depth == 0:
+            groups.append([])
+        else:
+            groups[-1].append(tok)
+    return groups
+
+
+class NetlistReader:
+    def __init__(self, filename, chunk_size=CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.modules = OrderedDict()
+        self.assigns = []
+        self.bytes_read = 0
+        self.instance_count = 0
+        self.elapsed = 0.0
+
+    # ---------------------------------------------------------
+    # Statement stream
+    # ---------------------------------------------------------
+    def _chunks(self, f):
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                return
+            # Extend to the end of the line so no token is split in two
+            if not chunk.endswith('\n'):
+                chunk += f.readline()
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    def statements(self):
+        """Yields comment-free statement text, one ';' at a time."""
+        with open_text(self.filename) as f:
+            pending = ''
+            for chunk in self._chunks(f):
+                text = pending + chunk
+                if text.rfind('/*') > text.rfind('*/'):
+                    # Block comment runs into the next chunk
+                    pending = text
+                    continue
+                parts = COMMENT_PATTERN.sub(' ', text).split(';')
+                pending = parts.pop()
+                for stmt in parts:
+                    yield stmt
+            if pending.strip():
+                yield COMMENT_PATTERN.sub(' ', pending)
+
+    def records(self):
+        """
+        Streams the netlist, yielding Instance and Assign records in
+        file order. Module headers and port directions are collected
+        into self.modules as they are seen.
+        """
+        start = time.time()
+        module = None
+        for stmt in self.statements():
+            # `endmodule` has no ';' of its own, so it prefixes the next statement
+            while True:
+                head = stmt.lstrip()
+                if not head.startswith('endmodule'):
+                    break
+                module = None
+                stmt = head[9:]
+            if not head:
+                continue
+
+            match = INSTANCE_PATTERN.match(stmt) if module is not None else None
+            if match and match.group(1) not in KEYWORDS:
+                cell_type, name, body = match.groups()
+                if body.lstrip().startswith('.'):
+                    inst = self._instance(module, cell_type, name, body)
+                    if inst is not None:
+                        yield inst
+                        continue
+
+            toks = [t for t in TOKEN_PATTERN.findall(stmt) if t]
+            for rec in self._statement(module, toks):
+                if rec.__class__ is ModuleInfo:
+                    module = rec
+                else:
+                    yield rec
+        self.elapsed = time.time() - start
+
+    def _instance(self, module, cell_type, name, body):
+        found = PIN_PATTERN.findall(body)
+        if len(found) != body.count('('):
+            # Several instances in one statement or odd escaped names
+            return None
+        pins = []
+        for pin, net in found:
+            if not net:
+                continue
+            if net[0] != '\\' and ' ' in net:
+                net = ''.join(net.split())
+            pins.append((pin, net))
+        if ' ' in name and name[0] != '\\':
+            name = ''.join(name.split())
+        module.instance_count += 1
+        module.cell_types.add(cell_type)
+        self.instance_count += 1
+        return Instance(module.name, cell_type, name, pins)
+
+    def instances(self):
+        """Yields only Instance records; assigns are kept in self.assigns."""
+        for rec in self.records():
+            if rec.__class__ is Instance:
+                yield rec
+            else:
+                self.assigns.append(rec)
+
+    def _statement(self, module, stmt):
+        head = stmt[0]
+        if head == 'module' or head == 'macromodule':
+            info = ModuleInfo(stmt[1])
+            self.modules[info.name] = info
+            self._parse_header(info, stmt[2:])
+            return [info]
+        if module is None:
+            return []
+        if head in DIRECTION_KEYWORDS:
+            self._parse_direction(module, stmt)
+            return []
+        if head in SKIP_KEYWORDS:
+            if head in VECTOR_KEYWORDS:
+                self._parse_ranges(module, stmt)
+            return []
+        if head == 'assign':
+            return self._parse_assign(module, stmt[1:])
+        return self._parse_instances(module, stmt)
+
+    def _parse_header(self, info, toks):
+        if not toks or toks[0] != '(':
+            return
+        # ANSI headers carry directions inline; plain headers only names
+        for group in _split_top_level(toks[1:-1]):
+            if not group:
+                continue
+            if group[0] in DIRECTION_KEYWORDS:
+                self._parse_direction(info, group)
+            else:
+                info.ports.append(group[-1])
+
+    def _parse_direction(self, info, toks):
+        direction = toks[0]
+        msb = lsb = None
+        i = 1
+        names = []
+        while i < len(toks):
+            tok = toks[i]
+            if tok == '[':
+                close = toks.index(']', i)
+                bounds = ''.join(toks[i + 1:close]).split(':')
+                if len(bounds) == 2 and bounds[0].isdigit() and bounds[1].isdigit():
+                    msb, lsb = int(bounds[0]), int(bounds[1])
+                i = close + 1
+                continue
+            if tok != ',' and tok not in SKIP_KEYWORDS and tok != 'signed':
+                names.append(tok)
+            i += 1
+        for name in names:
+            if name not in info.ports:
+                info.ports.append(name)
+            if msb is None:
+                info.directions[name] = direction
+            else:
+                info.ranges[name] = (msb, lsb)
+                for bit in _expand_range(name, msb, lsb):
+                    info.directions[bit] = direction
+
+    def _parse_ranges(self, info, toks):
+        """Widths of `wire [msb:lsb] a, b;` (needed to bit-blast module connections)."""
+        if len(toks) < 2 or toks[1] != '[' or ']' not in toks:
+            return
+        close = toks.index(']')
+        bounds = ''.join(toks[2:close]).split(':')
+        if len(bounds) != 2 or not bounds[0].isdigit() or not bounds[1].isdigit():
+            return
+        for tok in toks[close + 1:]:
+            if tok == '=':
+                break
+            if tok != ',':
+                info.ranges[tok] = (int(bounds[0]), int(bounds[1]))
+
+    def _parse_assign(self, module, toks):
+        records = []
+        for group in _split_top_level(toks):
+            if '=' not in group:
+                continue
+            eq = group.index('=')
+            records.append(Assign(module.name, ''.join(group[:eq]), ''.join(group[eq + 1:])))
+        return records
+
+    def _parse_instances(self, module, toks):
+        cell_type = toks[0]
+        i = 1
+        # Skip parameter overrides: CELL #( ... ) name ( ... )
+        if i < len(toks) and toks[i] == '#':
+            depth = 0
+            i += 1
+            while i < len(toks):
+                if toks[i] == '(':
+                    depth += 1
+                elif toks[i] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        i += 1
+                        break
+                i += 1
+        records = []
+        for group in _split_top_level(toks[i:]):
+            if '(' not in group:
+                continue
+            paren = group.index('(')
+            if paren == 0 or group[-1] != ')':
+                continue
+            name = ''.join(group[:paren])
+            records.append(Instance(module.name, cell_type, name,
+                                    self._parse_connections(group[paren + 1:-1])))
+            module.instance_count += 1
+            module.cell_types.add(cell_type)
+        self.instance_count += len(records)
+        return records
+
+    def _parse_connections(self, toks):
+        pins = []
+        for group in _split_top_level(toks):
+            if not group:
+                continue
+            if group[0] == '.':
+                # Named: .PIN(expr) -- unconnected pins are dropped
+                if len(group) > 4:
+                    pins.append((group[1], ''.join(group[3:-1])))
+            else:
+                # Positional: pin name unknown
+                pins.append((None, ''.join(group)))
+        return pins
+
+    # ---------------------------------------------------------
+    # Reporting
+    # ---------------------------------------------------------
+    def top_module(self):
+        """The last module that no other module instantiates."""
+        used = set()
+        for info in self.modules.values():
+            used.update(info.cell_types)
+        tops = [name for name in self.modules if name not in used]
+        if tops:
+            return self.modules[tops[-1]]
+        return None
+
+    def throughput(self):
+        """Parse throughput in MB/s of (uncompressed) netlist text."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes_read / (1024.0 * 1024.0) / self.elapsed
+
+
+def alias_map(assigns):
+    """
+    Resolves `assign lhs = rhs;` chains of plain nets into {lhs: root}.
+    Assigns from constants or expressions are left out.
+    """
+    direct = {}
+    for a in assigns:
+        if a.rhs and (a.rhs[0] == '\\' or re.match(r'^[A-Za-z_][\w$]*(\[\d+\])?$', a.rhs)):
+            direct[a.lhs] = a.rhs
+    resolved = {}
+    for lhs in direct:
+        root = direct[lhs]
+        seen = set([lhs])
+        while root in direct and root not in seen:
+            seen.add(root)
+            root = direct[root]
+        resolved[lhs] = root
+    return resolved
@@ -0,0 +1,234 @@
+import gzip
+import io
+import re
+import time
+
+import instrument
+from compact_graph import CompactGraph, PORT_NONE, PORT_IN, PORT_OUT
+from netlist_reader import CHUNK_SIZE, COMMENT_PATTERN, open_text
+
+# ==========================================
+# DIRECT NETLIST WRITER (ECO FAST PATH)
+# ==========================================
+# Streams the original gate-level Verilog once and writes it back with an
+# EcoSession's edits (eco.py) applied, so the stage 1-3 test logic lands
+# in a netlist without a dc_shell round trip:
+#
+#   - rewired pins of existing instances are patched in place,
+#     .A2(n_old) -> .A2(n_safe_1_n_old); all other text, comments
+#     included, is copied through unchanged
+#   - new ports are appended to the top module header and declared,
+#     together with the new wires, right after it
+#   - inserted cells and port aliases are written before its endmodule
+#
+# Like the stage scripts this assumes a flat netlist: edits are applied
+# to the top module. verify_netlist() re-parses the result and compares
+# it with the edited graph. The TCL scripts remain the signoff path.
+
+MODULE_PATTERN = re.compile(r'\s*(?:module|macromodule)\s+(\\\S+|[A-Za-z_][\w$]*)')
+NAME_PATTERN = re.compile(r'\s*[A-Za-z_][\w$]*\s+(\\\S+|[A-Za-z_][\w$]*(?:\s*\[[^\]]*\])?)')
+DIRECTIONS = {PORT_IN: 'input', PORT_OUT: 'output'}
+
+
+def _blank(match):
+    # Same-length blanking keeps offsets in the clean text valid for the raw text
+    return re.sub(r'[^\n]', ' ', match.group())
+
+
+def raw_statements(filename, chunk_size=CHUNK_SIZE):
+    """
+    Yields (raw, clean) per ';'-terminated statement, ';' included. raw
+    is the original text, clean the same text with comments blanked.
+    """
+    with open_text(filename) as f:
+        pending = ''
+        while True:
+            chunk = f.read(chunk_size)
+            # Extend to the end of the line so no comment is split in two
+            if chunk and not chunk.endswith('\n'):
+                chunk += f.readline()
+            text = pending + chunk
+            if chunk and text.rfind('/*') > text.rfind('*/'):
+                # Block comment runs into the next chunk
+                pending = text
+                continue
+            clean = COMMENT_PATTERN.sub(_blank, text)
+            start = 0
+            end = clean.find(';')
+            while end >= 0:
+                yield text[start:end + 1], clean[start:end + 1]
+                start = end + 1
+                end = clean.find(';', start)
+            pending = text[start:]
+            if not chunk:
+                break
+        if pending:
+            yield pending, COMMENT_PATTERN.sub(_blank, pending)
+
+
+def ident(name):
+    """Verilog spelling of an interned name: escaped identifiers need their terminating space."""
+    return name + " " if name.startswith("\\") else name
+
+
+def _open_output(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', encoding='latin-1')
+    return io.open(filename, 'w', encoding='latin-1')
+
+
+# ---------------------------------------------------------
+# Text edits
+# ---------------------------------------------------------
+def _patch_pins(raw, clean, pins):
+    """Replaces the net of each pin in an instance statement. Returns (text, pins not found)."""
+    spans = []
+    missing = []
+    for pin, net in pins.items():
+        match = re.search(r'\.\s*' + re.escape(pin) + r'\s*\(', clean)
+        close = clean.find(')', match.end()) if match else -1
+        if close < 0:
+            missing.append(pin)
+            continue
+        spans.append((match.end(), close, ident(net)))
+    # Right to left so earlier offsets stay valid
+    for start, end, net in sorted(spans, reverse=True):
+        raw = raw[:start] + net + raw[end:]
+    return raw, missing
+
+
+def _patch_header(raw, clean, ports):
+    """Appends `ports` [(name, direction)] to a module header statement."""
+    if not ports:
+        return raw
+    ansi = re.search(r'\b(input|output|inout)\b', clean) is not None
+    names = ", ".join((d + " " if ansi else "") + ident(n) for n, d in ports)
+    close = clean.rfind(')')
+    if close < 0:
+        # module m;
+        semi = clean.rfind(';')
+        return raw[:semi] + " (" + names + ")" + raw[semi:]
+    if clean[clean.find('(') + 1:close].strip():
+        names = ", " + names
+    return raw[:close] + names + raw[close:]
+
+
+def _declarations(session, ports, ansi):
+    graph = session.graph
+    lines = []
+    if not ansi:
+        for name, direction in ports:
+            lines.append("  {} {};".format(direction, ident(name)))
+    for net in range(session.base_nets, graph.num_nets):
+        if graph.net_port[net] == PORT_NONE:
+            lines.append("  wire {};".format(ident(graph.net_name(net))))
+    return "\n  // ECO: test logic nets\n" + "\n".join(lines) + "\n" if lines else ""
+
+
+def _additions(session):
+    graph = session.graph
+    lines = ["\n  // ECO: inserted test logic"]
+    for name in session.added:
+        inst = graph.inst_index(name)
+        conns = ", ".join(".{}({})".format(pin, ident(net)) for pin, net in graph.pins(inst))
+        lines.append("  {} {} ( {} );".format(graph.cell_type(inst), ident(name), conns))
+    for lhs, rhs in session.assigns:
+        lines.append("  assign {} = {};".format(ident(lhs), ident(rhs)))
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------
+# Writer
+# ---------------------------------------------------------
+def write_netlist(source, session, output, top=None):
+    """
+    Writes `source` with the edits of EcoSession `session` applied to
+    module `top` (default: the first module no instance refers to).
+    Returns the names of rewired instances that could not be patched.
+    """
+    print("[*] Writing ECO Netlist: {}...".format(output))
+    start = time.time()
+    graph = session.graph
+    edits = dict((graph.inst_name(i), pins) for i, pins in session.reconnected.items())
+    ports = [(graph.net_name(n), DIRECTIONS.get(graph.net_port[n], 'inout'))
+             for n in range(session.base_nets, graph.num_nets) if graph.net_port[n] != PORT_NONE]
+    unapplied = []
+    module = None
+    found_top = False
+
+    with instrument.phase("write_netlist", file=output), _open_output(output) as out:
+        for raw, clean in raw_statements(source):
+            # `endmodule` has no ';' of its own, so it prefixes the next statement
+            while True:
+                body = clean.lstrip()
+                if not body.startswith('endmodule'):
+                    break
+                at = len(clean) - len(body)
+                out.write(raw[:at])
+                if module is not None and module == top:
+                    out.write(_additions(session))
+                out.write(raw[at:at + 9])
+                raw, clean = raw[at + 9:], clean[at + 9:]
+                module = None
+            if not body:
+                out.write(raw)
+                continue
+
+            if module is None:
+                match = MODULE_PATTERN.match(clean)
+                if match:
+                    module = match.group(1)
+                    if top is None and graph.cells.get(module) < 0:
+                        top = module
+                    if module == top:
+                        found_top = True
+                        ansi = re.search(r'\b(input|output|inout)\b', clean) is not None
+                        out.write(_patch_header(raw, clean, ports))
+                        out.write(_declarations(session, ports, ansi))
+                        continue
+            elif module == top and edits:
+                match = NAME_PATTERN.match(clean)
+                if match:
+                    name = match.group(1)
+                    if ' ' in name and name[0] != '\\':
+                        name = ''.join(name.split())
+                    pins = edits.pop(name, None)
+                    if pins:
+                        raw, missing = _patch_pins(raw, clean, pins)
+                        if missing:
+                            unapplied.append(name)
+            out.write(raw)
+
+    if not found_top:
+        print("Error: top module not found in {}.".format(source))
+    unapplied.extend(sorted(edits))
+    print("    - {} cells added, {} instances rewired ({:.2f} s).".format(
+        len(session.added), len(session.reconnected) - len(unapplied), time.time() - start))
+    if unapplied:
+        print("WARNING: {} rewired instances could not be patched (e.g. {}).".format(len(unapplied), unapplied[0]))
+    return unapplied
+
+
+def verify_netlist(filename, graph):
+    """Re-parses `filename`; returns a list of differences from `graph` (empty if it matches)."""
+    print("[*] Verifying ECO Netlist: {}...".format(filename))
+    written = CompactGraph.from_netlist(filename)
+    problems = []
+    if written.num_insts != graph.num_insts:
+        problems.append("instance count {} != {}".format(written.num_insts, graph.num_insts))
+    for inst in range(graph.num_insts):
+        name = graph.inst_name(inst)
+        other = written.inst_index(name)
+        if other < 0:
+            problems.append("{}: missing".format(name))
+        elif written.cell_type(other) != graph.cell_type(inst):
+            problems.append("{}: cell {} != {}".format(name, written.cell_type(other), graph.cell_type(inst)))
+        elif sorted(written.pins(other)) != sorted(graph.pins(inst)):
+            problems.append("{}: connections differ".format(name))
+    for net in range(graph.num_nets):
+        if graph.net_port[net] != PORT_NONE:
+            other = written.nets.get(graph.net_name(net))
+            if other < 0 or written.net_port[other] != graph.net_port[net]:
+                problems.append("{}: port direction differs".format(graph.net_name(net)))
+    print("    - {} instances checked, {} differences.".format(graph.num_insts, len(problems)))
+    return problems
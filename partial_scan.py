@@ -0,0 +1,559 @@
+import argparse
+import heapq
+import sys
+import time
+from array import array
+
+import instrument
+import tcl_emit
+from cell_library import CONTROL_PINS
+from compact_graph import PIN_OUT, _transpose
+from graph_cache import CACHE_DIR, load_graph
+
+# ==========================================
+# GRAPH-BASED PARTIAL SCAN SELECTION
+# ==========================================
+# Picks the flip-flops to scan so that the unscanned sequential logic is
+# loop-free and shallow, which is what keeps sequential ATPG tractable:
+#
+#   1. S-graph: one vertex per flip-flop, an edge a -> b when a's output
+#      reaches b's data input through combinational logic only
+#   2. Strongly connected components (iterative Tarjan)
+#   3. Feedback vertex set: flip-flops whose removal breaks every cycle
+#   4. Sequential depth: extra flip-flops so no path through unscanned
+#      flip-flops is longer than MAX_SEQ_DEPTH
+#
+# The register-to-register reachability comes from one topological sweep
+# over the combinational gates: each gate carries the frozenset of
+# flip-flops in its fanin cone, built from its drivers' sets, and a set
+# is dropped as soon as its last combinational load has read it. There
+# is no per-register BFS, so the cost is the total size of those sets.
+#
+#   python partial_scan.py design.v --max-depth 4 --out select_scan.tcl
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+NETLIST_FILE     = "test_scan_b10_tpi.v"
+OUTPUT_TCL       = "select_partial_scan.tcl"
+MAX_SEQ_DEPTH    = 4       # Unscanned flip-flops on any path (None: loops only)
+BREAK_SELF_LOOPS = False   # Self-loops (hold/enable muxes) are cheap for ATPG
+SCAN_PINS        = ('SI', 'SE', 'TE')   # Scan path, not functional data
+
+
+# ==========================================
+# PART 1: S-GRAPH CONSTRUCTION
+# ==========================================
+class SGraph:
+    """
+    Flip-flop dependency graph. Vertex v is flip-flop regs[v]; edges are
+    in CSR form both ways, self-loops are kept in `self_loop` only.
+    """
+    def __init__(self, graph, regs, pred_ptr, pred):
+        self.graph = graph
+        self.regs = regs
+        self.pred_ptr, self.pred = pred_ptr, pred
+        self.succ_ptr, self.succ = _transpose(pred_ptr, pred, len(regs))
+        self.self_loop = bytearray(len(regs))
+        for v in range(len(regs)):
+            for k in range(pred_ptr[v], pred_ptr[v + 1]):
+                if pred[k] == v:
+                    self.self_loop[v] = 1
+
+    @property
+    def num_regs(self):
+        return len(self.regs)
+
+    @property
+    def num_edges(self):
+        return len(self.pred)
+
+    def successors(self, v):
+        return self.succ[self.succ_ptr[v]:self.succ_ptr[v + 1]]
+
+    def predecessors(self, v):
+        return self.pred[self.pred_ptr[v]:self.pred_ptr[v + 1]]
+
+
+def _data_drivers(graph, inst):
+    """Instances driving the data pins of flip-flop `inst` (clock, reset and scan pins excluded)."""
+    pin_names, net_driver = graph.pin_names.names, graph.net_driver
+    drivers = set()
+    for p in range(graph.pin_ptr[inst], graph.pin_ptr[inst + 1]):
+        if graph.pin_dir[p] == PIN_OUT:
+            continue
+        pin = pin_names[graph.pin_name[p]]
+        if pin in CONTROL_PINS or pin in SCAN_PINS:
+            continue
+        drv = net_driver[graph.pin_net[p]]
+        if drv >= 0:
+            drivers.add(drv)
+    return drivers
+
+
+def _comb_order(graph, comb):
+    """
+    Combinational gates in topological order. A gate on a combinational
+    loop is released early when the queue runs dry; returns (order, looped).
+    """
+    fanin, fanin_ptr = graph.fanin, graph.fanin_ptr
+    fanout, fanout_ptr = graph.fanout, graph.fanout_ptr
+    pending = array('i', [0]) * graph.num_insts
+    for n in range(graph.num_insts):
+        if comb[n]:
+            pending[n] = sum(1 for u in fanin[fanin_ptr[n]:fanin_ptr[n + 1]] if comb[u])
+    order = [n for n in range(graph.num_insts) if comb[n] and pending[n] == 0]
+    done = bytearray(graph.num_insts)
+    for n in order:
+        done[n] = 1
+    looped = 0
+    head = 0
+    scan = 0
+    while True:
+        while head < len(order):
+            n = order[head]
+            head += 1
+            for load in fanout[fanout_ptr[n]:fanout_ptr[n + 1]]:
+                if comb[load] and not done[load]:
+                    pending[load] -= 1
+                    if pending[load] == 0:
+                        done[load] = 1
+                        order.append(load)
+        # Stalled: the rest sits on or behind a combinational loop
+        while scan < graph.num_insts and not (comb[scan] and not done[scan]):
+            scan += 1
+        if scan == graph.num_insts:
+            return order, looped
+        done[scan] = 1
+        order.append(scan)
+        looped += 1
+
+
+def build_sgraph(graph):
+    """Builds the S-graph of `graph` (a CompactGraph) in one combinational sweep."""
+    num = graph.num_insts
+    cell_seq, inst_cell, inst_out = graph.cell_seq, graph.inst_cell, graph.inst_out
+    fanin, fanin_ptr = graph.fanin, graph.fanin_ptr
+
+    regs = array('i', (i for i in range(num) if cell_seq[inst_cell[i]]))
+    reg_index = array('i', [-1]) * num
+    for v, inst in enumerate(regs):
+        reg_index[inst] = v
+    comb = bytearray(num)
+    for i in range(num):
+        if inst_out[i] >= 0 and not cell_seq[inst_cell[i]]:
+            comb[i] = 1
+
+    # Combinational gates feeding a flip-flop data pin, and what each flip-flop reads
+    readers = {}
+    parts = [[] for _ in regs]
+    single = {}
+    for v, inst in enumerate(regs):
+        for drv in _data_drivers(graph, inst):
+            if comb[drv]:
+                readers.setdefault(drv, []).append(v)
+            elif reg_index[drv] >= 0:
+                parts[v].append(frozenset((reg_index[drv],)))
+
+    with instrument.phase("sgraph_sweep", regs=len(regs)):
+        order, looped = _comb_order(graph, comb)
+        # Loads still to read each gate's set; at zero the set is dropped
+        remaining = array('i', [0]) * num
+        for n in order:
+            for u in fanin[fanin_ptr[n]:fanin_ptr[n + 1]]:
+                if comb[u]:
+                    remaining[u] += 1
+        empty = frozenset()
+        sets = {}
+        passes = 0
+        while True:
+            passes += 1
+            changed = False
+            for n in order:
+                found = []
+                for u in fanin[fanin_ptr[n]:fanin_ptr[n + 1]]:
+                    if comb[u]:
+                        s = sets.get(u, empty)
+                        if not looped:
+                            remaining[u] -= 1
+                            if remaining[u] == 0:
+                                del sets[u]
+                    elif reg_index[u] >= 0:
+                        s = single.get(u)
+                        if s is None:
+                            s = single[u] = frozenset((reg_index[u],))
+                    else:
+                        continue
+                    if s:
+                        found.append(s)
+                if not found:
+                    s = empty
+                elif len(found) == 1:
+                    s = found[0]
+                else:
+                    s = empty.union(*found)
+                if looped:
+                    # Loops need a fixpoint: keep every set, repeat until stable
+                    if len(s) != len(sets.get(n, empty)):
+                        changed = True
+                    sets[n] = s
+                    continue
+                if remaining[n]:
+                    sets[n] = s
+                for v in readers.get(n, ()):
+                    parts[v].append(s)
+            if not looped or not changed:
+                break
+        if looped:
+            for n, regs_of in readers.items():
+                s = sets.get(n, empty)
+                for v in regs_of:
+                    parts[v].append(s)
+
+    # Predecessor CSR
+    pred_ptr = array('i', [0])
+    pred = array('i')
+    for v in range(len(regs)):
+        found = parts[v]
+        srcs = found[0] if len(found) == 1 else frozenset().union(*found)
+        pred.extend(sorted(srcs))
+        pred_ptr.append(len(pred))
+        parts[v] = None
+    if instrument.ENABLED:
+        instrument.count("sgraph_edges", len(pred))
+        instrument.count("comb_loop_releases", looped)
+    sgraph = SGraph(graph, regs, pred_ptr, pred)
+    sgraph.comb_loops = looped
+    sgraph.passes = passes
+    return sgraph
+
+
+# ==========================================
+# PART 2: STRONGLY CONNECTED COMPONENTS
+# ==========================================
+def strongly_connected(vertices, successors):
+    """
+    Iterative Tarjan. `successors(v)` returns an iterable of vertices.
+    Returns components as lists, sinks first (reverse topological order).
+    """
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+    for root in vertices:
+        if root in index:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors(root)))]
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if w not in index:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(successors(w))))
+                    break
+                if w in on_stack and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    comp = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        comp.append(w)
+                        if w == v:
+                            break
+                    components.append(comp)
+    return components
+
+
+def cyclic_components(sgraph):
+    """SCCs with a cycle among distinct flip-flops (size > 1)."""
+    with instrument.phase("sgraph_scc"):
+        comps = strongly_connected(range(sgraph.num_regs), sgraph.successors)
+    return [c for c in comps if len(c) > 1]
+
+
+# ==========================================
+# PART 3: FEEDBACK VERTEX SET
+# ==========================================
+# Per SCC on mutable adjacency sets, with the classic reductions applied
+# after every change:
+#   - no predecessor or no successor : on no cycle, drop it
+#   - a self-loop                    : must be scanned
+#   - one predecessor u (or one successor) : every cycle through v also
+#     runs through u, so v is bypassed (u -> succ(v)) instead of scanned
+# When nothing reduces, the vertex with the largest in*out degree is
+# scanned. Every time half of the component is gone it is split into
+# SCCs again, so vertices no longer on any cycle are not picked.
+
+class _CycleBreaker:
+    def __init__(self, sgraph, comp, in_comp):
+        self.succ = {}
+        self.pred = {}
+        for v in comp:
+            # Original self-loops are handled by the caller
+            self.succ[v] = set(w for w in sgraph.successors(v) if in_comp[w] and w != v)
+            self.pred[v] = set(u for u in sgraph.predecessors(v) if in_comp[u] and u != v)
+        self.selected = []
+        self.heap = []
+
+    def _push(self, v):
+        heapq.heappush(self.heap, (-len(self.pred[v]) * len(self.succ[v]), v))
+
+    def _remove(self, v, queue):
+        for w in self.succ.pop(v):
+            if w != v:
+                self.pred[w].discard(v)
+                queue.append(w)
+        for u in self.pred.pop(v):
+            if u != v:
+                self.succ[u].discard(v)
+                queue.append(u)
+
+    def _bypass(self, v, queue):
+        succ, pred = self.succ, self.pred
+        if len(pred[v]) == 1:
+            u = next(iter(pred[v]))
+            for w in succ[v]:
+                succ[u].add(w)
+                pred[w].add(u)
+        else:
+            w = next(iter(succ[v]))
+            for u in pred[v]:
+                succ[u].add(w)
+                pred[w].add(u)
+        self._remove(v, queue)
+
+    def reduce(self, queue):
+        succ, pred = self.succ, self.pred
+        while queue:
+            v = queue.pop()
+            if v not in succ:
+                continue
+            if v in succ[v]:
+                self.selected.append(v)
+                self._remove(v, queue)
+            elif not pred[v] or not succ[v]:
+                self._remove(v, queue)
+            elif len(pred[v]) == 1 or len(succ[v]) == 1:
+                self._bypass(v, queue)
+            else:
+                self._push(v)
+
+    def split(self):
+        """Drops vertices left outside every cycle; returns the live count."""
+        comps = strongly_connected(list(self.succ), lambda v: self.succ[v])
+        queue = []
+        for comp in comps:
+            if len(comp) == 1 and comp[0] not in self.succ[comp[0]]:
+                self._remove(comp[0], queue)
+        self.reduce(queue)
+        return len(self.succ)
+
+    def run(self):
+        self.reduce(list(self.succ))
+        live = self.split()
+        while self.succ:
+            score, v = heapq.heappop(self.heap)
+            if v not in self.succ or -score != len(self.pred[v]) * len(self.succ[v]):
+                continue    # Stale entry; the current score was pushed when it changed
+            self.selected.append(v)
+            queue = []
+            self._remove(v, queue)
+            self.reduce(queue)
+            if 2 * len(self.succ) < live:
+                live = self.split()
+        return self.selected
+
+
+def feedback_vertex_set(sgraph, components=None, break_self_loops=None):
+    """Vertices (S-graph indices) whose removal leaves the S-graph acyclic."""
+    if break_self_loops is None: break_self_loops = BREAK_SELF_LOOPS
+    if components is None:
+        components = cyclic_components(sgraph)
+    selected = []
+    in_comp = bytearray(sgraph.num_regs)
+    with instrument.phase("feedback_vertex_set", components=len(components)):
+        for comp in components:
+            for v in comp:
+                in_comp[v] = 1
+            selected.extend(_CycleBreaker(sgraph, comp, in_comp).run())
+            for v in comp:
+                in_comp[v] = 0
+        if break_self_loops:
+            chosen = set(selected)
+            selected.extend(v for v in range(sgraph.num_regs) if sgraph.self_loop[v] and v not in chosen)
+    return sorted(selected)
+
+
+# ==========================================
+# PART 4: SEQUENTIAL DEPTH LIMIT
+# ==========================================
+def limit_depth(sgraph, scanned, max_depth):
+    """
+    With `scanned` (a bytearray over vertices) breaking every cycle, scans
+    more flip-flops in topological order until no path crosses more than
+    `max_depth` unscanned ones. Returns (added vertices, resulting depth).
+    """
+    num = sgraph.num_regs
+    pred, pred_ptr = sgraph.pred, sgraph.pred_ptr
+    succ, succ_ptr = sgraph.succ, sgraph.succ_ptr
+    base = bytes(scanned)   # Only flip-flops unscanned on entry hold back their loads
+    pending = array('i', [0]) * num
+    for v in range(num):
+        for k in range(pred_ptr[v], pred_ptr[v + 1]):
+            u = pred[k]
+            if u != v and not base[u]:
+                pending[v] += 1
+    depth = array('i', [0]) * num     # Scanned flip-flops stay at 0
+    order = [v for v in range(num) if pending[v] == 0]
+    added = []
+    worst = 0
+    head = 0
+    while head < len(order):
+        v = order[head]
+        head += 1
+        if not scanned[v]:
+            d = 1
+            for k in range(pred_ptr[v], pred_ptr[v + 1]):
+                u = pred[k]
+                if u != v and depth[u] >= d:
+                    d = depth[u] + 1
+            if max_depth and d > max_depth:
+                scanned[v] = 1
+                added.append(v)
+                d = 0
+            depth[v] = d
+            if d > worst:
+                worst = d
+        if not base[v]:
+            for k in range(succ_ptr[v], succ_ptr[v + 1]):
+                w = succ[k]
+                if w != v:
+                    pending[w] -= 1
+                    if pending[w] == 0:
+                        order.append(w)
+    if len(order) < num:
+        raise ValueError("S-graph still has cycles outside the scanned set")
+    return added, worst
+
+
+# ==========================================
+# PART 5: SELECTION
+# ==========================================
+def select_scan_flops(graph, max_depth=None, break_self_loops=None):
+    """
+    Partial scan selection on a CompactGraph. Returns (instance IDs to
+    scan in netlist order, stats dict).
+    """
+    if max_depth is None: max_depth = MAX_SEQ_DEPTH
+    print("[*] Building S-graph...")
+    start = time.time()
+    sgraph = build_sgraph(graph)
+    print("    - {} flip-flops, {} edges, {} self-loops ({:.2f} s).".format(
+        sgraph.num_regs, sgraph.num_edges, sum(sgraph.self_loop), time.time() - start))
+    if sgraph.comb_loops:
+        print("    - WARNING: combinational loops ({} gates released out of order, {} sweep passes).".format(
+            sgraph.comb_loops, sgraph.passes))
+
+    print("[*] Breaking sequential loops...")
+    start = time.time()
+    comps = cyclic_components(sgraph)
+    loop_breakers = feedback_vertex_set(sgraph, comps, break_self_loops)
+    print("    - {} cyclic SCCs (largest {}), {} flip-flops break every cycle ({:.2f} s).".format(
+        len(comps), max([len(c) for c in comps] + [0]), len(loop_breakers), time.time() - start))
+
+    scanned = bytearray(sgraph.num_regs)
+    for v in loop_breakers:
+        scanned[v] = 1
+    with instrument.phase("limit_depth"):
+        depth_cuts, depth = limit_depth(sgraph, scanned, max_depth)
+    if max_depth:
+        print("    - {} more flip-flops for sequential depth <= {} (now {}).".format(len(depth_cuts), max_depth, depth))
+
+    selected = [sgraph.regs[v] for v in range(sgraph.num_regs) if scanned[v]]
+    stats = {
+        'flops': sgraph.num_regs,
+        'edges': sgraph.num_edges,
+        'self_loops': sum(sgraph.self_loop),
+        'cyclic_sccs': len(comps),
+        'loop_breakers': len(loop_breakers),
+        'depth_cuts': len(depth_cuts),
+        'seq_depth': depth,
+        'scanned': len(selected),
+    }
+    return selected, stats
+
+
+# ==========================================
+# PART 6: GENERATE TCL
+# ==========================================
+def scan_cell_name(graph, inst):
+    """Design Compiler cell name: escaped identifiers lose their leading backslash."""
+    name = graph.inst_name(inst)
+    return name[1:] if name.startswith("\\") else name
+
+
+def generate_scan_tcl(graph, selected, filename=None, stats=None, mode=None, chunk_size=None):
+    """Marks the selected flip-flops as scan elements and every other register as non-scan."""
+    if filename is None: filename = OUTPUT_TCL
+    if mode is None: mode = tcl_emit.TCL_MODE
+    print("[*] Generating Partial Scan TCL: {}...".format(filename))
+    names = [scan_cell_name(graph, inst) for inst in selected]
+    with instrument.phase("write_tcl", stage="scan"), open(filename, 'w') as f:
+        tcl = tcl_emit.TclScript(f)
+        tcl.write("# Partial Scan: {} flip-flops selected\n".format(len(names)))
+        if stats:
+            tcl.write("# {} loop breakers, {} for sequential depth <= {}\n".format(
+                stats['loop_breakers'], stats['depth_cuts'], stats['seq_depth']))
+        tcl.cmd("set_scan_element false [all_registers -edge_triggered]")
+        tcl.write("\n")
+        if mode == "bulk":
+            for part, chunk in enumerate(tcl_emit.chunks(names, chunk_size or tcl_emit.CHUNK_SIZE), 1):
+                tcl.write("# Chunk {}: {} flip-flops\n".format(part, len(chunk)))
+                tcl.set_list("scan_cells", chunk, 8)
+                tcl.cmd("set_scan_element true [get_cells $scan_cells]")
+        else:
+            for name in names:
+                tcl.cmd("set_scan_element true [get_cells {}]".format(tcl_emit.tcl_word(name)))
+    tcl.report()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Graph-based partial scan flip-flop selection.")
+    parser.add_argument("netlist", nargs="?", default=NETLIST_FILE)
+    parser.add_argument("--out", default=OUTPUT_TCL, help="Scan selection TCL")
+    parser.add_argument("--max-depth", type=int, default=MAX_SEQ_DEPTH,
+                        help="Max unscanned flip-flops on a path; 0 breaks loops only (default: {})".format(MAX_SEQ_DEPTH))
+    parser.add_argument("--break-self-loops", action="store_true", help="Also scan flip-flops that feed themselves")
+    parser.add_argument("--tcl-mode", choices=tcl_emit.TCL_MODES, default=tcl_emit.TCL_MODE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Parsed-netlist cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse the netlist")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    print("[*] Parsing Netlist: {}...".format(args.netlist))
+    graph = load_graph(args.netlist, None if args.no_cache else args.cache_dir)
+    selected, stats = select_scan_flops(graph, args.max_depth, args.break_self_loops or None)
+    generate_scan_tcl(graph, selected, args.out, stats, args.tcl_mode)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
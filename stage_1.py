@@ -1,251 +1,376 @@
-import re
-import sys
-from collections import defaultdict
-
-# ==========================================
-# CONFIGURATION
-# ==========================================
-NETLIST_FILE    = "b10.v"            
-REPORT_FILE     = "stage1_failures.rpt" 
-OUTPUT_TCL      = "insert_tpi_logic.tcl"
-
-# PURE ANALYSIS PARAMETERS (No arbitrary depths)
-# ------------------------------------------------
-# ELBOW_THRESHOLD: The minimum relative impact required to select a node.
-# If a node has < 10% of the impact of the top node, we stop.
-ELBOW_THRESHOLD = 0.10  
-MAX_AREA_BUDGET = 5    # Hard engineering limit (safety net)
-
-# ==========================================
-# PART 1: NETLIST PARSER
-# ==========================================
-class CircuitGraph:
-    def __init__(self):
-        self.drivers = defaultdict(list)
-        self.instance_to_output = {}
-        self.net_driver_inst = {}
-        self.inst_type = {} # To detect Registers vs Gates
-
-    def parse_verilog(self, filename):
-        print "[*] Parsing Netlist: {}...".format(filename)
-        with open(filename, 'r') as f:
-            content = f.read()
-
-        # Capture instance type to identify registers later
-        instance_pattern = re.compile(r'([\w\\]+)\s+([\w\\\[\]]+)\s*\((.*?)\);', re.DOTALL)
-        matches = instance_pattern.findall(content)
-        
-        for cell_type, inst_name, pins in matches:
-            clean_inst = inst_name.strip()
-            self.inst_type[clean_inst] = cell_type # Store type (e.g., DFF)
-            
-            pin_pattern = re.compile(r'\.([\w\[\]]+)\s*\(\s*([\w\\\[\]]+)\s*\)')
-            pin_matches = pin_pattern.findall(pins)
-            
-            inputs = []
-            output = None
-            
-            for pin_name, net_name in pin_matches:
-                # Identify Outputs
-                if pin_name in ['Y', 'Z', 'Q', 'QN', 'SO']: 
-                    output = net_name
-                    self.instance_to_output[clean_inst] = net_name
-                    self.net_driver_inst[net_name] = clean_inst
-                # Identify Inputs
-                elif pin_name in ['A', 'B', 'C', 'D', 'A1', 'A2', 'A3', 'A4', 
-                                  'B1', 'B2', 'S0', 'S1', 'CLK', 'RSTB', 'SI', 'SE', 'TE']:
-                    inputs.append(net_name)
-            
-            if output:
-                self.drivers[output] = inputs
-        print "    - Parsed {} instances.".format(len(matches))
-
-    # ---------------------------------------------------------
-    # NEW: Distance-Aware Cone Trace (BFS)
-    # ---------------------------------------------------------
-    def get_full_fanin_cone(self, start_inst):
-        """
-        Traces backwards until a Register or Primary Input is hit.
-        Returns a dictionary: {node_name: distance_from_fault}
-        """
-        cone_map = {} # Stores {node: min_distance}
-        
-        start_net = self.instance_to_output.get(start_inst)
-        if not start_net: return {}
-        
-        driver_nets = self.drivers.get(start_net, [])
-        
-        # Standard BFS Queue: [(Instance, Distance)]
-        bfs_queue = [] 
-        
-        # Initialize queue with immediate drivers of the fault
-        for net in driver_nets:
-             d_inst = self.net_driver_inst.get(net)
-             if d_inst:
-                 bfs_queue.append( (d_inst, 1) )
-        
-        visited_insts = set()
-
-        while bfs_queue:
-            curr_inst, dist = bfs_queue.pop(0)
-            
-            if curr_inst in visited_insts: continue
-            visited_insts.add(curr_inst)
-            
-            # Record the node and its distance
-            cone_map[curr_inst] = dist
-            
-            # CHECK BOUNDARY: If it's a Flip-Flop, STOP tracing this path
-            # (Assumes library cells like DFF*, SDFF*, etc.)
-            ctype = self.inst_type.get(curr_inst, "")
-            if "DFF" in ctype or "reg" in ctype or "LA" in ctype: 
-                continue
-                
-            # Else, keep going deeper
-            curr_net = self.instance_to_output.get(curr_inst)
-            if curr_net:
-                upstream_nets = self.drivers.get(curr_net, [])
-                for u_net in upstream_nets:
-                    u_inst = self.net_driver_inst.get(u_net)
-                    if u_inst and u_inst not in visited_insts:
-                        bfs_queue.append( (u_inst, dist + 1) )
-                        
-        return cone_map
-
-# ==========================================
-# PART 2: FAILURE PARSER (Unchanged)
-# ==========================================
-def parse_tetramax_failures(filename):
-    print "[*] Parsing Failure Report: {}...".format(filename)
-    victims = []
-    try:
-        with open(filename, 'r') as f:
-            for line in f:
-                if len(line) < 5 or "defect" in line or "---" in line: continue
-                if any(c in line for c in ["ND", "AU", "AN", "AP", "NO"]):
-                    parts = line.split()
-                    if len(parts) > 0:
-                        path = parts[-1]
-                        if "/" in path:
-                            inst = path.split('/')[0]
-                            victims.append(inst)
-    except IOError:
-        print "Error: Could not read report file."
-        return []
-    return list(set(victims))
-
-# ==========================================
-# PART 3: WEIGHTED ANALYSIS & ELBOW SELECTION
-# ==========================================
-def run_weighted_analysis(circuit, victims):
-    print "[*] Running Distance-Weighted Topological Analysis..."
-    
-    # 1. Calculate Weighted Scores
-    node_scores = defaultdict(float)
-    
-    for victim in victims:
-        # Get map of {node: distance}
-        cone_map = circuit.get_full_fanin_cone(victim)
-        
-        for node, distance in cone_map.items():
-            # FILTER: Skip Global Reset Driver
-            if node == "U115": continue 
-            
-            # FORMULA: Score += 1 / (1 + distance)
-            weight = 1.0 / (1.0 + float(distance))
-            node_scores[node] += weight
-            
-        # Add the victim itself (Distance 0 -> Weight 1.0)
-        if victim != "U115": 
-            node_scores[victim] += 1.0
-
-    # 2. Sort Nodes
-    sorted_nodes = sorted(node_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    if not sorted_nodes: return []
-
-    # 3. ELBOW POINT SELECTION (The "Pure Analysis" Logic)
-    print "[*] Performing Knee-Point Selection (Threshold: {})...".format(ELBOW_THRESHOLD)
-    selected_nodes = []
-    
-    # Peak score is the reference
-    max_score = sorted_nodes[0][1]
-    
-    print "    Rank | Node       | Score  | Normalized"
-    print "    ---------------------------------------"
-    
-    for i in range(len(sorted_nodes)):
-        node, score = sorted_nodes[i]
-        
-        # Calculate Normalized Impact (0.0 to 1.0)
-        norm_score = score / max_score
-        
-        # Debug Print
-        if i < 10: 
-            print "    {:4} | {:10} | {:6.2f} | {:4.2f}".format(i+1, node, score, norm_score)
-        
-        # STOPPING CRITERIA:
-        # 1. Hard Engineering Limit (Budget)
-        if len(selected_nodes) >= MAX_AREA_BUDGET:
-            print "    -> Stopped: Hit Max Area Budget ({})".format(MAX_AREA_BUDGET)
-            break
-            
-        # 2. Diminishing Returns (Elbow)
-        # If this node has less than 10% of the impact of the best node, stop.
-        if norm_score < ELBOW_THRESHOLD:
-            print "    -> Stopped: Hit Diminishing Returns (Score < {}% of Peak)".format(ELBOW_THRESHOLD*100)
-            break
-            
-        selected_nodes.append((node, score))
-        
-    return selected_nodes
-
-# ==========================================
-# PART 4: TCL GENERATION (Unchanged Logic)
-# ==========================================
-def generate_tcl_script(selected_nodes, circuit):
-    print "[*] Generating TCL Script: {}...".format(OUTPUT_TCL)
-    with open(OUTPUT_TCL, 'w') as f:
-        f.write("# Stage 1: Inversion TPI Insertion\n")
-        f.write("set lib_cell_ref [get_object_name [get_lib_cells */XOR2X1_LVT]]\n")
-        f.write("if {$lib_cell_ref == \"\"} { echo \"Error: XOR2X1_LVT not found!\"; exit }\n\n")
-        
-        f.write("create_port -direction in TEST_ENABLE\n")
-        f.write("create_net TEST_ENABLE\n")
-        f.write("connect_net TEST_ENABLE TEST_ENABLE\n\n")
-        
-        for node, score in selected_nodes:
-            f.write("# Node: {} (Weighted Score: {:.2f})\n".format(node, score))
-            
-            if "reg" in node or "last_" in node or "DFF" in node:
-                pin_name = "Q"
-            else:
-                pin_name = "Y"
-                
-            full_pin_path = "{" + "{}/{}".format(node, pin_name) + "}"
-            clean_name = node.replace("\\", "").replace("[", "_").replace("]", "_")
-            xor_inst_name = "TPI_XOR_{}".format(clean_name)
-            new_net_name  = "n_tpi_{}".format(clean_name)
-
-            f.write("set target_net [get_nets -of_objects [get_pins {}]]\n".format(full_pin_path))
-            f.write("create_cell {{{}}} $lib_cell_ref\n".format(xor_inst_name))
-            f.write("disconnect_net $target_net {}\n".format(full_pin_path))
-            f.write("connect_net $target_net {}/Y\n".format(xor_inst_name))
-            f.write("create_net {}\n".format(new_net_name))
-            f.write("connect_net {} {}\n".format(new_net_name, full_pin_path))
-            f.write("connect_net {} {}/A1\n".format(new_net_name, xor_inst_name))
-            f.write("connect_net TEST_ENABLE {}/A2\n".format(xor_inst_name))
-            f.write("\n")
-
-# ==========================================
-# MAIN
-# ==========================================
-if __name__ == "__main__":
-    circuit = CircuitGraph()
-    circuit.parse_verilog(NETLIST_FILE)
-    victims = parse_tetramax_failures(REPORT_FILE)
-    if victims:
-        top_nodes = run_weighted_analysis(circuit, victims)
-        generate_tcl_script(top_nodes, circuit)
-    else:
-        print "Error: No victims found."
+import sys
+from collections import defaultdict
+
+from compact_graph import CompactGraph
+from graph_cache import load_graph
+from cone_scoring import coverage_table, expanded_cone, frame_scores, lazy_greedy, score_victims
+import instrument
+import tcl_emit
+from cell_library import output_pins
+from cop import CopEngine
+from fault_report import RPR_CLASSES, read_fault_report
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+NETLIST_FILE    = "b10.v"            
+REPORT_FILE     = "stage1_failures.rpt" 
+OUTPUT_TCL      = "insert_tpi_logic.tcl"
+GRAPH_CACHE_DIR = ".tpi_cache"  # Parsed-netlist cache (None disables)
+
+# PURE ANALYSIS PARAMETERS (No arbitrary depths)
+# ------------------------------------------------
+# ELBOW_THRESHOLD: The minimum relative impact required to select a node.
+# If a node has < 10% of the impact of the top node, we stop.
+ELBOW_THRESHOLD = 0.10  
+MAX_AREA_BUDGET = 5    # Hard engineering limit (safety net)
+
+# SCORING_MODE: "distance" ranks by cone overlap alone. "cop" re-ranks the
+# best COP_CANDIDATES of those nodes by the COP-estimated drop in random
+# test length of the victim faults, so no tool run is needed to check
+# whether an inversion point actually helps.
+SCORING_MODE    = "distance"
+COP_CANDIDATES  = 1000
+
+# SELECTION_MODE: "rank" takes nodes in score order. "celf" picks by
+# marginal victim coverage (lazy greedy), so victims already covered by a
+# closer selected node stop counting; elbow and budget rules still apply.
+SELECTION_MODE  = "rank"
+
+# SEQ_FRAMES: time frames traced back through registers when scoring.
+# 0 stops every cone at the first register; k also credits the logic up
+# to k register stages back, each frame weighted FRAME_DECAY times the one
+# before (cone_scoring.py). Applies to the "rank" selection.
+SEQ_FRAMES      = 0
+
+# ==========================================
+# PART 1: NETLIST PARSER
+# ==========================================
+class CircuitGraph:
+    def __init__(self, graph=None, eco=None):
+        # Integer-indexed CSR netlist; names are only used at the edges
+        self.graph = graph if graph is not None else CompactGraph()
+        self.eco = eco  # EcoSession keeping cone scores current across edits
+
+    def parse_verilog(self, filename):
+        print("[*] Parsing Netlist: {}...".format(filename))
+        self.graph = load_graph(filename, GRAPH_CACHE_DIR)
+        if self.graph.cache_hit:
+            print("    - Loaded {} instances from cache ({:.0f} ms).".format(self.graph.num_insts, self.graph.load_time * 1000))
+        else:
+            print("    - Parsed {} instances ({:.1f} MB/s).".format(self.graph.num_insts, self.graph.throughput))
+
+    # ---------------------------------------------------------
+    # NEW: Distance-Aware Cone Trace (BFS)
+    # ---------------------------------------------------------
+    def get_full_fanin_cone(self, start_inst, frames=0):
+        """
+        Traces backwards until a Register or Primary Input is hit, or
+        through `frames` register stages when frames > 0.
+        Returns a dictionary: {node_name: distance_from_fault}
+        With frames > 0 the distance is the shortest across frames and is
+        not what get_cone_scores() weighs.
+        """
+        start = self.graph.inst_index(start_inst)
+        if start < 0: return {}
+
+        names = self.graph.insts.names
+        if frames > 0:
+            cone = expanded_cone(self.graph, start, frames)
+        else:
+            cone = self.graph.fanin_cone(start)
+        return {names[i]: dist for i, dist in cone.items()}
+
+    def get_cone_scores(self, victims, frames=0):
+        """
+        Batched equivalent of summing 1/(1+distance) over
+        get_full_fanin_cone(v) for every victim v. With frames > 0,
+        frame k adds FRAME_DECAY**k times the product of each frame's
+        1/(1+d) over register paths (cone_scoring.frame_scores), which
+        the cone distances do not reproduce.
+        Returns a dictionary: {node_name: weighted_score}
+        """
+        if self.eco is not None and frames <= 0:
+            return self.eco.cone_scores(victims)
+        victim_ids = [i for i in (self.graph.inst_index(v) for v in victims) if i >= 0]
+        instrument.count("faults_unknown_instance", len(victims) - len(victim_ids))
+        names = self.graph.insts.names
+        if frames > 0:
+            scores = frame_scores(self.graph, victim_ids, frames)
+        else:
+            scores = score_victims(self.graph, victim_ids)
+        return {names[i]: score for i, score in scores.items()}
+
+    def get_cop_gains(self, candidates, victims):
+        """
+        COP estimate of how much an inversion point on each candidate
+        shortens the random-pattern test of the victims' stuck-at faults.
+        Returns a dictionary: {node_name: gain} (positive gains only)
+        """
+        engine = CopEngine(self.graph)
+        canonical = engine.circuit.canonical
+
+        def net_of(name):
+            inst = self.graph.inst_index(name)
+            if inst < 0 or self.graph.output_net(inst) < 0: return -1
+            return canonical[self.graph.output_net(inst)]
+
+        targets = [(net, value) for net in set(net_of(v) for v in victims) if net >= 0 for value in (0, 1)]
+        nets = {}
+        for node in candidates:
+            net = net_of(node)
+            if net >= 0: nets.setdefault(net, node)
+        return {nets[net]: gain for net, gain in engine.rank_candidates(list(nets), targets) if gain > 0}
+
+# ==========================================
+# PART 2: FAILURE PARSER
+# ==========================================
+def parse_tetramax_failures(filename):
+    print("[*] Parsing Failure Report: {}...".format(filename))
+    try:
+        # Primary faults only; "--" equivalents are not separate victims
+        report = read_fault_report(filename, RPR_CLASSES, include_equivalent=False)
+    except IOError:
+        print("Error: Could not read report file.")
+        return []
+    return report.instances()
+
+# ==========================================
+# PART 3: WEIGHTED ANALYSIS & ELBOW SELECTION
+# ==========================================
+def existing_points(graph):
+    """Names of the inversion points already in `graph` (TPI_XOR_*) and of the nodes they invert."""
+    names = graph.insts.names
+    points = set()
+    for inst in range(graph.num_insts):
+        if names[inst].rsplit("/", 1)[-1].startswith("TPI_XOR_"):
+            points.add(names[inst])
+            points.update(names[node] for node in graph.fanin[graph.fanin_ptr[inst]:graph.fanin_ptr[inst + 1]])
+    return points
+
+def run_weighted_analysis(circuit, victims, elbow_threshold=None, max_area_budget=None, scoring=None,
+                          selection=None, frames=None, exclude=()):
+    # Defaults come from the CONFIGURATION block at call time
+    if elbow_threshold is None: elbow_threshold = ELBOW_THRESHOLD
+    if max_area_budget is None: max_area_budget = MAX_AREA_BUDGET
+    if scoring is None: scoring = SCORING_MODE
+    if selection is None: selection = SELECTION_MODE
+    if frames is None: frames = SEQ_FRAMES
+    # Never pick a node twice across iterations: re-inverting it cancels the first point
+    skip = set(exclude) | existing_points(circuit.graph)
+    skip.add("U115")    # FILTER: Skip Global Reset Driver
+    if selection == "celf":
+        return run_coverage_selection(circuit, victims, elbow_threshold, max_area_budget, skip)
+    print("[*] Running Distance-Weighted Topological Analysis...")
+    if len(skip) > 1:
+        print("    - Skipping {} nodes with inversion points.".format(len(skip) - 1))
+    if frames > 0:
+        print("    - Tracing {} time frame(s) back through registers.".format(frames))
+    
+    # 1. Calculate Weighted Scores
+    # FORMULA: Score += 1 / (1 + distance), summed over every victim's cone
+    # in one batched sweep (same totals as one get_full_fanin_cone per victim)
+    node_scores = defaultdict(float)
+    
+    for node, score in circuit.get_cone_scores(victims, frames).items():
+        # FILTER: Skip Global Reset Driver and existing inversion points
+        if node in skip: continue 
+        node_scores[node] += score
+            
+    for victim in victims:
+        # Add the victim itself (Distance 0 -> Weight 1.0)
+        if victim not in skip: 
+            node_scores[victim] += 1.0
+
+    # 1b. Optional COP re-ranking of the strongest topological candidates
+    if scoring == "cop":
+        candidates = sorted(node_scores, key=node_scores.get, reverse=True)[:COP_CANDIDATES]
+        print("[*] Re-ranking {} candidates by COP detectability gain...".format(len(candidates)))
+        with instrument.phase("cop_rerank", candidates=len(candidates)):
+            node_scores = circuit.get_cop_gains(candidates, victims)
+
+    # 2. Sort Nodes
+    with instrument.phase("rank_nodes", nodes=len(node_scores)):
+        sorted_nodes = sorted(node_scores.items(), key=lambda x: x[1], reverse=True)
+    
+    if not sorted_nodes: return []
+
+    # 3. ELBOW POINT SELECTION (The "Pure Analysis" Logic)
+    print("[*] Performing Knee-Point Selection (Threshold: {})...".format(elbow_threshold))
+    selected_nodes = []
+    
+    # Peak score is the reference
+    max_score = sorted_nodes[0][1]
+    
+    print("    Rank | Node       | Score  | Normalized")
+    print("    ---------------------------------------")
+    
+    for i in range(len(sorted_nodes)):
+        node, score = sorted_nodes[i]
+        
+        # Calculate Normalized Impact (0.0 to 1.0)
+        norm_score = score / max_score
+        
+        # Debug Print
+        if i < 10: 
+            print("    {:4} | {:10} | {:6.2f} | {:4.2f}".format(i+1, node, score, norm_score))
+        
+        # STOPPING CRITERIA:
+        # 1. Hard Engineering Limit (Budget)
+        if len(selected_nodes) >= max_area_budget:
+            print("    -> Stopped: Hit Max Area Budget ({})".format(max_area_budget))
+            break
+            
+        # 2. Diminishing Returns (Elbow)
+        # If this node has less than 10% of the impact of the best node, stop.
+        if norm_score < elbow_threshold:
+            print("    -> Stopped: Hit Diminishing Returns (Score < {}% of Peak)".format(elbow_threshold*100))
+            break
+            
+        selected_nodes.append((node, score))
+        
+    return selected_nodes
+
+def run_coverage_selection(circuit, victims, elbow_threshold, max_area_budget, skip=("U115",)):
+    """
+    Lazy-greedy (CELF) selection on marginal distance-weighted coverage.
+    The first pick has the same score as in run_weighted_analysis; later
+    picks only count victims they reach closer than the nodes before.
+    Nodes named in `skip` are never picked.
+    """
+    print("[*] Running Coverage-Aware (Lazy Greedy) Selection...")
+    if len(skip) > 1:
+        print("    - Skipping {} nodes with inversion points.".format(len(skip) - 1))
+    graph = circuit.graph
+    # FILTER: Skip Global Reset Driver
+    victim_ids = [i for i in (graph.inst_index(v) for v in victims if v != "U115") if i >= 0]
+    table = coverage_table(graph, victim_ids)
+    exclude = set(graph.inst_index(node) for node in skip)
+
+    print("[*] Performing Knee-Point Selection (Threshold: {})...".format(elbow_threshold))
+    print("    Rank | Node       | Gain   | Normalized")
+    print("    ---------------------------------------")
+    selected_nodes = []
+    max_gain = None
+    evaluations = 0
+    for node, gain, evaluations in lazy_greedy(table, exclude):
+        name = graph.inst_name(node)
+        if max_gain is None: max_gain = gain
+        norm_gain = gain / max_gain if max_gain > 0 else 0.0
+        if len(selected_nodes) < 10:
+            print("    {:4} | {:10} | {:6.2f} | {:4.2f}".format(len(selected_nodes)+1, name, gain, norm_gain))
+
+        # Same stopping rules as the ranked selection, on marginal gain
+        if len(selected_nodes) >= max_area_budget:
+            print("    -> Stopped: Hit Max Area Budget ({})".format(max_area_budget))
+            break
+        if norm_gain < elbow_threshold:
+            print("    -> Stopped: Hit Diminishing Returns (Gain < {}% of Peak)".format(elbow_threshold*100))
+            break
+
+        selected_nodes.append((name, gain))
+    print("    - {} candidates, {} lazy re-evaluations.".format(len(table), evaluations))
+    instrument.count("lazy_evaluations", evaluations)
+    return selected_nodes
+
+# ==========================================
+# PART 4: TCL GENERATION (Unchanged Logic)
+# ==========================================
+def tpi_names(node, cell_type=None):
+    """
+    (driving pin, XOR instance, new net) of the inversion point on `node`.
+    With a Liberty library loaded the pin is the cell's own output (Q
+    first); otherwise it is guessed from the instance name.
+    """
+    outputs = output_pins(cell_type) if cell_type else None
+    if outputs:
+        pin_name = "Q" if "Q" in outputs else outputs[0]
+    elif "reg" in node or "last_" in node or "DFF" in node:
+        pin_name = "Q"
+    else:
+        pin_name = "Y"
+    # Hierarchical instances get their XOR inside the same module instance
+    path, leaf = "", node
+    if node[:1] != "\\" and "/" in node:
+        path, leaf = node.rsplit("/", 1)
+        path += "/"
+    clean_name = leaf.replace("\\", "").replace("[", "_").replace("]", "_")
+    return pin_name, "{}TPI_XOR_{}".format(path, clean_name), "{}n_tpi_{}".format(path, clean_name)
+
+def generate_tcl_script(selected_nodes, circuit, filename=None, mode=None, chunk_size=None):
+    if filename is None: filename = OUTPUT_TCL
+    if mode is None: mode = tcl_emit.TCL_MODE
+    print("[*] Generating TCL Script: {}...".format(filename))
+    with instrument.phase("write_tcl", stage=1), open(filename, 'w') as f:
+        tcl = tcl_emit.TclScript(f)
+        tcl.write("# Stage 1: Inversion TPI Insertion\n")
+        tcl.cmd("set lib_cell_ref [get_object_name [get_lib_cells */XOR2X1_LVT]]")
+        tcl.cmd("if {$lib_cell_ref == \"\"} { echo \"Error: XOR2X1_LVT not found!\"; exit }")
+        tcl.write("\n")
+        
+        tcl.cmd("create_port -direction in TEST_ENABLE")
+        tcl.cmd("create_net TEST_ENABLE")
+        tcl.cmd("connect_net TEST_ENABLE TEST_ENABLE")
+        tcl.write("\n")
+        
+        if mode == "bulk":
+            _write_bulk_tpi(tcl, selected_nodes, circuit, chunk_size or tcl_emit.CHUNK_SIZE)
+        else:
+            _write_tpi(tcl, selected_nodes, circuit)
+    tcl.report()
+
+def _node_cell(circuit, node):
+    """Cell type of `node` in the analyzed netlist, or None."""
+    inst = circuit.graph.inst_index(node) if circuit is not None else -1
+    return circuit.graph.cell_type(inst) if inst >= 0 else None
+
+def _write_tpi(tcl, selected_nodes, circuit):
+    for node, score in selected_nodes:
+        tcl.write("# Node: {} (Weighted Score: {:.2f})\n".format(node, score))
+        
+        pin_name, xor_inst_name, new_net_name = tpi_names(node, _node_cell(circuit, node))
+        full_pin_path = "{" + "{}/{}".format(node, pin_name) + "}"
+
+        tcl.cmd("set target_net [get_nets -of_objects [get_pins {}]]".format(full_pin_path))
+        tcl.cmd("create_cell {{{}}} $lib_cell_ref".format(xor_inst_name))
+        tcl.cmd("disconnect_net $target_net {}".format(full_pin_path))
+        tcl.cmd("connect_net $target_net {}/Y".format(xor_inst_name))
+        tcl.cmd("create_net {}".format(new_net_name))
+        tcl.cmd("connect_net {} {}".format(new_net_name, full_pin_path))
+        tcl.cmd("connect_net {} {}/A1".format(new_net_name, xor_inst_name))
+        tcl.cmd("connect_net TEST_ENABLE {}/A2".format(xor_inst_name))
+        tcl.write("\n")
+
+def _write_bulk_tpi(tcl, selected_nodes, circuit, chunk_size):
+    body = ["set target_net [get_nets -of_objects [get_pins $pin]]",
+            "disconnect_net $target_net $pin",
+            "connect_net $target_net $cell/Y",
+            "connect_net $net [list $pin $cell/A1]"]
+    for part, chunk in enumerate(tcl_emit.chunks(selected_nodes, chunk_size), 1):
+        rows = []
+        for node, _ in chunk:
+            pin_name, xor_inst_name, new_net_name = tpi_names(node, _node_cell(circuit, node))
+            rows.append(("{}/{}".format(node, pin_name), xor_inst_name, new_net_name))
+        tcl.write("# Chunk {}: {} inversion points\n".format(part, len(rows)))
+        tcl.set_list("tpi_rows", [item for row in rows for item in row], 3)
+        tcl.set_list("tpi_cells", [row[1] for row in rows], 8)
+        tcl.set_list("tpi_nets", [row[2] for row in rows], 8)
+        tcl.cmd("create_cell $tpi_cells $lib_cell_ref")
+        tcl.cmd("create_net $tpi_nets")
+        tcl.foreach(("pin", "cell", "net"), "tpi_rows", body, len(rows))
+        tcl.set_list("tpi_te_pins", ["{}/A2".format(row[1]) for row in rows], 8)
+        tcl.cmd("connect_net TEST_ENABLE $tpi_te_pins")
+        tcl.write("\n")
+
+# ==========================================
+# MAIN
+# ==========================================
+if __name__ == "__main__":
+    circuit = CircuitGraph()
+    circuit.parse_verilog(NETLIST_FILE)
+    victims = parse_tetramax_failures(REPORT_FILE)
+    if victims:
+        top_nodes = run_weighted_analysis(circuit, victims)
+        generate_tcl_script(top_nodes, circuit)
+    else:
+        print("Error: No victims found.")
@@ -1,6 +1,12 @@
-import re
 import sys
 
+import instrument
+import tcl_emit
+from cell_library import cell_function, truth_table
+from compact_graph import PIN_OUT, CompactGraph, cell_pin_direction
+from fault_report import read_fault_report
+from graph_cache import load_graph
+
 # ==========================================
 # CONFIGURATION
 # ==========================================
@@ -8,179 +14,384 @@ NETLIST_FILE     = "test_scan_b10_tpi.v"
 FAULT_REPORT     = "stage2_failures.rpt"
 OUTPUT_TCL       = "insert_atomic_fix.tcl"
 TEST_PORT_NAME   = "TEST_ENABLE"  # Reusing your existing port
+GRAPH_CACHE_DIR  = ".tpi_cache"  # Parsed-netlist cache (None disables)
 
 # ==========================================
 # PART 1: PARSERS
 # ==========================================
 class CircuitAnalyzer:
-    def __init__(self):
-        self.gates = {} 
+    def __init__(self, graph=None):
+        self.graph = graph if graph is not None else CompactGraph()
+        self.report = None  # Indexed FaultList
         self.faults = [] 
 
     def parse_verilog(self, filename):
-        print "[*] Parsing Netlist: {}...".format(filename)
-        with open(filename, 'r') as f:
-            content = f.read()
-
-        instance_pattern = re.compile(r'([a-zA-Z0-9_]+)\s+([\\a-zA-Z0-9_\[\]]+)\s*\((.*?)\);', re.DOTALL)
-        
-        for cell_type, inst_name, pin_block in instance_pattern.findall(content):
-            pin_pattern = re.compile(r'\.([a-zA-Z0-9_]+)\s*\(\s*([a-zA-Z0-9_\[\]\\]+)\s*\)')
-            pin_matches = pin_pattern.findall(pin_block)
-            
-            pins_map = {}
-            for port, net in pin_matches:
-                pins_map[port] = net
-            
-            clean_name = inst_name.strip()
-            self.gates[clean_name] = {
-                'type': cell_type,
-                'pins': pins_map
-            }
-        print "    - Indexed {} gates.".format(len(self.gates))
+        print("[*] Parsing Netlist: {}...".format(filename))
+        self.graph = load_graph(filename, GRAPH_CACHE_DIR)
+        if self.graph.cache_hit:
+            print("    - Loaded {} gates from cache ({:.0f} ms).".format(self.graph.num_insts, self.graph.load_time * 1000))
+        else:
+            print("    - Indexed {} gates ({:.1f} MB/s).".format(self.graph.num_insts, self.graph.throughput))
 
     def parse_failures(self, filename):
-        print "[*] Parsing Fault List: {}...".format(filename)
+        print("[*] Parsing Fault List: {}...".format(filename))
         try:
-            with open(filename, 'r') as f:
-                for line in f:
-                    parts = line.split()
-                    if len(parts) >= 3:
-                        ftype = parts[0]
-                        location = parts[2]
-                        if "/" in location:
-                            inst, pin = location.split('/')
-                            self.faults.append({'inst': inst, 'pin': pin, 'type': ftype})
+            self.report = read_fault_report(filename)
         except IOError:
-            print "Error: Could not read fault report."
+            print("Error: Could not read fault report.")
+            return
+        for fault in self.report:
+            if fault.inst is not None:
+                self.faults.append({'inst': fault.inst, 'pin': fault.pin, 'type': fault.type})
 
 # ==========================================
 # PART 2: TRAP LOGIC
 # ==========================================
-def find_traps(analyzer):
-    print "[*] Correlating Faults with Blocking Gates..."
-    fixes = []
-    
-    for f in analyzer.faults:
-        inst = f['inst']
-        victim_pin = f['pin']
-        
-        if inst not in analyzer.gates: 
-            if ("\\" + inst) in analyzer.gates:
-                inst = "\\" + inst
-            else:
-                continue
-        
-        gate = analyzer.gates[inst]
-        g_type = gate['type'].upper()
-        
-        # Determine Logic
-        forcing_action = None
-        if "AND" in g_type or "NAND" in g_type:
-            forcing_action = "FORCE_1" # Need 1 to unblock
-        elif "OR" in g_type or "NOR" in g_type or "XOR" in g_type:
-            forcing_action = "FORCE_0" # Need 0 to unblock
-            
-        if not forcing_action: continue
+# Faults are grouped per gate and each gate is analyzed once. For cells
+# with a known function (cell_library) the analysis runs on the truth
+# table: a fault on input P shows at the output on the rows where P is
+# activated and flipping P flips the output; an output fault on the
+# rows where the output differs from the stuck value. Forcing side input
+# S to v keeps only the rows with S == v. Greedily, the (S, v) that
+# raises the detection probability of the most faults on the gate is
+# taken, until no forcing helps any uncovered fault. Only sensitizing
+# values are candidates: a value that makes the output constant, or
+# leaves any fault on the gate with no detecting row, would block the
+# gate in test mode instead of unblocking it. That finds the
+# blocking values of AOI/OAI/MUX cells too (MUX21 A1 -> S0 = 0), and
+# none for XOR, where no side value blocks. Cells of unknown function
+# fall back to the cell-name rule (AND* -> 1, OR* -> 0).
+#
+# The plan depends only on the cell type and the gate's (pin, type)
+# fault signature, so it is cached on those; million-fault reports hit
+# a few hundred distinct plans.
 
-        side_nets = []
-        side_pins = []
-        
-        for pin_name, net_name in gate['pins'].items():
-            if pin_name != victim_pin and pin_name not in ['Y', 'Z', 'Q', 'QN']:
-                side_nets.append(net_name)
-                side_pins.append(pin_name)
+STUCK_VALUES = {'sa0': 0, 'sa1': 1}
+_PLANS = {}
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def _fault_rows(tt, n, pin, stuck):
+    """Input rows (bit k: assignment k) where the fault is activated and reaches the output."""
+    rows = 0
+    for k in range(1 << n):
+        out = (tt >> k) & 1
+        if pin < 0:
+            hit = stuck is not None and out != stuck
+        elif stuck is not None and ((k >> pin) & 1) == stuck:
+            hit = False
+        else:
+            hit = out != (tt >> (k ^ (1 << pin))) & 1
+        if hit:
+            rows |= 1 << k
+    return rows
+
+
+def _pin_rows(n, pin, value):
+    rows = 0
+    for k in range(1 << n):
+        if ((k >> pin) & 1) == value:
+            rows |= 1 << k
+    return rows
+
+
+def _plan_by_function(function, signature):
+    n = len(function.inputs)
+    tt = truth_table(function)
+    faults = []
+    hosts = set()
+    for pin, ftype in signature:
+        stuck = STUCK_VALUES.get(ftype)
+        if pin in function.inputs:
+            idx = function.inputs.index(pin)
+            hosts.add(idx)
+        elif pin == function.output and stuck is not None:
+            idx = -1
+        else:
+            faults.append(None)
+            continue
+        faults.append(_fault_rows(tt, n, idx, stuck))
+
+    allowed = (1 << (1 << n)) - 1
+    modeled = [j for j, rows in enumerate(faults) if rows is not None]
+    live = list(modeled)
+    forced = set()
+    plan = []
+    while live:
+        best = None
+        for i in range(n):
+            if i in hosts or i in forced:
+                continue    # Forcing a faulty pin would mask its own fault
+            for value in (1, 0):
+                cond = allowed & _pin_rows(n, i, value)
+                if not cond or (tt & cond) in (0, cond):
+                    continue    # Controlling value: constant output in test mode
+                if any(faults[j] & allowed and not faults[j] & cond for j in modeled):
+                    continue    # Would leave a fault on the gate undetectable
+                gained = []
+                total = 0.0
+                for j in live:
+                    before = _popcount(faults[j] & allowed) / float(_popcount(allowed))
+                    after = _popcount(faults[j] & cond) / float(_popcount(cond))
+                    if after > before + 1e-9:
+                        gained.append(j)
+                        total += after - before
+                if gained and (best is None or (len(gained), total) > best[0]):
+                    best = ((len(gained), total), i, value, cond, gained)
+        if best is None:
+            break
+        _, i, value, allowed, gained = best
+        forced.add(i)
+        plan.append((function.inputs[i], "FORCE_1" if value else "FORCE_0", tuple(gained)))
+        live = [j for j in live if j not in gained]
+    return plan
+
+
+def _plan_by_name(cell_type, pin_names, signature):
+    g_type = cell_type.upper()
+    if "AND" in g_type:
+        action = "FORCE_1"  # Need 1 to unblock
+    elif "OR" in g_type and "XOR" not in g_type and "XNOR" not in g_type:
+        action = "FORCE_0"  # Need 0 to unblock
+    else:
+        return []
+    hosts = set(pin for pin, _ in signature)
+    for pin in pin_names:
+        if pin not in hosts and cell_pin_direction(cell_type, pin) != PIN_OUT:
+            return [(pin, action, tuple(range(len(signature))))]
+    return []
+
+
+def gate_plan(cell_type, pin_names, signature):
+    """
+    [(side pin, action, covered)] for faults `signature` = ((pin, type), ...)
+    on a cell of `cell_type` with pins `pin_names`; covered indexes
+    signature. Cached per (cell type, pins, signature).
+    """
+    key = (cell_type, pin_names, signature)
+    plan = _PLANS.get(key)
+    if plan is None:
+        function = cell_function(cell_type)
+        if function is not None and all(p in pin_names for p in function.inputs):
+            plan = _plan_by_function(function, signature)
+        else:
+            plan = _plan_by_name(cell_type, pin_names, signature)
+        _PLANS[key] = plan
+    return plan
 
-        if not side_nets: continue
-        
-        blocker_net = side_nets[0]
-        blocker_pin = side_pins[0]
-
-        duplicate = False
-        for fix in fixes:
-            if fix['gate'] == inst and fix['gate_pin'] == blocker_pin:
-                duplicate = True
-                break
-        
-        if not duplicate:
-            # print "    -> MATCH: {}/{} blocked by '{}'".format(inst, victim_pin, blocker_net)
-            fixes.append({
-                'gate': inst,
-                'gate_pin': blocker_pin,
-                'side_net': blocker_net,
-                'action': forcing_action,
-                'victim': f['inst'] + "/" + f['pin']
-            })
 
+def analyze_gate(graph, gate_id, signature):
+    """
+    Forcing fixes for one gate: [{'gate', 'gate_pin', 'side_net',
+    'action', 'covered'}]. Depends only on the gate's own cell type and
+    pins, so an edit elsewhere never changes the answer.
+    """
+    pins = graph.pins(gate_id)
+    nets = dict(pins)
+    inst = graph.inst_name(gate_id)
+    return [{'gate': inst, 'gate_pin': pin, 'side_net': nets[pin], 'action': action, 'covered': covered}
+            for pin, action, covered in gate_plan(graph.cell_type(gate_id), tuple(p for p, _ in pins), signature)]
+
+
+def trap_for_fault(graph, f):
+    """
+    Best blocking side input for fault `f` alone, as a fix dict without
+    the 'victim' key, or None.
+    """
+    gate_id = graph.inst_index(f['inst'], escaped_fallback=True)
+    if gate_id < 0:
+        instrument.count("faults_unknown_instance")
+        return None
+    fixes = analyze_gate(graph, gate_id, ((f['pin'], f['type']),))
+    if not fixes:
+        return None
+    fix = fixes[0]
+    del fix['covered']
+    return fix
+
+
+def group_faults(graph, faults):
+    """{gate ID: [faults]} in report order per gate; each name is resolved once."""
+    index = {}
+    groups = {}
+    for f in faults:
+        gate_id = index.get(f['inst'])
+        if gate_id is None:
+            gate_id = index[f['inst']] = graph.inst_index(f['inst'], escaped_fallback=True)
+            if gate_id < 0:
+                instrument.count("faults_unknown_instance")
+        if gate_id >= 0:
+            groups.setdefault(gate_id, []).append(f)
+    return groups
+
+
+def find_traps(analyzer, gate_lookup=None):
+    """
+    One fix per forced (gate, pin), in netlist order of the gates.
+    gate_lookup(gate_id, signature) replaces analyze_gate, e.g. an
+    EcoSession's cached analysis.
+    """
+    print("[*] Correlating Faults with Blocking Gates...")
+    with instrument.phase("find_traps", faults=len(analyzer.faults)):
+        fixes = _collect_traps(analyzer, gate_lookup)
+    print("    - {} fixes unblock {} faults.".format(len(fixes), sum(len(fix['victims']) for fix in fixes)))
+    return fixes
+
+
+def _collect_traps(analyzer, gate_lookup):
+    graph = analyzer.graph
+    groups = group_faults(graph, analyzer.faults)
+    fixes = []
+    index = {}  # (gate, pin) -> fix
+    for gate_id in sorted(groups):
+        gate_faults = groups[gate_id]
+        signature = tuple(sorted(set((f['pin'], f['type']) for f in gate_faults)))
+        traps = gate_lookup(gate_id, signature) if gate_lookup else analyze_gate(graph, gate_id, signature)
+        function = cell_function(graph.cell_type(gate_id))
+        if function is not None:
+            unmodeled = sum(1 for f in gate_faults if f['pin'] == function.output and f['type'] not in STUCK_VALUES)
+            if unmodeled:
+                instrument.count("output_faults_unmodeled", unmodeled)
+        for trap in traps:
+            key = (trap['gate'], trap['gate_pin'])
+            if key in index:
+                continue
+            covered = set(signature[j] for j in trap['covered'])
+            victims = []
+            named = set()
+            for f in gate_faults:
+                name = f['inst'] + "/" + f['pin']
+                if (f['pin'], f['type']) in covered and name not in named:
+                    named.add(name)
+                    victims.append(name)
+            fix = dict((k, v) for k, v in trap.items() if k != 'covered')
+            fix['victim'] = victims[0]
+            fix['victims'] = victims
+            index[key] = fix
+            fixes.append(fix)
     return fixes
 
 # ==========================================
 # PART 3: GENERATE TCL (INTEGRATED)
 # ==========================================
-def generate_tcl(fixes, filename):
-    print "[*] Generating Atomic Fix TCL: {}...".format(filename)
+TE_INV_CELL = "U_TE_INV"
+TE_INV_NET  = "n_TEST_ENABLE_bar"
+
+
+def fix_names(count, side_net):
+    """(forcing gate instance, safe net) of fix number `count` (1-based)."""
+    safe_net = "n_safe_{}_{}".format(count, side_net.replace("\\","").replace("[","_").replace("]","").replace("/","_"))
+    return "U_ATOMIC_FIX_{}".format(count), safe_net
+
+
+def generate_tcl(fixes, filename, test_port=None, mode=None, chunk_size=None):
+    if test_port is None: test_port = TEST_PORT_NAME
+    if mode is None: mode = tcl_emit.TCL_MODE
+    print("[*] Generating Atomic Fix TCL: {}...".format(filename))
     
     # Check if we need the inverter (Do we have any FORCE_0 cases?)
     need_inverter = any(f['action'] == "FORCE_0" for f in fixes)
     
-    with open(filename, 'w') as f:
-        f.write("# Phase 2: Atomic Fix using Existing TEST_ENABLE\n")
+    with instrument.phase("write_tcl", stage=2), open(filename, 'w') as f:
+        tcl = tcl_emit.TclScript(f)
+        tcl.write("# Phase 2: Atomic Fix using Existing TEST_ENABLE\n")
         
-        f.write("set LIB_OR  [get_lib_cells */OR2*]\n")
-        f.write("set LIB_AND [get_lib_cells */AND2*]\n")
-        f.write("set LIB_INV [get_lib_cells */INV*]\n") # Need Inverter for polarity
+        tcl.cmd("set LIB_OR  [get_lib_cells */OR2*]")
+        tcl.cmd("set LIB_AND [get_lib_cells */AND2*]")
+        tcl.cmd("set LIB_INV [get_lib_cells */INV*]") # Need Inverter for polarity
         
         # Note: We do NOT create_port because TEST_ENABLE already exists.
         
         # 1. Create Helper Inverter if needed (for Force 0 logic)
         if need_inverter:
-            f.write("\n# --- Helper: Invert TEST_ENABLE for Force 0 Logic ---\n")
-            f.write("create_cell U_TE_INV [index_collection $LIB_INV 0]\n")
-            f.write("create_net n_TEST_ENABLE_bar\n")
-            f.write("connect_net {} U_TE_INV/A\n".format(TEST_PORT_NAME))
-            f.write("connect_net n_TEST_ENABLE_bar U_TE_INV/Y\n")
-            f.write("# ----------------------------------------------------\n\n")
-
-        count = 0
-        for fix in fixes:
-            count += 1
-            gate_name = fix['gate']
-            pin_name  = fix['gate_pin']
-            side_net  = fix['side_net']
+            tcl.write("\n# --- Helper: Invert TEST_ENABLE for Force 0 Logic ---\n")
+            tcl.cmd("create_cell {} [index_collection $LIB_INV 0]".format(TE_INV_CELL))
+            tcl.cmd("create_net {}".format(TE_INV_NET))
+            tcl.cmd("connect_net {} {}/A".format(test_port, TE_INV_CELL))
+            tcl.cmd("connect_net {} {}/Y".format(TE_INV_NET, TE_INV_CELL))
+            tcl.write("# ----------------------------------------------------\n\n")
+
+        if mode == "bulk":
+            _write_bulk_fixes(tcl, fixes, test_port, chunk_size or tcl_emit.CHUNK_SIZE)
+        else:
+            _write_fixes(tcl, fixes, test_port)
+    tcl.report()
+
+
+def _write_fixes(tcl, fixes, test_port):
+    count = 0
+    for fix in fixes:
+        count += 1
+        gate_name = fix['gate']
+        pin_name  = fix['gate_pin']
+        side_net  = fix['side_net']
+        
+        inst_name, safe_net = fix_names(count, side_net)
+        
+        tcl.write("# Fix #{}: Unblocking {} ({})\n".format(count, fix['victim'], fix['action']))
+        
+        if fix['action'] == "FORCE_1":
+            # INSERT OR GATE (Passes 1 when TEST_ENABLE is 1)
+            tcl.cmd("create_cell {} [index_collection $LIB_OR 0]".format(inst_name))
+            tcl.cmd("create_net {}".format(safe_net))
             
-            inst_name = "U_ATOMIC_FIX_{}".format(count)
-            safe_net  = "n_safe_{}_{}".format(count, side_net.replace("\\","").replace("[","_").replace("]",""))
+            tcl.cmd("disconnect_net {} {}/{}".format(side_net, gate_name, pin_name))
+            tcl.cmd("connect_net {} {}/{}".format(safe_net, gate_name, pin_name))
             
-            f.write("# Fix #{}: Unblocking {} ({})\n".format(count, fix['victim'], fix['action']))
+            tcl.cmd("connect_net {} {}/A1".format(side_net, inst_name))
+            tcl.cmd("connect_net {} {}/A2".format(test_port, inst_name)) 
+            tcl.cmd("connect_net {} {}/Y".format(safe_net, inst_name))
+            tcl.write("\n")
+
+        elif fix['action'] == "FORCE_0":
+            # INSERT AND GATE (Passes 0 when n_TEST_ENABLE_bar is 0... Wait!)
+            # Logic Check: We want Output=0 when Test=1.
+            # AND Gate: A1=Side, A2=Control.
+            # If Control=0 -> Output=0. 
+            # So we connect A2 to n_TEST_ENABLE_bar (which is 0 when Test=1).
+            
+            tcl.cmd("create_cell {} [index_collection $LIB_AND 0]".format(inst_name))
+            tcl.cmd("create_net {}".format(safe_net))
+            
+            tcl.cmd("disconnect_net {} {}/{}".format(side_net, gate_name, pin_name))
+            tcl.cmd("connect_net {} {}/{}".format(safe_net, gate_name, pin_name))
             
-            if fix['action'] == "FORCE_1":
-                # INSERT OR GATE (Passes 1 when TEST_ENABLE is 1)
-                f.write("create_cell {} [index_collection $LIB_OR 0]\n".format(inst_name))
-                f.write("create_net {}\n".format(safe_net))
-                
-                f.write("disconnect_net {} {}/{}\n".format(side_net, gate_name, pin_name))
-                f.write("connect_net {} {}/{}\n".format(safe_net, gate_name, pin_name))
-                
-                f.write("connect_net {} {}/A1\n".format(side_net, inst_name))
-                f.write("connect_net {} {}/A2\n".format(TEST_PORT_NAME, inst_name)) 
-                f.write("connect_net {} {}/Y\n\n".format(safe_net, inst_name))
-
-            elif fix['action'] == "FORCE_0":
-                # INSERT AND GATE (Passes 0 when n_TEST_ENABLE_bar is 0... Wait!)
-                # Logic Check: We want Output=0 when Test=1.
-                # AND Gate: A1=Side, A2=Control.
-                # If Control=0 -> Output=0. 
-                # So we connect A2 to n_TEST_ENABLE_bar (which is 0 when Test=1).
-                
-                f.write("create_cell {} [index_collection $LIB_AND 0]\n".format(inst_name))
-                f.write("create_net {}\n".format(safe_net))
-                
-                f.write("disconnect_net {} {}/{}\n".format(side_net, gate_name, pin_name))
-                f.write("connect_net {} {}/{}\n".format(safe_net, gate_name, pin_name))
-                
-                f.write("connect_net {} {}/A1\n".format(side_net, inst_name))
-                f.write("connect_net n_TEST_ENABLE_bar {}/A2\n".format(inst_name)) 
-                f.write("connect_net {} {}/Y\n\n".format(safe_net, inst_name))
+            tcl.cmd("connect_net {} {}/A1".format(side_net, inst_name))
+            tcl.cmd("connect_net {} {}/A2".format(TE_INV_NET, inst_name)) 
+            tcl.cmd("connect_net {} {}/Y".format(safe_net, inst_name))
+            tcl.write("\n")
+
+
+def _write_bulk_fixes(tcl, fixes, test_port, chunk_size):
+    # Same numbering as the per-pin script, so instance names do not depend on the mode
+    groups = {"FORCE_1": [], "FORCE_0": []}
+    for count, fix in enumerate(fixes, 1):
+        if fix['action'] in groups:
+            inst_name, safe_net = fix_names(count, fix['side_net'])
+            groups[fix['action']].append((inst_name, safe_net, fix['side_net'],
+                                          "{}/{}".format(fix['gate'], fix['gate_pin'])))
+
+    tcl.cmd("set OR_REF  [index_collection $LIB_OR 0]")
+    tcl.cmd("set AND_REF [index_collection $LIB_AND 0]")
+    tcl.write("\n")
+    body = ["disconnect_net $side $pin",
+            "connect_net $safe [list $pin $cell/Y]",
+            "connect_net $side $cell/A1"]
+    for action, ref, control in (("FORCE_1", "$OR_REF", test_port), ("FORCE_0", "$AND_REF", TE_INV_NET)):
+        for part, rows in enumerate(tcl_emit.chunks(groups[action], chunk_size), 1):
+            tcl.write("# {} chunk {}: {} fixes\n".format(action, part, len(rows)))
+            tcl.set_list("fix_rows", [item for row in rows for item in row], 4)
+            tcl.set_list("fix_cells", [row[0] for row in rows], 8)
+            tcl.set_list("fix_nets", [row[1] for row in rows], 8)
+            tcl.cmd("create_cell $fix_cells {}".format(ref))
+            tcl.cmd("create_net $fix_nets")
+            tcl.foreach(("cell", "safe", "side", "pin"), "fix_rows", body, len(rows))
+            tcl.set_list("fix_ctrl_pins", ["{}/A2".format(row[0]) for row in rows], 8)
+            tcl.cmd("connect_net {} $fix_ctrl_pins".format(control))
+            tcl.write("\n")
 
 if __name__ == "__main__":
     analyzer = CircuitAnalyzer()
@@ -188,4 +399,4 @@ if __name__ == "__main__":
     analyzer.parse_failures(FAULT_REPORT)
     fixes = find_traps(analyzer)
     if fixes: generate_tcl(fixes, OUTPUT_TCL)
-    else: print "No atomic candidates found."
+    else: print("No atomic candidates found.")
@@ -1,5 +1,13 @@
-import re
+import heapq
 import sys
+from collections import defaultdict
+
+import instrument
+import tcl_emit
+from cell_library import cell_function, output_pins, pin_sensitivity
+from compact_graph import PIN_OUT as PIN_DIR_OUT, PORT_OUT, CompactGraph
+from fault_report import read_fault_report
+from graph_cache import load_graph
 
 # ==========================================
 # CONFIGURATION
@@ -8,6 +16,11 @@ NETLIST_FILE     = "test_scan_b10_tpi.v"
 FAILURE_RPT      = "stage2_failures.rpt" # Ensure this file exists from your previous analysis!
 OUTPUT_TCL       = "insert_xor_trees.tcl"
 OBS_PORT_NAME    = "TEST_OBSERVE"
+OBS_PORTS        = 1      # Observe ports, one balanced XOR tree each
+MAX_XOR_DEPTH    = None   # XOR levels per tree (None: no limit)
+OBS_DISTANCE     = 3      # Max gates from a failing instance to its observed net (0: its own output)
+MIN_PROPAGATION  = 0.5    # Min estimated chance the fault effect reaches that net
+GRAPH_CACHE_DIR  = ".tpi_cache"  # Parsed-netlist cache (None disables)
 
 # --- LIBRARY PIN NAMES (UPDATED FOR YOUR NETLIST) ---
 PIN_IN1 = "A1"   
@@ -18,50 +31,100 @@ PIN_OUT = "Y"
 # PART 1: ANALYZE THE FIXES
 # ==========================================
 class CircuitAnalyzer:
-    def __init__(self):
-        self.gates = {} 
+    def __init__(self, graph=None):
+        self.graph = graph if graph is not None else CompactGraph()
+        self.report = None  # Indexed FaultList
         self.faults = [] 
 
     def parse_verilog(self, filename):
-        print "[*] Parsing Netlist..."
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        # Regex to capture instance name and pin block
-        # Handles escaped names like \stato_reg[0]
-        instance_pattern = re.compile(r'([a-zA-Z0-9_]+)\s+([\\a-zA-Z0-9_\[\]]+)\s*\((.*?)\);', re.DOTALL)
-        
-        for cell_type, inst_name, pin_block in instance_pattern.findall(content):
-            # Regex to find .PIN(NET)
-            pin_pattern = re.compile(r'\.([a-zA-Z0-9_]+)\s*\(\s*([a-zA-Z0-9_\[\]\\]+)\s*\)')
-            pin_matches = pin_pattern.findall(pin_block)
-            pins = {p: n for p, n in pin_matches}
-            
-            clean_name = inst_name.strip()
-            self.gates[clean_name] = {'pins': pins}
+        print("[*] Parsing Netlist...")
+        # Escaped names like \stato_reg[0] are interned without the trailing space
+        self.graph = load_graph(filename, GRAPH_CACHE_DIR)
 
     def parse_failures(self, filename):
-        print "[*] Parsing Failures..."
+        print("[*] Parsing Failures...")
         try:
-            with open(filename, 'r') as f:
-                for line in f:
-                    parts = line.split()
-                    # Expecting format: "stuck_0   U123/Y" or similar
-                    if len(parts) >= 3:
-                        location = parts[2]
-                        if "/" in location:
-                            inst, pin = location.split('/')
-                            self.faults.append(inst)
+            # Expecting format: "sa0   AU   U123/Y"
+            self.report = read_fault_report(filename)
         except IOError:
-            print "Error reading report: {}".format(filename)
+            print("Error reading report: {}".format(filename))
+            return
+        for fault in self.report:
+            if fault.inst is not None:
+                self.faults.append(fault.inst)
 
 # ==========================================
-# PART 2: GENERATE XOR TREE TCL
+# PART 2: OBSERVATION POINT SELECTION
 # ==========================================
-def generate_xor_tcl(analyzer, filename):
-    print "[*] Generating XOR Observation Logic: {}...".format(filename)
-    
-    obs_nets = []
+# A failing instance is covered by observing its own output net, or any
+# net downstream of it that its fault effect is likely to reach. The
+# FanoutIndex walks forward from each failing instance (through at most
+# OBS_DISTANCE gates, never through registers), multiplying the chance
+# each gate passes a change on that pin (cell_library.pin_sensitivity,
+# e.g. 0.5 per AND2 side, 1.0 through XOR/INV). Nets reached with at
+# least MIN_PROPAGATION become candidates, and a greedy set cover then
+# picks the fewest nets covering every failing instance -- one net
+# downstream of a reconvergence replaces all the outputs feeding it.
+# OBS_DISTANCE = 0 observes every failing output directly.
+
+class FanoutIndex:
+    """Forward reach of instances on one graph; per-cell pin sensitivities are cached."""
+    def __init__(self, graph, max_distance=None, min_propagation=None):
+        if max_distance is None: max_distance = OBS_DISTANCE
+        if min_propagation is None: min_propagation = MIN_PROPAGATION
+        self.graph = graph
+        self.max_distance = max_distance
+        self.min_propagation = min_propagation
+        self._sensitivity = {}  # (cell ID, pin name ID) -> probability
+
+    def sensitivity(self, load, pin_id):
+        g = self.graph
+        key = (g.inst_cell[load], pin_id)
+        prob = self._sensitivity.get(key)
+        if prob is None:
+            function = cell_function(g.cell_type(load))
+            prob = pin_sensitivity(function, g.pin_names.names[pin_id]) if function else 0.0
+            self._sensitivity[key] = prob
+        return prob
+
+    def reach(self, start):
+        """{inst ID: propagation estimate} of combinational instances downstream of `start`."""
+        g = self.graph
+        fanout, fanout_ptr = g.fanout, g.fanout_ptr
+        best = {start: 1.0}
+        # Per node, the (distance, estimate) labels no other label beats on both:
+        # a shorter but weaker path can still reach loads a stronger one cannot
+        labels = {start: [(0, 1.0)]}
+        heap = [(-1.0, 0, start)]
+        while heap:
+            neg, dist, node = heapq.heappop(heap)
+            if dist == self.max_distance or (dist, -neg) not in labels[node]:
+                continue
+            for load in fanout[fanout_ptr[node]:fanout_ptr[node + 1]]:
+                if g.cell_seq[g.inst_cell[load]] or g.inst_out[load] < 0:
+                    continue    # Registers capture, they do not pass on
+                # Best pin of the load reading this node
+                sens = 0.0
+                for p in range(g.pin_ptr[load], g.pin_ptr[load + 1]):
+                    if g.pin_dir[p] != PIN_DIR_OUT and g.net_driver[g.pin_net[p]] == node:
+                        sens = max(sens, self.sensitivity(load, g.pin_name[p]))
+                prob = -neg * sens
+                if prob < self.min_propagation:
+                    continue
+                front = labels.get(load, [])
+                if any(d <= dist + 1 and p >= prob for d, p in front):
+                    continue
+                labels[load] = [(d, p) for d, p in front if d < dist + 1 or p > prob] + [(dist + 1, prob)]
+                if prob > best.get(load, 0.0):
+                    best[load] = prob
+                heapq.heappush(heap, (-prob, dist + 1, load))
+        del best[start]
+        return best
+
+
+def _failing_outputs(analyzer):
+    """[(gate ID, output net)] of the failing instances, once each, in report order."""
+    outputs = []
     seen_gates = set()
     
     # Find the output nets of the failing instances
@@ -69,76 +132,213 @@ def generate_xor_tcl(analyzer, filename):
         if inst in seen_gates: continue
         
         # Handle case where report has "U123" but netlist has "\U123 "
-        lookup_name = inst
-        if lookup_name not in analyzer.gates: 
-             if ("\\" + inst) in analyzer.gates: lookup_name = "\\" + inst
-             else: continue
+        gate_id = analyzer.graph.inst_index(inst, escaped_fallback=True)
+        if gate_id < 0:
+            instrument.count("faults_unknown_instance")
+            continue
         
         seen_gates.add(inst)
-        gate_info = analyzer.gates[lookup_name]
+        gate_pins = analyzer.graph.pin_map(gate_id)
         
-        # Heuristic to find output pin (Y, Q, Z, etc)
         out_net = None
-        for p in ['Y', 'Q', 'QN', 'Z', 'SO', 'out', 'OUT']:
-            if p in gate_info['pins']:
-                out_net = gate_info['pins'][p]
-                # Prefer Q over QN if both exist, but take what we can get
-                if p == 'Q': break 
+        library_outputs = output_pins(analyzer.graph.cell_type(gate_id))
+        if library_outputs:
+            # Library cell: its first connected output, Q before QN
+            for p in sorted(library_outputs, key=lambda p: p != 'Q'):
+                if p in gate_pins:
+                    out_net = gate_pins[p]
+                    break
+        else:
+            # Heuristic to find output pin (Y, Q, Z, etc)
+            for p in ['Y', 'Q', 'QN', 'Z', 'SO', 'out', 'OUT']:
+                if p in gate_pins:
+                    out_net = gate_pins[p]
+                    # Prefer Q over QN if both exist, but take what we can get
+                    if p == 'Q': break 
                 
         if out_net:
-            obs_nets.append(out_net)
+            outputs.append((gate_id, out_net))
+    return outputs
+
+
+def find_observation_nets(analyzer, max_distance=None, min_propagation=None):
+    """Sorted nets to observe so that every failing instance is covered."""
+    if max_distance is None: max_distance = OBS_DISTANCE
+    outputs = _failing_outputs(analyzer)
+    if not max_distance:
+        # Sort to ensure deterministic TCL generation
+        return sorted(set(net for _, net in outputs))
+
+    graph = analyzer.graph
+    index = FanoutIndex(graph, max_distance, min_propagation)
+    covers = defaultdict(set)   # candidate net -> failing instances (indexes into outputs)
+    for k, (gate_id, out_net) in enumerate(outputs):
+        covers[out_net].add(k)
+        for node in index.reach(gate_id):
+            net = graph.inst_out[node]
+            if graph.net_port[net] != PORT_OUT:     # Primary outputs are observed already
+                covers[graph.net_name(net)].add(k)
+    return sorted(_set_cover(covers, len(outputs)))
+
+
+def _set_cover(covers, count):
+    """Greedy (lazy) set cover; ties go to the smaller net name."""
+    heap = [(-len(ks), net, 0) for net, ks in covers.items()]
+    heapq.heapify(heap)
+    covered = set()
+    chosen = []
+    while heap and len(covered) < count:
+        neg, net, stamp = heapq.heappop(heap)
+        if stamp == len(chosen):
+            if -neg == 0:
+                break
+            chosen.append(net)
+            covered |= covers[net]
+            continue
+        heapq.heappush(heap, (-len(covers[net] - covered), net, len(chosen)))
+    return chosen
+
+
+# ==========================================
+# PART 3: XOR COMPACTION TREES
+# ==========================================
+# The observed nets are split into contiguous groups, one balanced XOR
+# tree per TEST_OBSERVE port. With MAX_XOR_DEPTH set, a tree takes at
+# most 2**depth nets; if the ports cannot hold them all at that depth,
+# the depth limit wins and more ports are created.
+
+def xor_tree(obs_nets, tree=None):
+    """
+    Pairwise XOR compaction of obs_nets, one layer at a time.
+    Returns ([[(inst, net_a, net_b, net_out), ...] per layer], root net).
+    `tree` numbers the names when there are several trees.
+    """
+    tag = "" if tree is None else str(tree)
+    layers = []
+    current_layer = obs_nets
+    layer_num = 0
+    gate_num = 0
+    
+    # Loop until we have compressed everything to 1 wire
+    while len(current_layer) > 1:
+        layer_num += 1
+        next_layer = []
+        gates = []
+        
+        for i in range(0, len(current_layer), 2):
+            if i+1 < len(current_layer):
+                gate_num += 1
+                inst = "U_OBS{}_XOR_{}_{}".format(tag, layer_num, gate_num)
+                net_out = "n_obs{}_{}_{}".format(tag, layer_num, gate_num)
+                gates.append((inst, current_layer[i], current_layer[i+1], net_out))
+                next_layer.append(net_out)
+            else:
+                # Odd number of signals; pass this one to the next layer
+                next_layer.append(current_layer[i])
+        layers.append(gates)
+        current_layer = next_layer
+    return layers, (current_layer[0] if current_layer else None)
 
-    # Sort to ensure deterministic TCL generation
-    obs_nets = sorted(list(set(obs_nets)))
-    print "    - Found {} points to observe.".format(len(obs_nets))
+
+def observation_trees(obs_nets, obs_port=None, num_ports=None, max_depth=None):
+    """[(port, layers, root)] with obs_nets spread over balanced XOR trees."""
+    if obs_port is None: obs_port = OBS_PORT_NAME
+    if num_ports is None: num_ports = OBS_PORTS
+    if max_depth is None: max_depth = MAX_XOR_DEPTH
+    trees = max(1, min(num_ports, len(obs_nets)))
+    if max_depth is not None:
+        needed = -(-len(obs_nets) // (1 << max_depth))
+        trees = max(trees, needed)
+    if trees == 1:
+        layers, root = xor_tree(obs_nets)
+        return [(obs_port, layers, root)]
+    result = []
+    size, extra = divmod(len(obs_nets), trees)
+    start = 0
+    for t in range(trees):
+        end = start + size + (1 if t < extra else 0)
+        layers, root = xor_tree(obs_nets[start:end], t)
+        result.append(("{}_{}".format(obs_port, t), layers, root))
+        start = end
+    return result
+
+
+# ==========================================
+# PART 4: GENERATE XOR TREE TCL
+# ==========================================
+def generate_xor_tcl(analyzer, filename, obs_port=None, mode=None, chunk_size=None,
+                     num_ports=None, max_depth=None, max_distance=None):
+    """Returns the observed nets."""
+    if obs_port is None: obs_port = OBS_PORT_NAME
+    if mode is None: mode = tcl_emit.TCL_MODE
+    print("[*] Generating XOR Observation Logic: {}...".format(filename))
+    
+    with instrument.phase("find_observation_nets", faults=len(analyzer.faults)):
+        obs_nets = find_observation_nets(analyzer, max_distance)
+    print("    - Found {} points to observe.".format(len(obs_nets)))
 
     if len(obs_nets) == 0:
-        print "WARNING: No observation points found. Check your failure report format."
-        return
+        print("WARNING: No observation points found. Check your failure report format.")
+        return obs_nets
 
-    with open(filename, 'w') as f:
-        f.write("# Phase 3: Observation XOR Tree\n")
+    trees = observation_trees(obs_nets, obs_port, num_ports, max_depth)
+    with instrument.phase("write_tcl", stage=3), open(filename, 'w') as f:
+        tcl = tcl_emit.TclScript(f)
+        tcl.write("# Phase 3: Observation XOR Tree\n")
         # Note: Generic wildcards might pick up XOR3/XOR4, so we specify XOR2*
-        f.write("set LIB_XOR [get_lib_cells */XOR2*]\n")
-        f.write("create_port -direction out {}\n".format(OBS_PORT_NAME))
+        tcl.cmd("set LIB_XOR [get_lib_cells */XOR2*]")
+        for port, _, _ in trees:
+            tcl.cmd("create_port -direction out {}".format(port))
+        if mode == "bulk":
+            tcl.cmd("set XOR_REF [index_collection $LIB_XOR 0]")
         
-        current_layer = obs_nets
-        layer_num = 0
-        gate_num = 0
+        for port, layers, root in trees:
+            if len(trees) > 1:
+                tcl.write("\n# === Tree {}: {} XOR layers ===\n".format(port, len(layers)))
+            if mode == "bulk":
+                _write_bulk_tree(tcl, layers, chunk_size or tcl_emit.CHUNK_SIZE)
+            else:
+                _write_tree(tcl, layers)
+                
+            if root:
+                tcl.write("\n# --- Final Connect ---\n")
+                tcl.cmd("connect_net {} {}".format(root, port))
+    print("    - {} XOR tree(s), depth {}.".format(len(trees), max(len(layers) for _, layers, _ in trees)))
+    if len(trees) > max(1, num_ports or OBS_PORTS):
+        print("    - NOTE: XOR depth limit needs {} observe ports.".format(len(trees)))
+    tcl.report()
+    return obs_nets
+
+
+def _write_tree(tcl, layers):
+    for layer_num, gates in enumerate(layers, 1):
+        tcl.write("\n# --- Layer {} ---\n".format(layer_num))
         
-        # Loop until we have compressed everything to 1 wire
-        while len(current_layer) > 1:
-            layer_num += 1
-            next_layer = []
-            f.write("\n# --- Layer {} ---\n".format(layer_num))
-            
-            for i in range(0, len(current_layer), 2):
-                if i+1 < len(current_layer):
-                    gate_num += 1
-                    inst = "U_OBS_XOR_{}_{}".format(layer_num, gate_num)
-                    net_out = "n_obs_{}_{}".format(layer_num, gate_num)
-                    
-                    net_a = current_layer[i]
-                    net_b = current_layer[i+1]
-                    
-                    # Create the XOR gate
-                    f.write("create_cell {} [index_collection $LIB_XOR 0]\n".format(inst))
-                    f.write("create_net {}\n".format(net_out))
-                    
-                    # Connect using YOUR library specific pins (A1, A2, Y)
-                    f.write("connect_net {} {}/{}\n".format(net_a, inst, PIN_IN1))
-                    f.write("connect_net {} {}/{}\n".format(net_b, inst, PIN_IN2))
-                    f.write("connect_net {} {}/{}\n".format(net_out, inst, PIN_OUT))
-                    
-                    next_layer.append(net_out)
-                else:
-                    # Odd number of signals; pass this one to the next layer
-                    next_layer.append(current_layer[i])
-            current_layer = next_layer
+        for inst, net_a, net_b, net_out in gates:
+            # Create the XOR gate
+            tcl.cmd("create_cell {} [index_collection $LIB_XOR 0]".format(inst))
+            tcl.cmd("create_net {}".format(net_out))
             
-        if current_layer:
-            f.write("\n# --- Final Connect ---\n")
-            f.write("connect_net {} {}\n".format(current_layer[0], OBS_PORT_NAME))
+            # Connect using YOUR library specific pins (A1, A2, Y)
+            tcl.cmd("connect_net {} {}/{}".format(net_a, inst, PIN_IN1))
+            tcl.cmd("connect_net {} {}/{}".format(net_b, inst, PIN_IN2))
+            tcl.cmd("connect_net {} {}/{}".format(net_out, inst, PIN_OUT))
+
+
+def _write_bulk_tree(tcl, layers, chunk_size):
+    # Layers are emitted in order, so every net a chunk reads already exists
+    gates = [gate for layer in layers for gate in layer]
+    body = ["connect_net $a $cell/{}".format(PIN_IN1),
+            "connect_net $b $cell/{}".format(PIN_IN2),
+            "connect_net $out $cell/{}".format(PIN_OUT)]
+    for part, rows in enumerate(tcl_emit.chunks(gates, chunk_size), 1):
+        tcl.write("\n# --- Chunk {}: {} XOR gates ---\n".format(part, len(rows)))
+        tcl.set_list("obs_rows", [item for row in rows for item in row], 4)
+        tcl.set_list("obs_cells", [row[0] for row in rows], 8)
+        tcl.set_list("obs_nets", [row[3] for row in rows], 8)
+        tcl.cmd("create_cell $obs_cells $XOR_REF")
+        tcl.cmd("create_net $obs_nets")
+        tcl.foreach(("cell", "a", "b", "out"), "obs_rows", body, len(rows))
 
 if __name__ == "__main__":
     analyzer = CircuitAnalyzer()
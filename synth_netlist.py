@@ -0,0 +1,141 @@
+import argparse
+import gzip
+import io
+import random
+import sys
+import time
+
+# ==========================================
+# SYNTHETIC GATE-LEVEL NETLIST + FAULT REPORT
+# ==========================================
+# Writes a flat, DC-style gate-level netlist with SAED cell and pin names
+# (A/A1..A4/S0 -> Y, D/CLK -> Q) and a matching TetraMAX fault list, for
+# scaling runs far beyond the shipped RTL examples.
+#
+#   python synth_netlist.py synth_1m.v 1000000 --ff-rate 0.1 --reconvergence 0.8
+#
+# Instance i drives net n<i>. Each input pin picks a driver from the last
+# WINDOW nets with probability `reconvergence` (local fanout that meets
+# again downstream), otherwise from anywhere before it, so the result is
+# acyclic through combinational logic. Net names are derived from IDs, so
+# memory stays flat even at millions of instances.
+
+WINDOW      = 300
+NUM_INPUTS  = 64
+NUM_OUTPUTS = 32
+FF_RATE     = 0.10
+RECONVERGENCE = 0.80
+FAULT_RATE  = 0.05      # Share of combinational gates with faults in the report
+EQUIV_RATE  = 0.30      # Share of primary faults followed by a "--" equivalent
+SEED        = 1
+
+COMB_CELLS = (
+    ("NAND2X0_LVT", ("A1", "A2")),
+    ("AND2X1_LVT",  ("A1", "A2")),
+    ("OR2X1_LVT",   ("A1", "A2")),
+    ("NOR2X0_LVT",  ("A1", "A2")),
+    ("XOR2X1_LVT",  ("A1", "A2")),
+    ("INVX0_LVT",   ("A",)),
+    ("AO22X1_LVT",  ("A1", "A2", "A3", "A4")),
+    ("OAI21X1_LVT", ("A1", "A2", "A3")),
+    ("MUX21X1_LVT", ("A1", "A2", "S0")),
+)
+FF_CELL = "DFFX1_LVT"
+# Undetected classes only, as in a stage 1/2 failure report
+FAULT_CLASSES = ("ND", "AU", "AN", "NO", "UD")
+
+
+def _open_out(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', encoding='latin-1')
+    return io.open(filename, 'w', encoding='latin-1')
+
+
+def generate(netlist, report, num_insts, ff_rate=FF_RATE, reconvergence=RECONVERGENCE,
+             fault_rate=FAULT_RATE, window=WINDOW, seed=SEED):
+    """Writes both files in one pass. Returns (instances, faults written)."""
+    rng = random.Random(seed)
+    rand, randrange = rng.random, rng.randrange
+    inputs = ["pi{}".format(i) for i in range(NUM_INPUTS)]
+
+    def net(idx):
+        return inputs[idx] if idx < NUM_INPUTS else "n{}".format(idx - NUM_INPUTS)
+
+    faults = 0
+    with _open_out(netlist) as nf, _open_out(report) as rf:
+        outputs = ["po{}".format(i) for i in range(NUM_OUTPUTS)]
+        nf.write("module top ( clk, {}, {} );\n".format(", ".join(inputs), ", ".join(outputs)))
+        nf.write("  input clk;\n")
+        for name in inputs:
+            nf.write("  input {};\n".format(name))
+        for name in outputs:
+            nf.write("  output {};\n".format(name))
+
+        lines, rlines = [], []
+        for i in range(num_insts):
+            avail = NUM_INPUTS + i
+            low = max(0, avail - window)
+            if rand() < ff_rate:
+                d = randrange(low, avail)
+                lines.append("  {} \\r_reg[{}]  ( .D({}), .CLK(clk), .Q(n{}) );\n".format(FF_CELL, i, net(d), i))
+            else:
+                cell, pins = COMB_CELLS[randrange(len(COMB_CELLS))]
+                conns = []
+                for pin in pins:
+                    src = randrange(low, avail) if rand() < reconvergence else randrange(avail)
+                    conns.append(".{}({})".format(pin, net(src)))
+                lines.append("  {} U{} ( {}, .Y(n{}) );\n".format(cell, i, ", ".join(conns), i))
+                if rand() < fault_rate:
+                    pin = "Y" if rand() < 0.5 else pins[randrange(len(pins))]
+                    rlines.append(" sa{}   {}   U{}/{}\n".format(randrange(2), FAULT_CLASSES[randrange(len(FAULT_CLASSES))], i, pin))
+                    faults += 1
+                    if rand() < EQUIV_RATE:
+                        rlines.append(" sa{}   --   U{}/{}\n".format(randrange(2), i, pins[0]))
+            if len(lines) >= 10000:
+                nf.write("".join(lines))
+                rf.write("".join(rlines))
+                lines, rlines = [], []
+        nf.write("".join(lines))
+        rf.write("".join(rlines))
+
+        # Primary outputs observe the last nets
+        for k, name in enumerate(outputs):
+            nf.write("  assign {} = n{};\n".format(name, max(0, num_insts - 1 - k)))
+        nf.write("endmodule\n")
+    return num_insts, faults
+
+
+def default_report(netlist):
+    base = netlist[:-3] if netlist.endswith('.gz') else netlist
+    if base.endswith('.v'):
+        base = base[:-2]
+    return base + ".rpt"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Write a synthetic SAED-style netlist and TetraMAX fault list.")
+    parser.add_argument("netlist", help="Output netlist (.v or .v.gz)")
+    parser.add_argument("instances", type=int, help="Number of cell instances")
+    parser.add_argument("--report", default=None, help="Output fault report (default: <netlist>.rpt)")
+    parser.add_argument("--ff-rate", type=float, default=FF_RATE, help="Share of flip-flops")
+    parser.add_argument("--reconvergence", type=float, default=RECONVERGENCE,
+                        help="Probability an input is driven from the last --window nets")
+    parser.add_argument("--window", type=int, default=WINDOW)
+    parser.add_argument("--fault-rate", type=float, default=FAULT_RATE, help="Share of gates with a reported fault")
+    parser.add_argument("--seed", type=int, default=SEED)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = args.report or default_report(args.netlist)
+    print("[*] Writing {} instances: {} + {}...".format(args.instances, args.netlist, report))
+    start = time.time()
+    insts, faults = generate(args.netlist, report, args.instances, args.ff_rate, args.reconvergence,
+                             args.fault_rate, args.window, args.seed)
+    print("    - {} instances, {} faults ({:.1f} s).".format(insts, faults, time.time() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
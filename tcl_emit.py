@@ -0,0 +1,68 @@
+import instrument
+
+# ==========================================
+# TCL SCRIPT EMISSION
+# ==========================================
+# All three stage generators write through a TclScript, which counts the
+# commands it emits so the two emission modes can be compared:
+#
+#   per-pin : one create_cell / create_net / connect_net line per pin
+#             (the original scripts, kept byte for byte)
+#   bulk    : library cells resolved once; each chunk of insertions is
+#             one create_cell and one create_net over list variables,
+#             plus a foreach loop for the per-instance rewiring
+#
+# In bulk mode dc_shell parses a handful of commands per chunk instead
+# of several per insertion, and Tcl compiles each loop body once.
+
+TCL_MODE   = "per-pin"   # "per-pin" | "bulk"
+CHUNK_SIZE = 500         # Insertions per list variable / foreach in bulk mode
+TCL_MODES  = ("per-pin", "bulk")
+
+
+def chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def tcl_word(text):
+    """Brace-quotes a name so [] and \\ in escaped identifiers stay literal."""
+    return "{" + text + "}"
+
+
+class TclScript:
+    def __init__(self, f):
+        self.f = f
+        self.commands = 0   # Commands in the file (what dc_shell parses)
+        self.executed = 0   # Commands run, loop bodies counted per iteration
+
+    def write(self, text):
+        """Comments and blank lines; not counted."""
+        self.f.write(text)
+
+    def cmd(self, line):
+        self.f.write(line + "\n")
+        self.commands += 1
+        self.executed += 1
+
+    def set_list(self, var, items, per_line=1):
+        """set var { ... } with `per_line` brace-quoted items on each line."""
+        self.f.write("set {} {{\n".format(var))
+        for row in chunks(items, per_line):
+            self.f.write("    " + " ".join(tcl_word(item) for item in row) + "\n")
+        self.f.write("}\n")
+        self.commands += 1
+        self.executed += 1
+
+    def foreach(self, names, var, body, iterations):
+        self.f.write("foreach {{{}}} ${} {{\n".format(" ".join(names), var))
+        for line in body:
+            self.f.write("    " + line + "\n")
+        self.f.write("}\n")
+        self.commands += 1
+        self.executed += 1 + len(body) * iterations
+
+    def report(self):
+        print("    - Emitted {} TCL commands ({} executed).".format(self.commands, self.executed))
+        instrument.count("tcl_commands", self.commands)
+        instrument.count("tcl_commands_executed", self.executed)
@@ -0,0 +1,293 @@
+import argparse
+import os
+import sys
+import time
+
+import instrument
+import liberty
+import partial_scan
+import stage_1
+import stage_2
+import stage_3
+import tcl_emit
+from eco import EcoSession
+from graph_cache import CACHE_DIR, load_graph
+from hierarchy import load_hierarchy
+from netlist_writer import verify_netlist, write_netlist
+
+# ==========================================
+# UNIFIED STAGE 1 -> 2 -> 3 DRIVER
+# ==========================================
+# Runs all three stages in one process. Each netlist and each fault
+# report is read once and shared: stage 2 and stage 3 analyze the same
+# in-memory graph and the same parsed stage 2 fault list.
+#
+#   python tpi_pipeline.py --netlist b10.v --stage1-report stage1_failures.rpt \
+#       --post-tpi-netlist test_scan_b10_tpi.v --stage2-report stage2_failures.rpt
+#
+# With eco=True each stage's insertions are also applied to the stage 1
+# graph (see eco.py), and stages 2/3 analyze that edited graph instead
+# of waiting for dc_shell to write the post-TPI netlist. write_netlist()
+# then streams the stage 1 netlist out with all edits applied.
+#
+# --liberty indexes a .lib (cached next to the parsed netlists) before
+# anything is parsed, so every stage takes pin directions, sequential
+# cells and cell functions from the library instead of name rules.
+#
+# The "scan" stage (--stages 1,2,3,scan) selects partial-scan flip-flops
+# on the same graph as stages 2/3 (see partial_scan.py).
+#
+# --hierarchical reads the netlists as module hierarchies (hierarchy.py)
+# and flattens only what each stage analyzes: stage 1 the module
+# instances its victims' fanin cones reach, stages 2/3 the module
+# instances holding the stage 2 faults. The partial-scan stage still
+# needs the whole design.
+
+
+class Pipeline:
+    def __init__(self, cache_dir=CACHE_DIR, out_dir=".", eco=False, tcl_mode=None, tcl_chunk=None,
+                 hierarchical=False):
+        self.cache_dir = cache_dir
+        self.out_dir = out_dir
+        self.tcl_mode = tcl_mode    # None: tcl_emit.TCL_MODE
+        self.tcl_chunk = tcl_chunk
+        self.eco = None     # EcoSession on the stage 1 graph when eco=True
+        self.use_eco = eco
+        self.hierarchical = hierarchical
+        self.hierarchies = {}  # {netlist path: hierarchy.Hierarchy} when hierarchical
+        self.graphs = {}    # {netlist path or (netlist, report) region: CompactGraph}
+        self.faults = {}    # {report path: [{'inst', 'pin', 'type'}, ...]}
+        self.artifacts = {}
+
+    # ---------------------------------------------------------
+    # Shared inputs (loaded once)
+    # ---------------------------------------------------------
+    def graph(self, netlist):
+        if netlist not in self.graphs and self.hierarchical:
+            print("[*] Elaborating the whole design of {}...".format(netlist))
+            self.graphs[netlist] = self.hierarchy(netlist).elaborate()
+        if netlist not in self.graphs:
+            print("[*] Loading Netlist: {}...".format(netlist))
+            graph = load_graph(netlist, self.cache_dir)
+            source = "cache" if graph.cache_hit else "parse"
+            print("    - {} instances ({:.0f} ms, {}).".format(graph.num_insts, graph.load_time * 1000, source))
+            self.graphs[netlist] = graph
+        return self.graphs[netlist]
+
+    def hierarchy(self, netlist):
+        if netlist not in self.hierarchies:
+            self.hierarchies[netlist] = load_hierarchy(netlist)
+        return self.hierarchies[netlist]
+
+    def region(self, netlist, report, seeds, cones=True):
+        """Graph of the part of hierarchical `netlist` that `report`'s instances reach."""
+        key = (netlist, report)
+        if key not in self.graphs:
+            print("[*] Elaborating {} region of {}...".format("fault-cone" if cones else "fault", netlist))
+            self.graphs[key] = self.hierarchy(netlist).region(seeds, cones)
+        return self.graphs[key]
+
+    def stage2_faults(self, report):
+        if report not in self.faults:
+            analyzer = stage_2.CircuitAnalyzer()
+            analyzer.parse_failures(report)
+            self.faults[report] = analyzer.faults
+        return self.faults[report]
+
+    def _output(self, filename):
+        return os.path.join(self.out_dir, filename)
+
+    # ---------------------------------------------------------
+    # Stages
+    # ---------------------------------------------------------
+    def run_stage1(self, netlist, report, elbow_threshold=None, max_area_budget=None,
+                   output=stage_1.OUTPUT_TCL, scoring=None, selection=None, frames=None, exclude=()):
+        victims = stage_1.parse_tetramax_failures(report)
+        if not victims:
+            print("Error: No victims found.")
+            return []
+        graph = self.region(netlist, report, victims) if self.hierarchical else self.graph(netlist)
+        if self.use_eco:
+            self.eco = EcoSession(graph)
+        circuit = stage_1.CircuitGraph(graph, self.eco)
+        selected = stage_1.run_weighted_analysis(circuit, victims, elbow_threshold, max_area_budget, scoring,
+                                                 selection, frames, exclude)
+        path = self._output(output)
+        stage_1.generate_tcl_script(selected, circuit, path, self.tcl_mode, self.tcl_chunk)
+        self.artifacts['stage1'] = path
+        if self.eco is not None:
+            affected = self.eco.insert_inversion_points(selected)
+            print("    - ECO: applied {} inversion points ({} victim cones affected).".format(len(selected), affected))
+        return selected
+
+    def _analysis_graph(self, netlist, report=None):
+        """The ECO-edited stage 1 graph if there is one, else `netlist` (its `report` region if hierarchical)."""
+        if self.eco is not None:
+            return self.eco.graph
+        if self.hierarchical and report is not None:
+            seeds = [f['inst'] for f in self.stage2_faults(report)]
+            return self.region(netlist, report, seeds, cones=False)
+        return self.graph(netlist)
+
+    def run_stage2(self, netlist, report, output=stage_2.OUTPUT_TCL, test_port=None):
+        analyzer = stage_2.CircuitAnalyzer(self._analysis_graph(netlist, report))
+        analyzer.faults = self.stage2_faults(report)
+        fixes = stage_2.find_traps(analyzer, self.eco.gate_traps if self.eco is not None else None)
+        if not fixes:
+            print("No atomic candidates found.")
+            return fixes
+        path = self._output(output)
+        stage_2.generate_tcl(fixes, path, test_port, self.tcl_mode, self.tcl_chunk)
+        self.artifacts['stage2'] = path
+        if self.eco is not None:
+            affected = self.eco.insert_atomic_fixes(fixes, test_port or stage_2.TEST_PORT_NAME)
+            print("    - ECO: applied {} forcing gates ({} victim cones affected).".format(len(fixes), affected))
+        return fixes
+
+    def run_stage3(self, netlist, report, output=stage_3.OUTPUT_TCL, obs_port=None, num_ports=None,
+                   max_depth=None, max_distance=None):
+        analyzer = stage_3.CircuitAnalyzer(self._analysis_graph(netlist, report))
+        analyzer.faults = [f['inst'] for f in self.stage2_faults(report)]
+        path = self._output(output)
+        obs_nets = stage_3.generate_xor_tcl(analyzer, path, obs_port, self.tcl_mode, self.tcl_chunk,
+                                            num_ports, max_depth, max_distance)
+        if os.path.exists(path):
+            self.artifacts['stage3'] = path
+        if self.eco is not None and obs_nets:
+            self.eco.insert_observation_tree(obs_nets, obs_port or stage_3.OBS_PORT_NAME, num_ports, max_depth)
+            print("    - ECO: applied observation tree over {} nets.".format(len(obs_nets)))
+
+    def run_partial_scan(self, netlist, output=partial_scan.OUTPUT_TCL, max_depth=None):
+        graph = self._analysis_graph(netlist)
+        selected, stats = partial_scan.select_scan_flops(graph, max_depth)
+        path = self._output(output)
+        partial_scan.generate_scan_tcl(graph, selected, path, stats, self.tcl_mode, self.tcl_chunk)
+        self.artifacts['scan'] = path
+        return selected
+
+    def write_netlist(self, netlist, output, verify=False):
+        """Writes `netlist` with the ECO edits of all stages run so far applied."""
+        if self.eco is None:
+            print("Error: no ECO session; run stage 1 with eco=True first.")
+            return False
+        if self.hierarchical:
+            print("Error: --write-netlist needs a flat netlist; hierarchical runs only emit TCL.")
+            return False
+        unapplied = write_netlist(netlist, self.eco, output)
+        self.artifacts['netlist'] = output
+        if verify:
+            problems = verify_netlist(output, self.eco.graph)
+            for problem in problems[:10]:
+                print("    - {}".format(problem))
+            return not unapplied and not problems
+        return not unapplied
+
+
+# ==========================================
+# CLI
+# ==========================================
+def build_parser():
+    parser = argparse.ArgumentParser(description="ATPG-guided hybrid DFT: run stages 1-3 in one process.")
+    parser.add_argument("--stages", default="1,2,3", help="Comma-separated stages to run: 1, 2, 3, scan (default: 1,2,3)")
+    parser.add_argument("--netlist", default=stage_1.NETLIST_FILE, help="Stage 1 netlist")
+    parser.add_argument("--stage1-report", default=stage_1.REPORT_FILE, help="Stage 1 TetraMAX fault report")
+    parser.add_argument("--post-tpi-netlist", default=None,
+                        help="Netlist for stages 2/3 (default: stage_2.NETLIST_FILE; pass --netlist's path to share it)")
+    parser.add_argument("--stage2-report", default=stage_2.FAULT_REPORT, help="Fault report for stages 2/3")
+
+    parser.add_argument("--elbow", type=float, default=stage_1.ELBOW_THRESHOLD, help="Stage 1 elbow threshold")
+    parser.add_argument("--budget", type=int, default=stage_1.MAX_AREA_BUDGET, help="Stage 1 max test points")
+    parser.add_argument("--scoring", choices=("distance", "cop"), default=stage_1.SCORING_MODE,
+                        help="Stage 1 node scoring (default: {})".format(stage_1.SCORING_MODE))
+    parser.add_argument("--selection", choices=("rank", "celf"), default=stage_1.SELECTION_MODE,
+                        help="Stage 1 selection: score order or lazy-greedy coverage (default: {})".format(stage_1.SELECTION_MODE))
+    parser.add_argument("--frames", type=int, default=stage_1.SEQ_FRAMES,
+                        help="Stage 1 time frames traced back through registers (default: {})".format(stage_1.SEQ_FRAMES))
+    parser.add_argument("--exclude", default=None, metavar="NODES",
+                        help="Stage 1 nodes never to pick, comma-separated (existing TPI_XOR_* points are always skipped)")
+    parser.add_argument("--test-port", default=stage_2.TEST_PORT_NAME, help="Stage 2 test enable port")
+    parser.add_argument("--obs-port", default=stage_3.OBS_PORT_NAME, help="Stage 3 observe port")
+    parser.add_argument("--obs-ports", type=int, default=stage_3.OBS_PORTS,
+                        help="Stage 3 observe ports, one balanced XOR tree each (named <obs-port>_<i> if > 1)")
+    parser.add_argument("--max-xor-depth", type=int, default=stage_3.MAX_XOR_DEPTH,
+                        help="Stage 3 XOR levels per tree; more ports are added if needed")
+    parser.add_argument("--obs-distance", type=int, default=stage_3.OBS_DISTANCE,
+                        help="Stage 3 max gates between a failing instance and its observed net (0: own output)")
+    parser.add_argument("--max-seq-depth", type=int, default=partial_scan.MAX_SEQ_DEPTH,
+                        help="Partial scan: max unscanned flip-flops on a path, 0 breaks loops only")
+
+    parser.add_argument("--out-dir", default=".", help="Directory for generated TCL")
+    parser.add_argument("--stage1-tcl", default=stage_1.OUTPUT_TCL)
+    parser.add_argument("--stage2-tcl", default=stage_2.OUTPUT_TCL)
+    parser.add_argument("--stage3-tcl", default=stage_3.OUTPUT_TCL)
+    parser.add_argument("--scan-tcl", default=partial_scan.OUTPUT_TCL)
+    parser.add_argument("--tcl-mode", choices=tcl_emit.TCL_MODES, default=tcl_emit.TCL_MODE,
+                        help="per-pin commands or bulk list/foreach scripts (default: {})".format(tcl_emit.TCL_MODE))
+    parser.add_argument("--tcl-chunk", type=int, default=tcl_emit.CHUNK_SIZE,
+                        help="Insertions per list/foreach chunk in bulk mode")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Parsed-netlist cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Always parse netlists")
+    parser.add_argument("--liberty", default=liberty.LIBERTY_FILE, metavar="LIB",
+                        help="Liberty library (.lib/.lib.gz) for pin directions and cell functions")
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Read netlists as module hierarchies and elaborate only the fault regions")
+    parser.add_argument("--eco", action="store_true",
+                        help="Apply each stage's insertions in memory; stages 2/3 then analyze the edited stage 1 "
+                             "graph instead of --post-tpi-netlist")
+    parser.add_argument("--write-netlist", default=None, metavar="PATH",
+                        help="Write --netlist with all insertions applied to PATH (implies --eco; .gz ok)")
+    parser.add_argument("--verify-netlist", action="store_true", help="Re-parse --write-netlist output and compare")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="Record per-phase timings, peak RSS and counters to PATH")
+    parser.add_argument("--profile-format", choices=("json", "chrome"), default="json",
+                        help="json summary or Chrome trace (chrome://tracing, Perfetto)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    stages = set(s.strip() for s in args.stages.split(","))
+    post_tpi = args.post_tpi_netlist or stage_2.NETLIST_FILE
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    pipeline = Pipeline(None if args.no_cache else args.cache_dir, args.out_dir,
+                        args.eco or args.write_netlist is not None, args.tcl_mode, args.tcl_chunk,
+                        args.hierarchical)
+
+    if args.profile:
+        instrument.enable()
+    start = time.time()
+    if args.liberty:
+        liberty.use_library(args.liberty, None if args.no_cache else args.cache_dir)
+    if "1" in stages:
+        with instrument.phase("stage1"):
+            pipeline.run_stage1(args.netlist, args.stage1_report, args.elbow, args.budget, args.stage1_tcl,
+                                args.scoring, args.selection, args.frames,
+                                [n for n in args.exclude.split(",") if n] if args.exclude else ())
+    if "2" in stages:
+        with instrument.phase("stage2"):
+            pipeline.run_stage2(post_tpi, args.stage2_report, args.stage2_tcl, args.test_port)
+    if "3" in stages:
+        with instrument.phase("stage3"):
+            pipeline.run_stage3(post_tpi, args.stage2_report, args.stage3_tcl, args.obs_port, args.obs_ports,
+                                args.max_xor_depth, args.obs_distance)
+    if "scan" in stages:
+        with instrument.phase("partial_scan"):
+            pipeline.run_partial_scan(post_tpi, args.scan_tcl, args.max_seq_depth)
+    written = True
+    if args.write_netlist:
+        written = pipeline.write_netlist(args.netlist, args.write_netlist, args.verify_netlist)
+
+    print("[*] Pipeline finished in {:.2f} s".format(time.time() - start))
+    for stage in sorted(pipeline.artifacts):
+        print("    - {}: {}".format(stage, pipeline.artifacts[stage]))
+    if args.profile:
+        instrument.print_summary()
+        instrument.export(args.profile, args.profile_format)
+        print("[*] Profile written to {}".format(args.profile))
+    return 0 if written else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())